@@ -97,6 +97,26 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Ranked search results, shared by the web workers and the ingestion process that
+    # invalidates them, see postings/result_cache.py
+    'results': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'data/result_cache'),
+        'TIMEOUT': 60 * 60 * 6,
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
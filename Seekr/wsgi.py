@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Seekr.settings')
 
 application = get_wsgi_application()
+
+# Load the word embeddings before the first request instead of during it
+from utils.glove import glove
+glove.warm_up()
@@ -1,5 +1,8 @@
 #!/bin/bash
 source venv/bin/activate
 python manage.py migrate
+python manage.py geocode_postings
+python manage.py convert_glove
+python manage.py build_posting_vectors
 python manage.py ingest 28
 exec gunicorn -b :5000 --access-logfile - Seekr.wsgi:application
\ No newline at end of file
@@ -5,7 +5,8 @@ WORD_EMBEDDING_LEN = 50
 
 # Education
 SCHOOL_VEC_LEN = 1
-EDUCATION_VECTOR_LEN = WORD_EMBEDDING_LEN*3 + SCHOOL_VEC_LEN + 3
+NUM_FIELD_OF_STUDY_WORDS = 3
+EDUCATION_VECTOR_LEN = WORD_EMBEDDING_LEN*NUM_FIELD_OF_STUDY_WORDS + SCHOOL_VEC_LEN + 3
 
 # Experience
 NUM_EXPERIENCE_TITLE_WORDS = 4
@@ -16,10 +17,88 @@ EXPERIENCE_VECTOR_LEN = EXPERIENCE_YEAR_VECTOR_LEN * PREV_YEARS_LOOKUP
 
 SKILLS_LEN = 132
 
+# Profile vector layout: [education, experience, skills]
+EDUCATION_VECTOR_OFFSET = 0
+EXPERIENCE_VECTOR_OFFSET = EDUCATION_VECTOR_OFFSET + EDUCATION_VECTOR_LEN
+SKILLS_VECTOR_OFFSET = EXPERIENCE_VECTOR_OFFSET + EXPERIENCE_VECTOR_LEN
+PROFILE_VECTOR_LEN = SKILLS_VECTOR_OFFSET + SKILLS_LEN
+# Bump when Profile.to_vector changes so stored ProfileVectors are recomputed
+PROFILE_VECTOR_VERSION = 2
+
+# Max number of (string, num_words) embeddings kept by the Glove LRU cache, 0 disables it
+EMBEDDING_CACHE_SIZE = 10000
+
 GLOVE_FILE = 'data/filtered.glove.6B.50d.txt'
 if settings.DEBUG:
     GLOVE_FILE = 'data/dev_word_embeddings.txt'
 
+# Memory-mapped posting vectors, see postings/vector_store.py
+POSTING_VECTOR_STORE_DIR = 'data/posting_vectors'
+# One store per projection version of the reduced posting vectors
+REDUCED_POSTING_VECTOR_STORE_DIR = 'data/posting_vectors_reduced'
+
+# Dimensions kept by `python manage.py fit_projection`
+REDUCED_VECTOR_LEN = 256
+# Score postings with their reduced vectors when a projection was fitted
+USE_REDUCED_VECTORS = False
+
+# Averaged GloVe embeddings of posting titles, see postings/titles.py
+TITLE_VECTOR_STORE_DIR = 'data/title_vectors'
+# Also match postings with titles similar to the searched one, not only sharing its words
+SEMANTIC_TITLE_SEARCH = False
+# Most similar titles added to the candidates of a search, and their minimum similarity
+SEMANTIC_TITLE_CANDIDATES = 500
+SEMANTIC_TITLE_MIN_SIMILARITY = 0.8
+
+# Days the employees of a company and title are reused by new postings before being
+# looked up again, see postings.models.CompanyTitleVector
+COMPANY_TITLE_VECTOR_TTL_DAYS = 7
+
+# Random projection LSH over posting vectors, see postings/ann.py
+ANN_NUM_TABLES = 8
+ANN_NUM_BITS = 10
+ANN_SEED = 0
+# Postings fetched from the index per requested recommendation, to survive post filters
+ANN_CANDIDATES_PER_RESULT = 5
+
+# Offline city coordinates used to geocode postings, see postings/geo.py
+GAZETTEER_FILE = 'postings/data/gazetteer.csv'
+# Side of the grid cells indexing posting locations, about 22 km of latitude
+GEO_CELL_DEGREES = 0.2
+# Postings within this distance of a searched city are returned
+GEO_SEARCH_RADIUS_KM = 30
+
+# Concurrent page fetching of ingestions, see postings/fetch.py
+FETCH_MAX_WORKERS = 8
+# Max requests in flight to the same host
+FETCH_MAX_PER_HOST = 4
+# Seconds before a request is abandoned
+FETCH_TIMEOUT = 30
+
+# `ingest --async`, see postings/async_fetch.py. Max requests in flight, and requests
+# per second and burst allowed per host.
+ASYNC_FETCH_MAX_IN_FLIGHT = 200
+ASYNC_FETCH_RATE_PER_HOST = 10
+ASYNC_FETCH_BURST_PER_HOST = 20
+
+# Worker threads of the ingestion stages, see IndeedIngestion.ingest_jobs. Every
+# vectorize worker logs in to LinkedIn with its own browser.
+INGEST_PARSE_WORKERS = 2
+INGEST_VECTORIZE_WORKERS = 1
+# Max items waiting between two ingestion stages
+INGEST_QUEUE_SIZE = 100
+# Postings written per transaction by the persist stage, a result page has 50
+INGEST_PERSIST_BATCH_SIZE = 50
+# Retries of a batch insert while the database is locked, waiting longer each time
+INGEST_PERSIST_RETRIES = 3
+INGEST_PERSIST_RETRY_SECONDS = 1
+# Ids of the postings posted in the last days are loaded at the start of an ingestion,
+# older cards are only deduplicated on insert. Indeed shows dates up to '30+ days ago'.
+INGEST_DEDUPE_DAYS = 31
+# Max result pages fetched per search in a run. A search normally stops at its
+# watermark, see postings.models.IngestionWatermark.
+INDEED_MAX_PAGES = 20
+
 HOST_URL = 'ec2-3-82-225-241.compute-1.amazonaws.com/'
 
 BASE_LINKEDIN_USER_URL = 'https://www.linkedin.com/in/'
@@ -1,10 +1,18 @@
 from django.db import models
+from django.db.models import Q
 from django.contrib.auth.models import User
-from profiles.models import Profile
-from postings.models import Posting
+from profiles.models import Profile, VectorProjection
+from postings.models import Posting, PostingToken
+from postings.ranking import PostingVectors
+from postings.ann import get_posting_ann_index
+from postings.result_cache import get_ranked_ids, set_ranked_ids
+from postings.geo import gazetteer, filter_radius
+from postings.titles import search_titles
+from constants import ANN_CANDIDATES_PER_RESULT, USE_REDUCED_VECTORS, GEO_SEARCH_RADIUS_KM, \
+    SEMANTIC_TITLE_SEARCH, SEMANTIC_TITLE_CANDIDATES
 from datetime import date, timedelta
-import numpy as np
 import logging
+import math
 
 logger = logging.getLogger('app')
 
@@ -23,76 +31,201 @@ class MessengerUser(models.Model):
     clicked_postings = models.ManyToManyField(Posting, related_name="clicks")
 
 
-    def compute_similarity(self, posting):
-        """ Computes similarity score between job posting and profile
-
-        Parameters:
-            posting (Posting): a job posting
+    def get_profile_vector(self):
+        """Returns the profile vector of today
 
         Returns:
-            cos_sim (Float): a value representing how different the user is to the existing
-                employees of the job posting, the higher the value, the it will be
-                recommended
+            np.ndarray: the vector, None if the user has no profile or it couldn't be
+                vectorized
         """
-        today = date.today()
-        my_vec = self.profile.to_vector(today)
-        posting_vec = np.loads(posting.vector)
+        if self.profile is None:
+            logger.warning("Messenger user {} has no profile".format(self.pk))
+            return None
+        try:
+            return self.profile.get_vector(date.today())
+        except Exception:
+            logger.exception("Couldn't vectorize the profile of {}".format(self.pk))
+            return None
 
-        cos_sim = np.dot(my_vec, posting_vec) \
-                / (np.linalg.norm(my_vec) * np.linalg.norm(posting_vec))
+    def get_postings(self, title, location, offset):
+        """Returns a page of 10 postings for a search, best first
 
-        return cos_sim
+        The complete ranking of a search is cached for the day, so later pages only
+        fetch their 10 postings.
 
-    def get_postings(self, title, location, offset):
-        # postings = self.filter_postings(title, location)
-        # postings.sort(key=self.compute_similarity)
-        
-        # return postings[offset*10:offset*10+10]
-        return self.rank_postings(
-            self.filter_postings(title, location)
-        )[offset*10:offset*10+10]
-
-    def filter_postings(self, title, location):
+        Parameters:
+            title (str): the job title that user seeks
+            location (str): the city at which the user seeks
+            offset (int): the page number, starting at 0
+
+        Returns:
+            List (Posting): the postings of the page
+        """
+        ranked_ids = get_ranked_ids(self.pk, self.profile_id, title, location)
+        if ranked_ids is None:
+            postings = self.filter_postings(title, location)
+            ranked_ids = self.rank_posting_ids(postings)
+            set_ranked_ids(self.pk, self.profile_id, title, location, ranked_ids,
+                postings.values_list('city', flat=True).distinct())
+
+        page_ids = ranked_ids[offset*10:offset*10+10]
+        postings_by_id = Posting.objects.in_bulk(page_ids)
+        return [postings_by_id[i] for i in page_ids if i in postings_by_id]
+
+    def filter_postings(self, title, location, semantic=SEMANTIC_TITLE_SEARCH):
         """Filters postings given title and location
 
         Parameters:
             title (str): the job title that user seeks
             location (str): the city at which the user seeks
+            semantic (bool): also keep the postings with the titles most similar to title
+                by word embeddings, not only the ones with every word of title
 
         Returns:
             base_queryset (QuerySet): a set of filtered postings by title, city and date
         """
-        # Title
-        title_words = title.split()
-        base_queryset = Posting.objects.all()
-        for word in title_words:
-            base_queryset = base_queryset.filter(title__icontains=word)
-        
         # Location
-        base_queryset = base_queryset.filter(city__icontains=location)
+        base_queryset = self.filter_location(Posting.objects.all(), location)
 
         # New jobs
         last_day = date.today() - timedelta(days=30)
         base_queryset = base_queryset.filter(date_posted__gt = last_day)
 
-        return base_queryset
+        # Title
+        by_words = PostingToken.filter_postings(base_queryset, PostingToken.TITLE, title)
+        if not semantic:
+            return by_words
+        # Similar titles are searched among the postings in the location and date range,
+        # so the most similar titles elsewhere don't take up the candidates
+        similar_ids, _ = search_titles(title, SEMANTIC_TITLE_CANDIDATES,
+            posting_ids=base_queryset.values_list('pk', flat=True).iterator())
+        if not similar_ids:
+            return by_words
+        return base_queryset.filter(Q(pk__in=by_words.values('pk')) | Q(pk__in=similar_ids))
+
+    def filter_location(self, postings, location):
+        """Filters postings to the ones near a location
+
+        Locations in the gazetteer match the postings within GEO_SEARCH_RADIUS_KM, so
+        'Toronto' also matches 'North York'. Postings that couldn't be geocoded, and
+        locations that aren't in the gazetteer, are matched by city words.
 
-    def rank_postings(self, postings):
-        has_vector = postings.filter(num_employees__gte=3)
-        no_vector = postings.exclude(num_employees__gte=3)
+        Parameters:
+            postings (QuerySet): the postings to filter
+            location (str): the city at which the user seeks
 
-        failed_vector = []
-        scores = []
-        for p in has_vector:
-            try:
-                scores.append((self.compute_similarity(p), p))
-            except:
-                logger.exception("Couldn't compute similarity for {}".format(p))
-                failed_vector.append(p)
-        scores.sort(key=lambda s: s[0], reverse=True)
+        Returns:
+            QuerySet: the filtered postings
+        """
+        place = gazetteer.parse(location) if location else None
+        if place is None:
+            return PostingToken.filter_postings(postings, PostingToken.CITY, location)
+
+        by_city = PostingToken.filter_postings(Posting.objects.all(), PostingToken.CITY,
+            location)
+        nearby = filter_radius(Posting.objects.all(), place.latitude, place.longitude,
+            GEO_SEARCH_RADIUS_KM)
+        return postings.filter(Q(pk__in=nearby.values('pk'))
+            | Q(latitude__isnull=True, pk__in=by_city.values('pk')))
+
+    def recommend_postings(self, num_results, location=None, posted_since=None):
+        """Recommends the postings most similar to the user across all postings
+
+        Candidates come from the approximate nearest neighbour index, so the whole
+        posting table isn't scored. The index holds every posting ever stored, so the
+        number of candidates is scaled by the share of the indexed postings that pass the
+        location and date filters. If that covers the whole index, or less than
+        num_results candidates pass the filters, the filtered postings are ranked exactly
+        with rank_postings instead. Without a profile vector, they are returned in the
+        unranked order of rank_posting_ids.
+
+        Parameters:
+            num_results (int): number of postings to return
+            location (str): only postings in this city if given
+            posted_since (datetime.date): only postings posted after this date if given
+
+        Returns:
+            List (Posting): the recommended postings, best first
+        """
+        my_vec = self.get_profile_vector()
+        postings = Posting.objects.all()
+        if location:
+            postings = self.filter_location(postings, location)
+        if posted_since:
+            postings = postings.filter(date_posted__gt=posted_since)
+        if my_vec is None:
+            return self.rank_postings(postings, num_results)
+
+        index = get_posting_ann_index()
+        num_matching = postings.filter(num_employees__gte=3).exclude(vector=b'').count()
+        if num_matching == 0:
+            return self.rank_postings(postings, num_results)
+        k = math.ceil(num_results * ANN_CANDIDATES_PER_RESULT
+            * max(index.num_rows, num_matching) / num_matching)
+        if k >= index.num_rows:
+            logger.info("{} of {} indexed postings pass the filters, ranking exactly"
+                .format(num_matching, index.num_rows))
+            return self.rank_postings(postings, num_results)
+
+        ranked_ids, scores = index.search(my_vec, k)
+        postings_by_id = postings.filter(pk__in=ranked_ids).in_bulk()
+        if len(postings_by_id) < num_results:
+            logger.info("{} of {} nearest postings passed the filters, ranking exactly"
+                .format(len(postings_by_id), len(ranked_ids)))
+            return self.rank_postings(postings, num_results)
+
+        return [postings_by_id[i] for i in ranked_ids if i in postings_by_id][:num_results]
+
+    def rank_postings(self, postings, num_results=None, reduced=USE_REDUCED_VECTORS):
+        """Ranks postings by similarity to the user's profile, see rank_posting_ids
+
+        Returns:
+            List (Posting): the ranked postings
+        """
+        ranked_ids = self.rank_posting_ids(postings, num_results, reduced)
+        postings_by_id = Posting.objects.in_bulk(ranked_ids)
+        return [postings_by_id[i] for i in ranked_ids]
+
+    def rank_posting_ids(self, postings, num_results=None, reduced=USE_REDUCED_VECTORS):
+        """Ranks postings by similarity to the user's profile
+
+        Postings with vectors are scored all at once, and are followed by the postings
+        without vectors, oldest first. Without a profile vector, every posting is in the
+        order of the postings without vectors.
+
+        Parameters:
+            postings (QuerySet): the postings to rank
+            num_results (int): only the best num_results postings are returned, all if None
+            reduced (bool): score with the reduced vectors of the active projection if
+                one was fitted
+
+        Returns:
+            List (str): ids of the ranked postings
+        """
+        my_vec = self.get_profile_vector()
+        if my_vec is None:
+            ranked_ids = []
+            no_vector = postings
+        else:
+            # Vectors that couldn't be decoded were cleared, see postings migration 0004
+            has_vector_q = Q(num_employees__gte=3) & ~Q(vector=b'')
+            has_vector = postings.filter(has_vector_q)
+            no_vector = postings.exclude(has_vector_q)
+
+            projection = VectorProjection.get_active() if reduced else None
+            if projection is not None:
+                my_vec = projection.project(my_vec)
+
+            candidates = PostingVectors.from_postings(has_vector, projection=projection)
+            k = len(candidates) if num_results is None else num_results
+            ranked_ids, scores = candidates.top_k(my_vec, k)
+
+        no_vector = no_vector.order_by('date_posted').values_list('id', flat=True)
+        if num_results is not None:
+            no_vector = no_vector[:max(0, num_results - len(ranked_ids))]
+        no_vector_ids = list(no_vector)
 
-        postings_with_vectors = [p[1] for p in scores]
         logger.info("Ranked {} postings with vectors, {} without vectors".format(
-            len(postings_with_vectors), len(no_vector)))
+            len(ranked_ids), len(no_vector_ids)))
             
-        return postings_with_vectors + list(no_vector.order_by('date_posted'))
\ No newline at end of file
+        return list(ranked_ids) + no_vector_ids
@@ -1,4 +1,4 @@
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
 from django.urls import reverse
 from .models import MessengerUser
 from postings.models import Posting
@@ -6,10 +6,25 @@ from .views import *
 from django.http import HttpRequest
 import json
 from pprint import pprint
+from profiles.models import Profile
+from datetime import date, timedelta
+from postings.result_cache import get_result_cache, get_city_key, invalidate_cities
+from utils.vector_encoding import encode_vector
+from constants import PROFILE_VECTOR_VERSION
+from postings.vector_store import PostingVectorStore, iter_posting_vectors
+from postings.ann import LSHIndex
+from unittest import mock
+import tempfile
+import numpy as np
 
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'results': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+})
 class MessengerUserTestCase(TestCase):
     def setUp(self):
         self.client = Client()
+        get_result_cache().clear()
 
     def add_objects(self):
         posting = Posting(pk='test', title='test', url='https://google.com')
@@ -72,4 +87,177 @@ class MessengerUserTestCase(TestCase):
         )
         data = json.loads(response.content)
         print(json.dumps(data, indent=4))
-        assert(len(data['messages'][0]['attachment']['payload']['elements']) == 1)
\ No newline at end of file
+        assert(len(data['messages'][0]['attachment']['payload']['elements']) == 1)
+
+    def test_rank_postings(self):
+        profile = Profile.objects.create(username='test-profile')
+        user = MessengerUser.objects.create(pk='test', profile=profile)
+        my_vec = np.zeros(Profile.VECTOR_LEN, dtype=np.float32)
+        my_vec[:2] = [1, 1]
+        profile.profilevector_set.create(simulation_date=date.today(),
+            version=PROFILE_VECTOR_VERSION, vector=encode_vector(my_vec))
+
+        for i, direction in enumerate([[1, 0], [1, 1], [0, 1]]):
+            vector = np.zeros(Profile.VECTOR_LEN, dtype=np.float32)
+            vector[:2] = direction
+            posting = Posting(pk='vector-{}'.format(i), num_employees=3)
+            posting.set_vector(vector)
+            posting.save()
+        Posting.objects.create(pk='old', num_employees=0, date_posted=date(2020, 1, 1))
+        Posting.objects.create(pk='new', num_employees=0)
+        # Vector cleared by the migration of pickled vectors
+        Posting.objects.create(pk='cleared', num_employees=5, date_posted=date(2020, 6, 1))
+
+        ranked = user.rank_postings(Posting.objects.all())
+        self.assertEqual([p.pk for p in ranked][0], 'vector-1')
+        self.assertEqual([p.pk for p in ranked][3:], ['old', 'cleared', 'new'])
+
+        ranked = user.rank_postings(Posting.objects.all(), num_results=4)
+        self.assertEqual([p.pk for p in ranked][3:], ['old'])
+        self.assertEqual(len(user.rank_postings(Posting.objects.all(), num_results=1)), 1)
+
+    def test_rank_postings_without_profile(self):
+        user = MessengerUser.objects.create(pk='test')
+        posting = Posting(pk='vector', num_employees=3, city='Toronto')
+        posting.set_vector(np.ones(Profile.VECTOR_LEN, dtype=np.float32))
+        posting.save()
+        Posting.objects.create(pk='old', num_employees=0, date_posted=date(2020, 1, 1))
+
+        self.assertEqual(user.rank_posting_ids(Posting.objects.all()), ['old', 'vector'])
+        self.assertEqual([p.pk for p in user.recommend_postings(10, location='Toronto')],
+            ['vector'])
+        response = self.client.post('/messenger_users/recommend',
+            content_type='application/json',
+            data={'messenger_id': 'test', 'location': '', 'page': '0'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_recommend_postings_fallback(self):
+        profile = Profile.objects.create(username='test-profile')
+        user = MessengerUser.objects.create(pk='test', profile=profile)
+        profile.profilevector_set.create(simulation_date=date.today(),
+            version=PROFILE_VECTOR_VERSION,
+            vector=encode_vector(np.ones(Profile.VECTOR_LEN, dtype=np.float32)))
+        for i in range(12):
+            posting = Posting(pk='p{}'.format(i), city='Toronto', num_employees=3)
+            posting.set_vector(np.full(Profile.VECTOR_LEN, i + 1, dtype=np.float32))
+            posting.save()
+
+        # None of the postings are in the nearest neighbour index
+        with mock.patch('messenger_users.models.get_posting_ann_index') as get_index:
+            get_index.return_value.num_rows = 100
+            get_index.return_value.search.return_value = (['elsewhere'], np.ones(1))
+            recommended = user.recommend_postings(2, location='Toronto')
+        self.assertEqual(len(recommended), 2)
+
+    def test_recommend_postings_stale_index(self):
+        profile = Profile.objects.create(username='test-profile')
+        user = MessengerUser.objects.create(pk='test', profile=profile)
+        rng = np.random.RandomState(0)
+        profile.profilevector_set.create(simulation_date=date.today(),
+            version=PROFILE_VECTOR_VERSION,
+            vector=encode_vector(rng.standard_normal(Profile.VECTOR_LEN).astype(np.float32)))
+        vectors = rng.standard_normal((1000, Profile.VECTOR_LEN)).astype(np.float32)
+        postings = []
+        for i, vector in enumerate(vectors):
+            # Only the last 50 postings are recent
+            posting = Posting(pk='p{:04}'.format(i), num_employees=3,
+                date_posted=date.today() - timedelta(days=60 if i < 950 else 1))
+            posting.set_vector(vector)
+            postings.append(posting)
+        Posting.objects.bulk_create(postings)
+
+        with tempfile.TemporaryDirectory() as directory:
+            store = PostingVectorStore(directory)
+            store.rebuild(iter_posting_vectors(Posting.objects.all()))
+            index = LSHIndex().update(store.reload())
+            with mock.patch('messenger_users.models.get_posting_ann_index',
+                            return_value=index), \
+                    mock.patch.object(MessengerUser, 'rank_postings') as rank_postings:
+                recommended = user.recommend_postings(2,
+                    posted_since=date.today() - timedelta(days=30))
+        # Enough candidates are fetched for the recent postings to be found in the index
+        rank_postings.assert_not_called()
+        self.assertEqual(len(recommended), 2)
+        self.assertTrue(all(p.date_posted > date.today() - timedelta(days=30)
+                            for p in recommended))
+
+    def test_get_postings_cache(self):
+        profile = Profile.objects.create(username='test-profile')
+        user = MessengerUser.objects.create(pk='test', profile=profile)
+        profile.profilevector_set.create(simulation_date=date.today(),
+            version=PROFILE_VECTOR_VERSION, vector=encode_vector(np.ones(Profile.VECTOR_LEN, dtype=np.float32)))
+        for i in range(15):
+            Posting.objects.create(pk='p{:02}'.format(i), title='Software Developer',
+                city='Toronto', num_employees=0, date_posted=date.today())
+
+        first_page = [p.pk for p in user.get_postings('software  developer', 'Toronto', 0)]
+        self.assertEqual(len(first_page), 10)
+        # Later pages and equivalent searches only fetch their postings
+        with self.assertNumQueries(1):
+            second_page = [p.pk for p in user.get_postings('Software Developer', 'toronto', 1)]
+        self.assertEqual(len(second_page), 5)
+        self.assertFalse(set(first_page) & set(second_page))
+
+        Posting.objects.create(pk='p15', title='Software Developer', city='Toronto',
+            num_employees=0, date_posted=date.today())
+        self.assertEqual(len(user.get_postings('Software Developer', 'Toronto', 1)), 5)
+        invalidate_cities(['Toronto'])
+        self.assertEqual(len(user.get_postings('Software Developer', 'Toronto', 1)), 6)
+
+    def test_get_postings_cache_culled_generation(self):
+        user = MessengerUser.objects.create(pk='test')
+        self.assertEqual(user.get_postings('Developer', 'Toronto', 0), [])
+        Posting.objects.create(pk='p0', title='Developer', city='Toronto')
+        self.assertEqual(user.get_postings('Developer', 'Toronto', 0), [])
+
+        # The cache culls the generation of Toronto, it may have been invalidated since
+        get_result_cache().delete(get_city_key('Toronto'))
+        self.assertEqual(len(user.get_postings('Developer', 'Toronto', 0)), 1)
+
+    def test_get_postings_cache_gazetteer_name(self):
+        user = MessengerUser.objects.create(pk='test')
+        self.assertEqual(user.get_postings('Developer', 'montreal', 0), [])
+
+        def add_posting(pk):
+            posting = Posting(pk=pk, title='Developer', city='Montréal', state='QC',
+                country='canada', date_posted=date.today())
+            posting.geocode()
+            posting.save()
+
+        add_posting('p0')
+        # Ingestion invalidates the gazetteer name, not the searched spelling
+        invalidate_cities(['Montréal'])
+        self.assertEqual(len(user.get_postings('Developer', 'montreal', 0)), 1)
+        # Spellings of the same place share the cached results
+        add_posting('p1')
+        self.assertEqual(len(user.get_postings('Developer', 'Montreal, QC', 0)), 1)
+
+    def test_filter_location(self):
+        user = MessengerUser.objects.create(pk='test')
+        for pk, city in [('toronto', 'Toronto'), ('north-york', 'North York'),
+                         ('ottawa', 'Ottawa'), ('not-geocoded', 'Toronto')]:
+            posting = Posting(pk=pk, title='Developer', city=city, state='ON', country='canada')
+            posting.geocode()
+            posting.save()
+        Posting.objects.filter(pk='not-geocoded').update(latitude=None)
+
+        def filter_location(location):
+            return sorted(user.filter_location(Posting.objects.all(), location)
+                .values_list('id', flat=True))
+
+        self.assertEqual(filter_location('Toronto'), ['north-york', 'not-geocoded', 'toronto'])
+        self.assertEqual(filter_location('north york, ON'), ['north-york', 'toronto'])
+        self.assertEqual(filter_location(''), ['north-york', 'not-geocoded', 'ottawa', 'toronto'])
+        # Not in the gazetteer
+        self.assertEqual(filter_location('York Region'), [])
+
+    def test_recommend_jobs_without_vectors(self):
+        profile = Profile.objects.create(username='test-profile')
+        MessengerUser.objects.create(pk='test', profile=profile)
+        response = self.client.post(
+            '/messenger_users/recommend',
+            content_type='application/json',
+            data={'messenger_id': 'test', 'location': 'toronto', 'page': '0'}
+        )
+        data = json.loads(response.content)
+        self.assertIn('text', data['messages'][0])
@@ -5,6 +5,7 @@ from . import views
 urlpatterns = [
     path('create', views.create_messenger_user, name='create'),
     path('search', views.search_jobs, name='search'),
+    path('recommend', views.recommend_jobs, name='recommend'),
     path('verify_linkedin_url', views.confirm_linkedin_profile, name='verify_linkedin_url'),
     path('save_posting', views.save_posting, name='save_posting'),
     path('view_posting', views.view_posting, name='view_posting'),
@@ -12,6 +12,7 @@ from constants import *
 import logging
 from django.db import IntegrityError
 from global_variables import linkedin_scraper
+from datetime import date, timedelta
 
 
 logger = logging.getLogger('app')
@@ -339,7 +340,46 @@ def search_jobs(request):
     user = MessengerUser.objects.get(pk=messenger_id)
     postings = user.get_postings(title, location, offset)
 
+    next_page = QuickReply("Next Page", block_name="JobSearch")
+    next_page.set_attribute("result_page", str(offset+1))
+    response = get_postings_response(messenger_id, postings, next_page)
+    response_dict = response.to_dict()
+    logger.info('Response: ' + json.dumps(response_dict, sort_keys=True))
+    return JsonResponse(response_dict)
+
+def recommend_jobs(request):
+    """Recommends the postings most similar to the user's profile across all postings
+
+    Returns:
+        JsonResponse: A gallery of recommended postings
+    """
+    data = json.loads(request.body)
+    logger.info(json.dumps(data, indent=4, sort_keys=True))
+
+    messenger_id = data['messenger_id']
+    location = data.get('location')
+    offset = int(data.get('page', 0))
 
+    user = MessengerUser.objects.get(pk=messenger_id)
+    last_day = date.today() - timedelta(days=30)
+    postings = user.recommend_postings(offset*10+10, location=location,
+        posted_since=last_day)[offset*10:offset*10+10]
+
+    next_page = QuickReply("Next Page", block_name="JobRecommendations")
+    next_page.set_attribute("result_page", str(offset+1))
+    response = get_postings_response(messenger_id, postings, next_page)
+    response_dict = response.to_dict()
+    logger.info('Response: ' + json.dumps(response_dict, sort_keys=True))
+    return JsonResponse(response_dict)
+
+def get_postings_response(messenger_id, postings, next_page):
+    """Returns a gallery of postings with apply and save buttons
+
+    Parameters:
+        messenger_id (str): id of the user
+        postings (List (Posting)): the postings to show
+        next_page (QuickReply): quick reply to the next page of postings
+    """
     response = ChatfuelResponse(messages=[])
     if len(postings) == 0:
         response.add_message(TextMessage(
@@ -362,14 +402,10 @@ def search_jobs(request):
 
             gallery_message.add_card(gallery_card)
 
-        next_page = QuickReply("Next Page", block_name="JobSearch")
-        next_page.set_attribute("result_page", str(offset+1))
         gallery_message.add_quick_reply(next_page)
 
         response.add_message(gallery_message)
-    response_dict = response.to_dict()
-    logger.info('Response: ' + json.dumps(response_dict, sort_keys=True))
-    return JsonResponse(response_dict)
+    return response
 
 def get_posting_url(messenger_user_id, posting_id):
     return HOST_URL[:-1] + reverse('view_posting') \
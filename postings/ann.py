@@ -0,0 +1,128 @@
+from constants import ANN_NUM_TABLES, ANN_NUM_BITS, ANN_SEED
+from .ranking import top_k
+from .vector_store import get_posting_vectors
+import numpy as np
+import logging
+import threading
+
+logger = logging.getLogger('app')
+
+class LSHTables:
+    """Hash tables of an LSHIndex and the snapshot whose rows they index
+
+    Replaced as a whole on update, so a search never mixes the tables of one store
+    generation with the rows of another. Tables of the same generation are shared and
+    only appended to, rows past the snapshot are ignored.
+    """
+    def __init__(self, snapshot, planes, buckets):
+        self.snapshot = snapshot
+        self.planes = planes
+        self.buckets = buckets
+
+class LSHIndex:
+    """Random projection LSH index over the rows of a posting vector store snapshot
+
+    Each of num_tables tables hashes a vector to the signs of num_bits random
+    projections, so vectors with a high cosine similarity likely share a bucket. A
+    query only scores the rows in its buckets instead of the whole matrix.
+
+    The store is append only within a generation, so update() only hashes rows
+    appended since the last call. A new generation is hashed from scratch.
+    """
+    def __init__(self, num_tables=ANN_NUM_TABLES, num_bits=ANN_NUM_BITS, seed=ANN_SEED):
+        self.num_tables = num_tables
+        self.num_bits = num_bits
+        self.seed = seed
+        self.tables = None
+        self.lock = threading.Lock()
+
+    @property
+    def num_rows(self):
+        tables = self.tables
+        return 0 if tables is None else len(tables.snapshot)
+
+    def get_codes(self, planes, matrix):
+        """Returns the bucket of every row of matrix in every table
+
+        Returns:
+            np.ndarray: int array of shape (len(matrix), num_tables)
+        """
+        projections = np.asarray(matrix, dtype=np.float32).dot(planes.T)
+        bits = (projections > 0).reshape(len(matrix), self.num_tables, self.num_bits)
+        return bits.dot(1 << np.arange(self.num_bits))
+
+    def update(self, snapshot):
+        """Hashes the rows of snapshot that aren't indexed yet
+
+        Parameters:
+            snapshot (VectorStoreSnapshot): latest snapshot of the posting vector store
+
+        Returns:
+            LSHIndex: self
+        """
+        tables = self.tables
+        if tables is not None and snapshot is tables.snapshot:
+            return self
+
+        with self.lock:
+            tables = self.tables
+            if tables is None or snapshot.generation != tables.snapshot.generation \
+                    or snapshot.dim != tables.snapshot.dim \
+                    or len(snapshot) < len(tables.snapshot):
+                rng = np.random.RandomState(self.seed)
+                planes = rng.standard_normal(
+                    (self.num_tables * self.num_bits, snapshot.dim)).astype(np.float32)
+                buckets = [{} for _ in range(self.num_tables)]
+                num_rows = 0
+            else:
+                planes, buckets, num_rows = tables.planes, tables.buckets, len(tables.snapshot)
+
+            # Hashed in chunks to bound memory
+            for start in range(num_rows, len(snapshot), 4096):
+                codes = self.get_codes(planes, snapshot.matrix[start:start + 4096])
+                for row, row_codes in enumerate(codes, start):
+                    for table, code in zip(buckets, row_codes):
+                        table.setdefault(code, []).append(row)
+            logger.info("Indexed {} new posting vectors".format(len(snapshot) - num_rows))
+            self.tables = LSHTables(snapshot, planes, buckets)
+        return self
+
+    def get_candidates(self, tables, query, min_candidates):
+        """Returns the rows of tables.snapshot sharing a bucket with query
+
+        If less than min_candidates rows are found, buckets one bit away are probed too.
+        """
+        codes = self.get_codes(tables.planes, query.reshape(1, -1))[0]
+        candidates = set()
+        for table, code in zip(tables.buckets, codes):
+            candidates.update(table.get(code, ()))
+        if len(candidates) < min_candidates:
+            for bit in range(self.num_bits):
+                for table, code in zip(tables.buckets, codes):
+                    candidates.update(table.get(code ^ (1 << bit), ()))
+                if len(candidates) >= min_candidates:
+                    break
+        rows = np.fromiter(candidates, dtype=np.intp, count=len(candidates))
+        # Rows appended by a concurrent update aren't in this snapshot
+        return rows[rows < len(tables.snapshot)]
+
+    def search(self, query, k):
+        """Returns the ids of approximately the k postings most similar to query
+
+        Returns:
+            (List (str), np.ndarray): posting ids, best first, and their cosine similarity
+        """
+        tables = self.tables
+        if tables is None or len(tables.snapshot) == 0 or len(query) != tables.snapshot.dim:
+            return [], np.empty(0, dtype=np.float32)
+
+        snapshot = tables.snapshot
+        rows = self.get_candidates(tables, np.asarray(query, dtype=np.float32), k)
+        best, scores = top_k(query, snapshot.matrix[rows], snapshot.norms[rows], k)
+        return [snapshot.ids[r] for r in rows[best]], scores
+
+posting_ann_index = LSHIndex()
+
+def get_posting_ann_index():
+    """Returns the ANN index of this process, updated with the latest posting vectors"""
+    return posting_ann_index.update(get_posting_vectors())
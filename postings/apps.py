@@ -9,6 +9,9 @@ class PostingsConfig(AppConfig):
     name = 'postings'
 
     def ready(self):
+        # Connects the signal receivers
+        from . import signals
+
         if 'gunicorn' in sys.argv[0].split('/'):
             # Can only be imported here
             from .ingestions import repeat 
@@ -0,0 +1,93 @@
+from collections import namedtuple
+from urllib.parse import urlparse
+from constants import ASYNC_FETCH_MAX_IN_FLIGHT, ASYNC_FETCH_RATE_PER_HOST, \
+    ASYNC_FETCH_BURST_PER_HOST, FETCH_TIMEOUT
+import asyncio
+import logging
+import time
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+logger = logging.getLogger('app')
+
+# Same attributes as the requests.Response read by the ingestion
+Response = namedtuple('Response', ['url', 'status_code', 'text'])
+
+class TokenBucket:
+    """Allows rate acquisitions per second on average, in bursts of up to capacity
+
+    Must be used from a single event loop.
+    """
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = None
+
+    async def acquire(self):
+        """Waits until a token is available and takes it, waiters are served in order"""
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class AsyncFetcher:
+    """Fetches pages from an asyncio event loop, rate limited per host
+
+    Hundreds of requests can be in flight from a single thread. Each host has a token
+    bucket, so requests to a host never exceed its rate however many are waiting. Use
+    as an async context manager from a running event loop.
+    """
+    def __init__(self, max_in_flight=ASYNC_FETCH_MAX_IN_FLIGHT,
+                 rate_per_host=ASYNC_FETCH_RATE_PER_HOST,
+                 burst_per_host=ASYNC_FETCH_BURST_PER_HOST, timeout=FETCH_TIMEOUT):
+        if aiohttp is None:
+            raise RuntimeError("The async ingestion needs aiohttp, "
+                "install it with `pip install -r requirements.txt`")
+        self.max_in_flight = max_in_flight
+        self.rate_per_host = rate_per_host
+        self.burst_per_host = burst_per_host
+        self.timeout = timeout
+        self.buckets = {}
+        self.session = None
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_in_flight),
+            timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self
+
+    async def __aexit__(self, *args):
+        await self.session.close()
+
+    def get_bucket(self, url):
+        host = urlparse(url).netloc
+        if host not in self.buckets:
+            self.buckets[host] = TokenBucket(self.rate_per_host, self.burst_per_host)
+        return self.buckets[host]
+
+    async def fetch(self, url):
+        """GETs url once its host allows it
+
+        Returns:
+            Response: the response, None if the request failed
+        """
+        await self.get_bucket(url).acquire()
+        logger.info('Issuing GET: ' + url)
+        try:
+            async with self.session.get(url) as response:
+                return Response(url, response.status, await response.text())
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            logger.exception("GET failed: {}".format(url))
+            return None
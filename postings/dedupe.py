@@ -0,0 +1,47 @@
+from datetime import date, timedelta
+from hashlib import blake2b
+from .models import Posting
+import logging
+import threading
+
+logger = logging.getLogger('app')
+
+class PostingIdSet:
+    """Set of posting ids stored as 64 bit hashes, safe to share between threads
+
+    A hash takes a fraction of the memory of an id string. Two ids colliding is
+    unlikely enough to be ignored, the posting would just be skipped by one run.
+    """
+    def __init__(self, ids=()):
+        self.hashes = {PostingIdSet.hash_id(posting_id) for posting_id in ids}
+        self.lock = threading.Lock()
+
+    def hash_id(posting_id):
+        return int.from_bytes(blake2b(posting_id.encode(), digest_size=8).digest(), 'little')
+
+    def load_recent(num_days):
+        """Returns the set of the ids of the postings posted in the last num_days"""
+        ids = Posting.objects.filter(date_posted__gte=date.today() - timedelta(days=num_days)) \
+            .values_list('id', flat=True).iterator()
+        known_ids = PostingIdSet(ids)
+        logger.info("Loaded {} recent posting ids".format(len(known_ids)))
+        return known_ids
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def __contains__(self, posting_id):
+        return PostingIdSet.hash_id(posting_id) in self.hashes
+
+    def add(self, posting_id):
+        """Adds posting_id to the set
+
+        Returns:
+            bool: False if posting_id was already in the set
+        """
+        h = PostingIdSet.hash_id(posting_id)
+        with self.lock:
+            if h in self.hashes:
+                return False
+            self.hashes.add(h)
+            return True
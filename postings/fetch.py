@@ -0,0 +1,57 @@
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from constants import FETCH_MAX_WORKERS, FETCH_MAX_PER_HOST, FETCH_TIMEOUT
+import requests
+import logging
+import threading
+
+logger = logging.getLogger('app')
+
+class Fetcher:
+    """Fetches pages over pooled keep-alive connections, from up to max_workers threads
+
+    Connections to a host are reused across requests instead of opening a new TLS
+    connection per request, and at most max_per_host requests to a host are in flight
+    at once. Use as a context manager so the connections are released.
+    """
+    def __init__(self, max_workers=FETCH_MAX_WORKERS, max_per_host=FETCH_MAX_PER_HOST,
+                 timeout=FETCH_TIMEOUT):
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.host_semaphores = {}
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def get_host_semaphore(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.host_semaphores:
+                self.host_semaphores[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self.host_semaphores[host]
+
+    def fetch(self, url):
+        """GETs url, waiting for a free slot of its host
+
+        Returns:
+            requests.Response: the response, None if the request failed
+        """
+        with self.get_host_semaphore(url):
+            logger.info('Issuing GET: ' + url)
+            try:
+                return self.session.get(url, timeout=self.timeout)
+            except requests.RequestException:
+                logger.exception("GET failed: {}".format(url))
+                return None
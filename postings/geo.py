@@ -0,0 +1,123 @@
+from collections import namedtuple
+from django.db.models import F, FloatField, ExpressionWrapper
+from constants import GAZETTEER_FILE, GEO_CELL_DEGREES
+import csv
+import math
+import re
+import threading
+import unicodedata
+
+KM_PER_DEGREE = 111.2
+
+Place = namedtuple('Place', ['name', 'state', 'country', 'latitude', 'longitude'])
+
+def normalize_place_name(s):
+    """Lowercases and strips accents and punctuation, 'St. John's' -> 'st johns'"""
+    s = unicodedata.normalize('NFKD', s).encode('ascii', 'ignore').decode('ascii')
+    return ' '.join(re.sub(r'[^\w\s]', '', s.lower()).split())
+
+def get_distance_km(lat1, lon1, lat2, lon2):
+    """Great circle distance between two points"""
+    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
+    a = math.sin((lat2 - lat1) / 2) ** 2 \
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371 * math.asin(math.sqrt(a))
+
+def get_geo_cell(latitude, longitude):
+    """Returns the id of the grid cell of GEO_CELL_DEGREES containing a point"""
+    num_cols = int(math.ceil(360 / GEO_CELL_DEGREES))
+    row = int((latitude + 90) // GEO_CELL_DEGREES)
+    col = int((longitude + 180) // GEO_CELL_DEGREES) % num_cols
+    return row * num_cols + col
+
+def get_geo_cells(latitude, longitude, radius_km):
+    """Returns the ids of the grid cells overlapping a circle"""
+    lat_radius = radius_km / KM_PER_DEGREE
+    lon_radius = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(latitude)), 0.01))
+    num_cols = int(math.ceil(360 / GEO_CELL_DEGREES))
+    min_row = int((max(latitude - lat_radius, -90) + 90) // GEO_CELL_DEGREES)
+    max_row = int((min(latitude + lat_radius, 90) + 90) // GEO_CELL_DEGREES)
+    min_col = int((longitude - lon_radius + 180) // GEO_CELL_DEGREES)
+    max_col = int((longitude + lon_radius + 180) // GEO_CELL_DEGREES)
+    return [row * num_cols + col % num_cols
+            for row in range(min_row, max_row + 1)
+            for col in range(min_col, max_col + 1)]
+
+def filter_radius(postings, latitude, longitude, radius_km):
+    """Filters postings to the ones within radius_km of a point
+
+    The geo_cell index narrows the postings to the cells overlapping the circle, which
+    are then filtered with an equirectangular distance, accurate at city scale.
+
+    Parameters:
+        postings (QuerySet): the postings to filter
+        latitude (float): latitude of the center
+        longitude (float): longitude of the center
+        radius_km (float): radius of the circle
+
+    Returns:
+        QuerySet: the postings in the circle
+    """
+    lon_scale = math.cos(math.radians(latitude))
+    d_lat = F('latitude') - latitude
+    d_lon = (F('longitude') - longitude) * lon_scale
+    return postings.filter(geo_cell__in=get_geo_cells(latitude, longitude, radius_km)) \
+        .annotate(geo_distance=ExpressionWrapper(d_lat * d_lat + d_lon * d_lon,
+            output_field=FloatField())) \
+        .filter(geo_distance__lte=(radius_km / KM_PER_DEGREE) ** 2)
+
+class Gazetteer:
+    """Offline list of cities and their coordinates, see postings/data/gazetteer.csv"""
+    def __init__(self, gazetteer_file):
+        self.places = []
+        self.index = {}
+        with open(gazetteer_file, 'r', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                place = Place(row['name'], row['state'], row['country'],
+                    float(row['latitude']), float(row['longitude']))
+                self.places.append(place)
+                self.index.setdefault(normalize_place_name(place.name), []).append(place)
+
+    def lookup(self, city, state=None, country=None):
+        """Returns the place of a city, None if it isn't in the gazetteer
+
+        Cities sharing a name are told apart by state, then country. Without either,
+        the first one listed is returned.
+        """
+        places = self.index.get(normalize_place_name(city), [])
+        for matches in [lambda p: state and p.state.lower() == state.lower(),
+                        lambda p: country and p.country == country.lower(),
+                        lambda p: not state and not country]:
+            for place in places:
+                if matches(place):
+                    return place
+        return None
+
+    def parse(self, location):
+        """Returns the place of a free text location like 'Toronto' or 'Toronto, ON'"""
+        city, _, rest = location.partition(',')
+        state = rest.split()[0] if rest.split() else None
+        return self.lookup(city, state) or self.lookup(city)
+
+    def get_nearby(self, latitude, longitude, radius_km):
+        """Returns the places within radius_km of a point"""
+        return [p for p in self.places
+                if get_distance_km(latitude, longitude, p.latitude, p.longitude) <= radius_km]
+
+class LazyGazetteer:
+    """Loads the gazetteer the first time it is used"""
+    def __init__(self, gazetteer_file):
+        self.gazetteer_file = gazetteer_file
+        self.model = None
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if name in ('gazetteer_file', 'model', 'lock'):
+            raise AttributeError(name)
+        if self.model is None:
+            with self.lock:
+                if self.model is None:
+                    self.model = Gazetteer(self.gazetteer_file)
+        return getattr(self.model, name)
+
+gazetteer = LazyGazetteer(GAZETTEER_FILE)
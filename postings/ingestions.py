@@ -1,12 +1,28 @@
 import time
-from bs4 import BeautifulSoup
-import requests
+from bs4 import BeautifulSoup, SoupStrainer
 from datetime import date, timedelta
 import datetime
-from .models import Posting
+from .models import Posting, IngestionWatermark
+from .vector_store import sync_posting_vectors
+from .titles import sync_title_vectors
+from .result_cache import invalidate_cities, get_invalidated_cities
+from .upgrades import upgrade_posting_vectors
+from .fetch import Fetcher
+from .async_fetch import AsyncFetcher
+from .pipeline import Pipeline
+from .dedupe import PostingIdSet
+from asgiref.sync import sync_to_async
+from django.db import connections, OperationalError
+from .parsing import HTML_PARSER, parse_cards, compile_selectors, find_elements
+import asyncio
 import sys
 import logging
-from constants import CANADA_LOCATIONS, US_LOCATIONS, TITLES
+import threading
+from constants import CANADA_LOCATIONS, US_LOCATIONS, TITLES, FETCH_MAX_WORKERS, \
+    INGEST_PARSE_WORKERS, INGEST_VECTORIZE_WORKERS, INGEST_QUEUE_SIZE, \
+    INDEED_MAX_PAGES, INGEST_PERSIST_BATCH_SIZE, INGEST_DEDUPE_DAYS, \
+    INGEST_PERSIST_RETRIES, INGEST_PERSIST_RETRY_SECONDS
+from profiles.models import VectorProjection
 from profiles.scraper import LinkedInScraper
 from profiles.linkedin import LinkedIn
 
@@ -22,7 +38,14 @@ def repeat():
         logger.info("Sleeping for %d seconds." % seconds_til_midnight)
         time.sleep(seconds_til_midnight)
         logger.info('Starting Indeed ingestion.')
-        indeed.ingest_jobs(1)
+        try:
+            indeed.ingest_jobs(1)
+        except Exception:
+            logger.exception("Indeed ingestion failed")
+        try:
+            upgrade_posting_vectors()
+        except Exception:
+            logger.exception("Couldn't upgrade posting vectors")
         
 
 def time_until_end_of_day(dt=None):
@@ -43,81 +66,352 @@ class IndeedIngestion:
         self.us_locations = us_locations
         self.titles = titles
 
-    def ingest_jobs(self, num_prev_days):
-        linkedin_scraper = LinkedInScraper(headless=True)
-        self.linkedin = LinkedIn(linkedin_scraper)
+    def ingest_jobs(self, num_prev_days=None, use_async=False):
+        """Ingests the postings of every location and title
+
+        Runs as a pipeline so fetching and parsing result pages never waits on the
+        LinkedIn lookups of the vectorize stage: fetch -> parse -> vectorize -> persist.
+        Ids of recent postings are loaded once, so the parse stage drops known cards
+        before building their model. Every search resumes from its checkpoint and stops
+        at its watermark, see IngestionWatermark, or at the first card posted more than
+        num_prev_days days ago.
+
+        Parameters:
+            num_prev_days (int): only postings posted in the last num_prev_days days, every
+                posting newer than the watermarks if not given
+            use_async (bool): crawls the result pages from an asyncio event loop instead
+                of the fetch and parse stages, see crawl_async. Also fetches the detail
+                page of every new posting to store its full description instead of the
+                summary of its card, which doubles the requests sent to Indeed
+        """
+        self.saved_postings = []
+        self.projection = VectorProjection.get_active()
+        self.persist_batch = []
+        self.num_skipped = 0
+        self.oldest_date = None
+        if num_prev_days is not None:
+            self.oldest_date = date.today() - timedelta(days=num_prev_days)
+        # Also holds the ids claimed by this run, so overlapping searches skip them too
+        self.known_ids = PostingIdSet.load_recent(INGEST_DEDUPE_DAYS)
+        self.scrapers = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        pages = []
+        for start_url, title, country, location in self.get_queries():
+            watermark, _ = IngestionWatermark.objects.get_or_create(source='indeed',
+                location=location, search_title=title)
+            pages.append(SearchPage(start_url, title, country, watermark.resume_page,
+                SearchCrawl(watermark)))
+        try:
+            if use_async:
+                self.pipeline = Pipeline().add_stage('crawl', self.crawl, 1)
+                self.add_model_stages()
+                self.pipeline.run([pages])
+            else:
+                with Fetcher() as self.fetcher:
+                    self.pipeline = Pipeline() \
+                        .add_stage('fetch', self.fetch_page, FETCH_MAX_WORKERS) \
+                        .add_stage('parse', self.parse_page, INGEST_PARSE_WORKERS,
+                            INGEST_QUEUE_SIZE)
+                    self.add_model_stages()
+                    self.pipeline.run(pages)
+            self.flush_postings()
+        finally:
+            # Even if the ingestion failed, browsers are closed and the postings saved so
+            # far are searchable
+            for scraper in self.scrapers:
+                scraper.quit()
+            logger.info("Inserted {} postings, skipped {} existing ones".format(
+                len(self.saved_postings), self.num_skipped))
+
+            try:
+                sync_posting_vectors(self.saved_postings)
+            except Exception:
+                logger.exception("Couldn't add posting vectors to the store")
+            try:
+                sync_title_vectors(self.saved_postings)
+            except Exception:
+                logger.exception("Couldn't add title vectors to the store")
+            invalidate_cities(get_invalidated_cities(self.saved_postings))
+
+    def get_queries(self):
+        """Returns the (start url, search title, country, location) of every location and
+        title"""
+        queries = []
         for ca_loc in self.ca_locations:
             for title in self.titles:
-                url = self.BASE_URL_CA + '&q=' + title + '&l=' + ca_loc
-                self.ingest_jobs_from_url(url, num_prev_days, title, 'canada')
-
+                queries.append((self.BASE_URL_CA + '&q=' + title + '&l=' + ca_loc, title,
+                    'canada', ca_loc))
         for us_loc in self.us_locations:
             for title in self.titles:
-                url = self.BASE_URL_US + '&q=' + title + '&l=' + us_loc
-                self.ingest_jobs_from_url(url, num_prev_days, title, 'usa')
-        linkedin_scraper.quit()
-
-    def ingest_jobs_from_url(self, start_url, num_prev_days, search_title, country):
-        page_num = 0
-
-        backfill_date = date.today() - timedelta(days=num_prev_days)
-        posting_in_range = True
-
-        while posting_in_range:
-            url = start_url + '&start=' + str(page_num * 50)
-            page_num += 1
+                queries.append((self.BASE_URL_US + '&q=' + title + '&l=' + us_loc, title,
+                    'usa', us_loc))
+        return queries
+
+    def get_linkedin(self):
+        """Returns the LinkedIn of the calling thread, a browser can't be shared"""
+        if not hasattr(self.local, 'linkedin'):
+            scraper = LinkedInScraper(headless=True)
+            with self.lock:
+                self.scrapers.append(scraper)
+            self.local.linkedin = LinkedIn(scraper)
+        return self.local.linkedin
+
+    def add_model_stages(self):
+        self.pipeline \
+            .add_stage('vectorize', self.vectorize_posting, INGEST_VECTORIZE_WORKERS,
+                INGEST_QUEUE_SIZE) \
+            .add_stage('persist', self.persist_posting, 1, INGEST_QUEUE_SIZE)
+
+    def fetch_page(self, page, emit):
+        page.response = self.fetcher.fetch(page.url)
+        if page.response is None or page.response.status_code != 200:
+            logger.error("GET Failed, Status Code {}".format(
+                page.response and page.response.status_code))
+            return
+        emit(page)
+
+    def parse_page(self, page, emit):
+        postings, next_page = self.parse_new_postings(page)
+        if next_page is not None:
+            self.pipeline.submit(next_page)
+        for p in postings:
+            emit(p)
+
+    def set_description(posting, response):
+        if response is None or response.status_code != 200:
+            logger.warning("Keeping the summary of {}".format(posting.id))
+            return
+        description = IndeedJobAd.parse_description(response.text)
+        if description:
+            posting.description = description
+
+    def parse_new_postings(self, page):
+        """Returns the postings of a fetched result page that are not known yet
+
+        Known cards are counted and dropped before their Posting is built. The new ones
+        are claimed in known_ids, so another search of this run skips them. The search
+        stops at the first page reaching its watermark or oldest_date, cards older than
+        oldest_date are dropped.
+
+        Returns:
+            (List (Posting), SearchPage): the new postings, and the next page of the
+                search, None if ingestion of the search should stop
+        """
+        logger.info('GET Success, Parsing...')
+        posting_soups = parse_cards(page.response.text)
+        page.response = None
+        logger.info('Found ' + str(len(posting_soups)) + ' ad cards.')
+
+        postings = []
+        newest = None
+        num_existing_postings = 0
+        reached_watermark = False
+        reached_oldest = False
+        for posting_soup in posting_soups:
+            posting = IndeedJobAd(posting_soup, page.country, page.search_title)
+            if not posting.valid:
+                continue
+            if newest is None:
+                newest = (posting.date_posted, posting.id)
+            reached_watermark |= page.crawl.watermark.is_reached(posting.date_posted,
+                posting.id)
+            if self.oldest_date is not None and posting.date_posted < self.oldest_date:
+                reached_oldest = True
+                continue
+            if self.known_ids.add(posting.id):
+                posting.print()
+                model = posting.to_model()
+                model.search_page = page
+                postings.append(model)
+            else:
+                num_existing_postings += 1
+        logger.info("Length of existing postings: {}".format(num_existing_postings))
 
-            logger.info('Issuing GET: ' + url)
-            search_result = requests.get(url)
+        next_page = None
+        if reached_watermark or reached_oldest or num_existing_postings > 40 or not posting_soups \
+                or page.page_num + 1 >= INDEED_MAX_PAGES:
+            logger.info("Stopping Ingestion.")
+        else:
+            next_page = page.get_next_page()
+        page.crawl.page_parsed(page.page_num, len(postings), newest, next_page is None)
+        return postings, next_page
+
+    def crawl(self, pages, emit):
+        asyncio.run(self.crawl_async(pages, emit))
+
+    async def crawl_async(self, pages, emit):
+        """Crawls every search concurrently from the running event loop
+
+        Every result page and detail page goes through one AsyncFetcher, so hundreds of
+        requests can be in flight while each host stays under its rate limit. Parsing,
+        which checkpoints to the database, runs in the thread of sync_to_async. Emitting,
+        which blocks while the vectorize stage is behind, runs in the default executor.
+        Neither stalls the event loop.
+        """
+        parse_new_postings = sync_to_async(self.parse_new_postings, thread_sensitive=True)
+        async with AsyncFetcher() as fetcher:
+            await asyncio.gather(*[self.crawl_search(fetcher, page, emit, parse_new_postings)
+                                   for page in pages])
+        await sync_to_async(connections.close_all, thread_sensitive=True)()
+
+    async def crawl_search(self, fetcher, page, emit, parse_new_postings):
+        while page is not None:
+            page.response = await fetcher.fetch(page.url)
+            if page.response is None or page.response.status_code != 200:
+                logger.error("GET Failed, Status Code {}".format(
+                    page.response and page.response.status_code))
+                return
+            postings, page = await parse_new_postings(page)
+            await asyncio.gather(*[self.describe_posting(fetcher, posting, emit)
+                                   for posting in postings])
+
+    async def describe_posting(self, fetcher, posting, emit):
+        """Replaces the summary of a posting with its full description, then emits it"""
+        loop = asyncio.get_running_loop()
+        if posting.url:
+            response = await fetcher.fetch(posting.url)
+            await loop.run_in_executor(None, IndeedIngestion.set_description, posting,
+                response)
+        await loop.run_in_executor(None, emit, posting)
+
+    def vectorize_posting(self, posting, emit):
+        """Generates the vector of a posting, then emits it
+
+        A posting whose employees can't be looked up is persisted without a vector, like
+        one with less than 3 employees, so its page still completes in SearchCrawl and
+        upgrade_posting_vectors can add employees later.
+        """
+        logger.info("Generating posting vector...")
+        try:
+            posting.generate_vector(5, self.get_linkedin(), self.projection)
+        except Exception:
+            logger.exception("Couldn't generate the vector of {}".format(posting.id))
+            posting.num_employees = 0
+            posting.vector_sum = b''
+            posting.matched_profiles = []
+        emit(posting)
+
+    def persist_posting(self, posting, emit):
+        self.persist_batch.append(posting)
+        if len(self.persist_batch) >= INGEST_PERSIST_BATCH_SIZE:
+            self.flush_postings()
+
+    def flush_postings(self):
+        """Bulk inserts the postings batched by persist_posting
+
+        If the batch can't be inserted, its postings are inserted one at a time, and the
+        ones that still fail are logged and dropped. Dropped postings count as saved for
+        the checkpoint of their search, retrying them would fail the same way.
+        """
+        if not self.persist_batch:
+            return
+        batch, self.persist_batch = self.persist_batch, []
+        try:
+            inserted, num_skipped = IndeedIngestion.insert_postings(batch)
+        except Exception:
+            logger.exception("Couldn't insert {} postings, inserting them one at a time"
+                .format(len(batch)))
+            inserted, num_skipped = [], 0
+            for posting in batch:
+                try:
+                    posting_inserted, posting_skipped = IndeedIngestion.insert_postings(
+                        [posting])
+                except Exception:
+                    logger.exception("Dropped posting {}".format(posting.id))
+                    continue
+                inserted.extend(posting_inserted)
+                num_skipped += posting_skipped
+        logger.info("Saved {} postings, {} already existed".format(len(inserted), num_skipped))
+        for p in batch:
+            p.search_page.crawl.posting_saved(p.search_page.page_num)
+        self.saved_postings.extend(inserted)
+        self.num_skipped += num_skipped
+
+    def insert_postings(postings):
+        """Bulk inserts postings, retrying up to INGEST_PERSIST_RETRIES times while the
+        database is locked, see Posting.bulk_insert"""
+        for attempt in range(INGEST_PERSIST_RETRIES + 1):
+            try:
+                return Posting.bulk_insert(postings)
+            except OperationalError as e:
+                if 'locked' not in str(e) or attempt == INGEST_PERSIST_RETRIES:
+                    raise
+                logger.warning("Database is locked, retrying the insert of {} postings"
+                    .format(len(postings)))
+                time.sleep(INGEST_PERSIST_RETRY_SECONDS * (attempt + 1))
+
+
+class SearchPage:
+    """A result page of a search, passed through the stages of an IndeedIngestion"""
+    def __init__(self, start_url, search_title, country, page_num, crawl):
+        self.start_url = start_url
+        self.search_title = search_title
+        self.country = country
+        self.page_num = page_num
+        self.crawl = crawl
+        self.url = start_url + '&start=' + str(page_num * 50)
+        self.response = None
 
-            if search_result.status_code != 200:
-                logger.error("GET Failed, Status Code {}".format(search_result.status_code))
-                continue
+    def get_next_page(self):
+        return SearchPage(self.start_url, self.search_title, self.country, self.page_num + 1,
+            self.crawl)
 
-            logger.info('GET Success, Parsing...')
-            search_soup = BeautifulSoup(search_result.text, 'html.parser')
+    def __str__(self):
+        return self.url
 
-            logger.info('Finding individual job postings...')
-            posting_soups = search_soup.find_all('div', {'class': 'jobsearch-SerpJobCard'})
-            logger.info('Found ' + str(len(posting_soups)) + ' ad cards.')
 
-            postings = []
-            for posting_soup in posting_soups:
-                posting = IndeedJobAd(posting_soup, country, search_title)
-                if posting.valid:
-                    posting.print()
-                    posting_db = posting.to_model()
-                    postings.append(posting_db)
-            
-            existing_postings = Posting.objects.filter(pk__in=[p.id for p in postings])
-            num_existing_postings = len(existing_postings)
-            logger.info("Length of existing postings: {}".format(num_existing_postings))
+class SearchCrawl:
+    """Pages of a search crawled in a run, checkpointed to its IngestionWatermark
 
-            existing_postings_id = [p.id for p in existing_postings]
+    A page is done once all its new postings are saved. The checkpoint only moves past
+    pages that are done, so an interrupted run resumes before any posting it didn't
+    save, including postings whose vectorization failed.
+    """
+    def __init__(self, watermark):
+        self.watermark = watermark
+        self.lock = threading.Lock()
+        # Number of postings not saved yet of every page that isn't done
+        self.pending = {}
+        self.resume_page = watermark.resume_page
+        self.last_page = None
+
+    def page_parsed(self, page_num, num_postings, newest, is_last):
+        """Records a parsed page and its new postings
+
+        Parameters:
+            page_num (int): the page
+            num_postings (int): number of new postings passed to the next stages
+            newest ((date, str)): date and id of the first card of the page, None if
+                it has no valid card
+            is_last (bool): True if the crawl stops at this page
+        """
+        with self.lock:
+            if is_last:
+                self.last_page = page_num
+            self.pending[page_num] = num_postings
+            if newest is not None and self.watermark.crawl_newest_date is None:
+                self.watermark.checkpoint(self.resume_page, *newest)
+            self.update()
+
+    def posting_saved(self, page_num):
+        with self.lock:
+            self.pending[page_num] -= 1
+            self.update()
+
+    def update(self):
+        resume_page = self.resume_page
+        while self.pending.get(self.resume_page) == 0:
+            del self.pending[self.resume_page]
+            self.resume_page += 1
+        if self.last_page is not None and self.resume_page > self.last_page:
+            logger.info("Completed crawl of {} {}".format(self.watermark.location,
+                self.watermark.search_title))
+            self.watermark.complete()
+            self.last_page = None
+        elif self.resume_page != resume_page:
+            self.watermark.checkpoint(self.resume_page)
 
-            if num_existing_postings > 40:
-                posting_in_range = False
-            
-            filtered_postings = []
-            for p in postings:
-                if p.id not in existing_postings_id:
-                    logger.info("Generating posting vector...")
-                    p.generate_vector(5, self.linkedin)
-                    try:
-                        logger.info("Saving posting {}".format(p.id))
-                        p.save()
-                    except:
-                        logger.exception("Error")
-
-            if page_num == 20:
-                posting_in_range = False
-                
-            if not posting_in_range:
-                logger.info("Stopping Ingestion.")
-
-            # Server can't handle load.
-            break
-                
 
 class IndeedJobAd:
     # Constants
@@ -137,8 +431,13 @@ class IndeedJobAd:
                       'attr': 'summary'},
         'LOCATION': {'el': 'span', 
                    'tag': 'class', 
-                   'attr': 'location'}
+                   'attr': 'location'},
+        'JOB_DESCRIPTION': {'el': 'div',
+                          'tag': 'class',
+                          'attr': 'jobsearch-JobComponent-description'}
     }
+    CARD_SELECTORS = compile_selectors({name: spec for name, spec in SOUP_ID.items()
+                                        if name != 'JOB_DESCRIPTION'})
 
     # Initalize with a BeautifulSoup Card element
     def __init__(self, ad_soup, country, search_title):
@@ -160,24 +459,29 @@ class IndeedJobAd:
 
     def to_model(self):
         if self.valid:
-            return Posting(id=self.id, title=self.title, company=self.company, 
+            posting = Posting(id=self.id, title=self.title, company=self.company, 
                     city=self.city, state=self.state, country=self.country,
                     source=self.source, date_posted=self.date_posted,
                     url=self.url, description=self.description, 
                     search_title=self.search_title)
+            if not posting.geocode():
+                logger.info("{}, {} is not in the gazetteer".format(self.city, self.state))
+            return posting
         else:
             return None
 
     # Returns false if Job Posting is sponsored
     def extract_card(self, ad_soup):
-        title_soup = self.find_element_from_soup(ad_soup, 'TITLE_URL')
+        # Every element of the card is found in a single walk of it
+        elements = find_elements(ad_soup, self.CARD_SELECTORS)
+        title_soup = self.get_element(elements, 'TITLE_URL')
         
         if title_soup and 'pagead' not in title_soup['href']:
             url = title_soup['href']
-            company_soup = self.find_element_from_soup(ad_soup, 'COMPANY')
-            date_posted_soup = self.find_element_from_soup(ad_soup, 'DATE_POSTED')
-            description_soup = self.find_element_from_soup(ad_soup, 'DESCRIPTION')
-            location_soup = self.find_element_from_soup(ad_soup, 'LOCATION')
+            company_soup = self.get_element(elements, 'COMPANY')
+            date_posted_soup = self.get_element(elements, 'DATE_POSTED')
+            description_soup = self.get_element(elements, 'DESCRIPTION')
+            location_soup = self.get_element(elements, 'LOCATION')
 
             if title_soup and company_soup and date_posted_soup and location_soup:
 
@@ -201,21 +505,21 @@ class IndeedJobAd:
 
         return False
 
-    def visit_link_to_extract_description(self):
-        if self.url:
-            job_url = self.url
-
-            logger.info('Issuing GET: ' + job_url)
-            job_response = requests.get(job_url)
-            logger.info('GET Success, Parsing...')
-
-            specific_job_soup = BeautifulSoup(job_response.text, 'html.parser')
-            description = self.find_element_from_soup(specific_job_soup,
-                    {'el': 'div',
-                      'tag': 'class',
-                      'attr': 'jobsearch-JobComponent-description'})
-            if description:
-                self.description = str(description)
+    def parse_description(html):
+        """Returns the description of a job detail page
+
+        Returns:
+            str: text of the description, truncated to fit Posting.description, None if
+                the page has no description
+        """
+        spec = IndeedJobAd.SOUP_ID['JOB_DESCRIPTION']
+        description = BeautifulSoup(html, HTML_PARSER,
+            parse_only=SoupStrainer(spec['el'], {spec['tag']: spec['attr']})).find()
+        if not description:
+            logger.warning("Could not find JOB_DESCRIPTION")
+            return None
+        max_length = Posting._meta.get_field('description').max_length
+        return ' '.join(description.text.split())[:max_length]
 
     def get_post_date(self, delta_post_date):
         today = date.today()
@@ -226,9 +530,8 @@ class IndeedJobAd:
         else:
             return today
 
-    def find_element_from_soup(self, soup, spec_name):
-        spec = self.SOUP_ID[spec_name]
-        result = soup.find(spec['el'], {spec['tag'], spec['attr']})
+    def get_element(self, elements, spec_name):
+        result = elements.get(spec_name)
         if not result:
             logger.warning("Could not find {}".format(spec_name))
-        return result
\ No newline at end of file
+        return result
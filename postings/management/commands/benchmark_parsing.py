@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+from bs4 import BeautifulSoup
+from postings.ingestions import IndeedJobAd
+from postings.parsing import CARD_CLASS, parse_cards
+import glob
+import time
+
+SAMPLE_PAGES = 'postings/data/pages/*.html'
+
+def parse_full_tree(html, parser):
+    """Card extraction before postings.parsing, kept as the benchmark baseline"""
+    return BeautifulSoup(html, parser).find_all('div', {'class': CARD_CLASS})
+
+def get_parsers():
+    parsers = ['html.parser']
+    try:
+        import lxml
+        parsers.append('lxml')
+    except ImportError:
+        pass
+    return parsers
+
+class Command(BaseCommand):
+    help = 'Times the parsing of saved Indeed result pages, full tree vs job cards only'
+
+    def add_arguments(self, parser):
+        parser.add_argument('pages', nargs='*',
+            help='Saved result pages, {} if not given'.format(SAMPLE_PAGES))
+        parser.add_argument('--repeat', type=int, default=20,
+            help='Number of times every page is parsed')
+
+    def handle(self, *args, **options):
+        paths = options['pages'] or sorted(glob.glob(SAMPLE_PAGES))
+        if not paths:
+            raise CommandError("No pages to parse")
+        pages = []
+        for path in paths:
+            with open(path, 'r', encoding='utf-8') as f:
+                pages.append(f.read())
+
+        print("{} pages, {} KB on average, parsed {} times".format(len(pages),
+            sum(len(page) for page in pages) // len(pages) // 1024, options['repeat']))
+        for parser in get_parsers():
+            for method, parse in [('full tree', parse_full_tree), ('cards only', parse_cards)]:
+                num_cards = 0
+                start = time.perf_counter()
+                for _ in range(options['repeat']):
+                    for page in pages:
+                        for card in parse(page, parser):
+                            IndeedJobAd(card, 'canada', 'benchmark')
+                            num_cards += 1
+                elapsed = time.perf_counter() - start
+                num_parsed = options['repeat'] * len(pages)
+                print("{:12}{:12}{:8.2f} ms/page{:6} cards/page".format(parser, method,
+                    1000 * elapsed / num_parsed, num_cards // num_parsed))
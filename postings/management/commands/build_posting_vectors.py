@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from postings.models import Posting
+from postings.vector_store import posting_vector_store, get_posting_vector_store, \
+    iter_posting_vectors
+from postings.titles import title_vector_store, iter_title_vectors
+from profiles.models import VectorProjection
+
+class Command(BaseCommand):
+    help = 'Rebuilds the memory-mapped posting and title vector stores from the database'
+
+    def handle(self, *args, **options):
+        num_postings = posting_vector_store.rebuild(iter_posting_vectors(Posting.objects.all()))
+        print("Wrote {} posting vectors to {}".format(num_postings,
+            posting_vector_store.directory))
+
+        projection = VectorProjection.get_active()
+        if projection is not None:
+            store = get_posting_vector_store(projection)
+            num_postings = store.rebuild(iter_posting_vectors(Posting.objects.all(), projection))
+            print("Wrote {} reduced posting vectors to {}".format(num_postings,
+                store.directory))
+
+        num_postings = title_vector_store.rebuild(iter_title_vectors(Posting.objects.all()))
+        print("Wrote {} title vectors to {}".format(num_postings, title_vector_store.directory))
@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand, CommandError
+from datetime import date
+from constants import REDUCED_VECTOR_LEN
+from postings.models import Posting
+from postings.vector_store import get_posting_vector_store, iter_posting_vectors
+from profiles.models import Profile, VectorProjection
+from profiles.projection import fit_projection
+from profiles.vectorize import vectorize_profiles
+from utils.vector_encoding import encode_vector, decode_vector
+
+class Command(BaseCommand):
+    help = 'Fits a projection of profile vectors to fewer dimensions and projects every posting vector'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dims', type=int, default=REDUCED_VECTOR_LEN,
+            help='Number of dimensions to keep')
+        parser.add_argument('--chunk-size', type=int, default=500,
+            help='Number of profiles vectorized at once')
+
+    def iter_profile_vectors(self, chunk_size):
+        today = date.today()
+        profiles = Profile.objects.order_by('pk')
+        for start in range(0, profiles.count(), chunk_size):
+            chunk = list(profiles[start:start + chunk_size])
+            yield vectorize_profiles(chunk, [today] * len(chunk))
+
+    def handle(self, *args, **options):
+        dims = options['dims']
+        if not 0 < dims <= Profile.VECTOR_LEN:
+            raise CommandError("dims must be between 1 and {}".format(Profile.VECTOR_LEN))
+
+        try:
+            components, explained_variance = fit_projection(
+                self.iter_profile_vectors(options['chunk_size']), dims)
+        except ValueError as e:
+            raise CommandError(e)
+
+        projection = VectorProjection.objects.create(input_len=Profile.VECTOR_LEN,
+            dims=dims, components=encode_vector(components.ravel()),
+            explained_variance=explained_variance)
+        print("Fitted projection {}".format(projection))
+
+        postings = Posting.objects.exclude(vector=b'').only('id', 'vector')
+        batch = []
+        for posting in postings.iterator():
+            try:
+                vector = decode_vector(posting.vector)
+            except ValueError:
+                continue
+            posting.reduced_vector = encode_vector(projection.project(vector))
+            posting.projection_version = projection.pk
+            batch.append(posting)
+            if len(batch) == 500:
+                Posting.objects.bulk_update(batch, ['reduced_vector', 'projection_version'])
+                batch = []
+        if batch:
+            Posting.objects.bulk_update(batch, ['reduced_vector', 'projection_version'])
+
+        store = get_posting_vector_store(projection)
+        num_postings = store.rebuild(iter_posting_vectors(Posting.objects.all(), projection))
+        print("Wrote {} reduced posting vectors to {}".format(num_postings, store.directory))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from postings.models import Posting
+
+class Command(BaseCommand):
+    help = 'Sets the coordinates of postings from the gazetteer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+            help='Geocode every posting, not only the ones without coordinates')
+
+    def handle(self, *args, **options):
+        postings = Posting.objects.only('id', 'city', 'state', 'country')
+        if not options['all']:
+            postings = postings.filter(latitude__isnull=True)
+
+        batch = []
+        num_found = 0
+        num_postings = 0
+        for posting in postings.iterator():
+            num_found += posting.geocode()
+            num_postings += 1
+            batch.append(posting)
+            if len(batch) == 500:
+                Posting.objects.bulk_update(batch, ['latitude', 'longitude', 'geo_cell'])
+                batch = []
+        Posting.objects.bulk_update(batch, ['latitude', 'longitude', 'geo_cell'])
+        print("Geocoded {} of {} postings".format(num_found, num_postings))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from postings.models import Posting, PostingToken
+
+class Command(BaseCommand):
+    help = 'Rebuilds the title and city token index of every posting'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+            help='Number of postings indexed per insert')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        num_postings = 0
+        num_tokens = 0
+        with transaction.atomic():
+            PostingToken.objects.all().delete()
+            tokens = []
+            for posting in Posting.objects.only('id', 'title', 'city').iterator():
+                tokens.extend(posting.get_tokens())
+                num_postings += 1
+                if num_postings % batch_size == 0:
+                    PostingToken.objects.bulk_create(tokens)
+                    num_tokens += len(tokens)
+                    tokens = []
+            PostingToken.objects.bulk_create(tokens)
+            num_tokens += len(tokens)
+        print("Indexed {} tokens of {} postings".format(num_tokens, num_postings))
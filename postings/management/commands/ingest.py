@@ -1,15 +1,32 @@
 from django.core.management.base import BaseCommand, CommandError
 from postings.ingestions import IndeedIngestion
+from postings.async_fetch import aiohttp
 from constants import CANADA_LOCATIONS, US_LOCATIONS, TITLES
+from utils.glove import glove
+import logging
+
+logger = logging.getLogger('app')
 
 class Command(BaseCommand):
     help = 'Initial ingestion command'
 
     def add_arguments(self, parser):
-        parser.add_argument('num_pages', nargs='?', type=int)
+        parser.add_argument('num_prev_days', nargs='?', type=int,
+            help='Only ingest postings posted in the last num_prev_days days, by default '
+                'every posting newer than the last completed crawl of each search')
+        parser.add_argument('--async', action='store_true', dest='use_async',
+            help='Fetch result pages from an asyncio event loop instead of thread pools, '
+                'and store the full description of every new posting from its detail '
+                'page instead of the summary of its search card. Sends twice as many '
+                'requests to Indeed')
 
     def handle(self, *args, **options):
+        if options['use_async'] and aiohttp is None:
+            raise CommandError("--async needs aiohttp, install it with "
+                "`pip install -r requirements.txt`")
+        glove.warm_up()
         indeed = IndeedIngestion(ca_locations=CANADA_LOCATIONS,
             us_locations=US_LOCATIONS,
             titles = TITLES)
-        indeed.ingest_jobs(options['num_pages'])
\ No newline at end of file
+        indeed.ingest_jobs(options['num_prev_days'], use_async=options['use_async'])
+        logger.info("Embedding cache: {}".format(glove.cache.info()))
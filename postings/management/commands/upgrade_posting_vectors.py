@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand, CommandError
+from postings.upgrades import upgrade_posting_vectors
+from utils.glove import glove
+
+class Command(BaseCommand):
+    help = 'Adds the stored profiles matching postings with less than 3 employees to their vectors'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30,
+            help='Only postings posted in the last days')
+
+    def handle(self, *args, **options):
+        glove.warm_up()
+        upgraded = upgrade_posting_vectors(options['days'])
+        print("{} postings got a vector".format(len(upgraded)))
@@ -0,0 +1,32 @@
+# Generated by Django 3.0.3 on 2026-10-18 17:12
+
+from django.db import migrations, models
+import numpy as np
+import pickle
+
+
+def compute_vector_norms(apps, schema_editor):
+    Posting = apps.get_model('postings', 'Posting')
+    for posting in Posting.objects.filter(num_employees__gte=3).only('id', 'vector'):
+        try:
+            vector = pickle.loads(posting.vector)
+        except Exception:
+            continue
+        posting.vector_norm = float(np.linalg.norm(vector))
+        posting.save(update_fields=['vector_norm'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('postings', '0002_auto_20200318_0339'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='posting',
+            name='vector_norm',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.RunPython(compute_vector_norms, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+from django.db import migrations
+import pickle
+from utils.vector_encoding import encode_vector, is_encoded_vector
+
+
+def encode_posting_vectors(apps, schema_editor):
+    """Rewrites pickled posting vectors with utils.vector_encoding"""
+    Posting = apps.get_model('postings', 'Posting')
+    for posting in Posting.objects.exclude(vector=b'').only('id', 'vector').iterator():
+        if is_encoded_vector(posting.vector):
+            continue
+        try:
+            vector = pickle.loads(posting.vector)
+        except Exception:
+            # Unreadable vectors are dropped, the posting is ranked as if it had none.
+            # num_employees is kept, it is still the number of matched employees.
+            posting.vector = b''
+            posting.vector_norm = None
+            posting.save(update_fields=['vector', 'vector_norm'])
+            continue
+        posting.vector = encode_vector(vector)
+        posting.save(update_fields=['vector'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('postings', '0003_posting_vector_norm'),
+    ]
+
+    operations = [
+        migrations.RunPython(encode_posting_vectors, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.0.3 on 2026-10-18 17:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('postings', '0004_encode_posting_vectors'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='posting',
+            name='projection_version',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='posting',
+            name='reduced_vector',
+            field=models.BinaryField(blank=True, default=b''),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 3.0.3 on 2026-10-18 17:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+from postings.tokens import tokenize
+
+
+def index_posting_tokens(apps, schema_editor):
+    Posting = apps.get_model('postings', 'Posting')
+    PostingToken = apps.get_model('postings', 'PostingToken')
+    tokens = []
+    for posting_id, title, city in Posting.objects.values_list('id', 'title', 'city').iterator():
+        for field, value in [('t', title), ('c', city)]:
+            for token in tokenize(value):
+                tokens.append(PostingToken(posting_id=posting_id, field=field, token=token))
+    PostingToken.objects.bulk_create(tokens, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('postings', '0005_posting_reduced_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostingToken',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.CharField(choices=[('t', 'title'), ('c', 'city')], max_length=1)),
+                ('token', models.CharField(max_length=32)),
+                ('posting', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='postings.Posting')),
+            ],
+            options={
+                'unique_together': {('posting', 'field', 'token')},
+                'index_together': {('field', 'token')},
+            },
+        ),
+        migrations.RunPython(index_posting_tokens, migrations.RunPython.noop),
+    ]
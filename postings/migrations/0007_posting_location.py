@@ -0,0 +1,28 @@
+# Generated by Django 3.0.3 on 2026-10-18 17:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('postings', '0006_postingtoken'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='posting',
+            name='geo_cell',
+            field=models.IntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='posting',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='posting',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 3.0.3 on 2026-10-18 17:24
+
+from django.db import migrations, models
+from utils.vector_encoding import encode_vector, decode_vector
+
+
+def compute_vector_sums(apps, schema_editor):
+    Posting = apps.get_model('postings', 'Posting')
+    postings = Posting.objects.filter(num_employees__gte=3).exclude(vector=b'') \
+        .only('id', 'vector', 'num_employees')
+    for posting in postings.iterator():
+        try:
+            vector = decode_vector(posting.vector)
+        except ValueError:
+            continue
+        posting.vector_sum = encode_vector(vector * posting.num_employees)
+        posting.save(update_fields=['vector_sum'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles', '0004_vectorprojection'),
+        ('postings', '0007_posting_location'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='posting',
+            name='employees',
+            field=models.ManyToManyField(blank=True, related_name='employee_postings', to='profiles.Profile'),
+        ),
+        migrations.AddField(
+            model_name='posting',
+            name='vector_sum',
+            field=models.BinaryField(blank=True, default=b''),
+        ),
+        migrations.RunPython(compute_vector_sums, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.0.3 on 2026-10-18 17:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles', '0004_vectorprojection'),
+        ('postings', '0008_posting_employees'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompanyTitleVector',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('company', models.CharField(max_length=64)),
+                ('search_title', models.CharField(max_length=16)),
+                ('vector_sum', models.BinaryField(blank=True, default=b'')),
+                ('num_employees', models.IntegerField(default=0)),
+                ('updated', models.DateTimeField()),
+                ('employees', models.ManyToManyField(blank=True, to='profiles.Profile')),
+            ],
+            options={
+                'unique_together': {('company', 'search_title')},
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.0.3 on 2026-10-18 17:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('postings', '0009_companytitlevector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestionWatermark',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=16)),
+                ('location', models.CharField(max_length=64)),
+                ('search_title', models.CharField(max_length=16)),
+                ('newest_date', models.DateField(null=True)),
+                ('newest_id', models.CharField(blank=True, max_length=64)),
+                ('crawl_newest_date', models.DateField(null=True)),
+                ('crawl_newest_id', models.CharField(blank=True, max_length=64)),
+                ('resume_page', models.IntegerField(default=0)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'unique_together': {('source', 'location', 'search_title')},
+            },
+        ),
+    ]
@@ -1,8 +1,14 @@
-from django.db import models
-from datetime import date
+from django.db import models, transaction, IntegrityError
+from django.utils import timezone
+from datetime import date, timedelta
 from PIL import Image, ImageDraw
 import numpy as np
-from profiles.models import Profile
+from profiles.models import Profile, VectorProjection
+from profiles.vectorize import prefetch_profiles, vectorize_profiles
+from utils.vector_encoding import encode_vector, decode_vector
+from .tokens import tokenize
+from .geo import gazetteer, get_geo_cell
+from constants import COMPANY_TITLE_VECTOR_TTL_DAYS
 import logging
 
 logger = logging.getLogger('app')
@@ -15,48 +21,181 @@ class Posting(models.Model):
     city = models.CharField(max_length=20, blank=True)
     state = models.CharField(max_length=8, blank=True)
     country = models.CharField(max_length=16, blank=True)
+    # Coordinates of the city from the gazetteer, see postings/geo.py
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    geo_cell = models.IntegerField(null=True, blank=True, db_index=True)
 
     source = models.CharField(max_length=16, blank=True)
     date_posted = models.DateField(default=date.today)
     url = models.URLField(blank=True)
     vector = models.BinaryField()
+    vector_norm = models.FloatField(null=True, blank=True)
+    # vector projected with VectorProjection of id projection_version
+    reduced_vector = models.BinaryField(blank=True, default=b'')
+    projection_version = models.IntegerField(null=True, blank=True)
     description = models.CharField(max_length=256, blank=True)
     image_url = models.URLField(blank=True)
 
     search_title = models.CharField(max_length=16, blank=True)
     num_employees = models.IntegerField(default=-1)
+    # Sum of the vectors of the num_employees matched employees, vector is their mean
+    vector_sum = models.BinaryField(blank=True, default=b'')
+    employees = models.ManyToManyField(Profile, blank=True, related_name='employee_postings')
 
     # logo = models.URLField(default='')
     
-    def generate_vector(self, num_profiles, linkedin):
+    def generate_vector(self, num_profiles, linkedin, projection=None):
         """Generates a averaged vector of the job postings existing employees
+
+        Employees are shared by the postings of a company and title, so they are only
+        looked up and vectorized once per COMPANY_TITLE_VECTOR_TTL_DAYS, see
+        CompanyTitleVector. The sum of the employee vectors is kept even with less than
+        3 employees, so employees found later can be folded in, see
+        postings/upgrades.py. The matched profiles are left in matched_profiles, to add
+        to employees once saved.
   
         Parameters: 
             num_profiles (int): number of profiles
+            projection (VectorProjection): also stores the reduced vector of this
+                projection if given
             
         Returns:
             (boolean): if generation was successful, fails if less than 5 existing
                 employees
         """
-        profiles = linkedin.get_profiles(self.company, self.search_title, num_profiles)
+        aggregate = CompanyTitleVector.get_fresh(self.company, self.search_title)
+        if aggregate is None:
+            aggregate = CompanyTitleVector.generate(self.company, self.search_title,
+                num_profiles, linkedin)
+        else:
+            logger.info("Reusing the {} employees of {}".format(aggregate.num_employees,
+                aggregate))
 
-        posting_vector = np.zeros(Profile.VECTOR_LEN, dtype=np.float32)
-        num_added_profiles = 0
-        for p in profiles:
-            exp_start_date = p.get_experience_start_date(self.company, self.search_title)
-            if exp_start_date:
-                posting_vector = np.add(posting_vector, p.to_vector(exp_start_date))
-                num_added_profiles += 1
-        
-        self.num_employees = num_added_profiles
-        if num_added_profiles >= 3:
-            posting_vector = np.divide(posting_vector, num_added_profiles)
-            self.vector = posting_vector.dumps()
+        self.num_employees = 0
+        self.vector_sum = b''
+        self.matched_profiles = aggregate.get_employees()
+        if aggregate.num_employees > 0:
+            self.add_employee_sum(decode_vector(aggregate.vector_sum), aggregate.num_employees,
+                projection)
+        if self.num_employees >= 3:
             return True
 
         logger.info("No profiles match.")
         return False
 
+    def add_employee_vectors(self, vectors, projection=None):
+        """Folds the vectors of new employees into the running sum and updates the mean
+
+        Only the sum and the count are read, so adding an employee doesn't need the
+        vectors of the others. The posting vector is set once there are 3 employees.
+
+        Parameters:
+            vectors (np.ndarray): matrix of the new employee vectors in rows
+            projection (VectorProjection): see set_vector
+        """
+        self.add_employee_sum(vectors.sum(axis=0), len(vectors), projection)
+
+    def add_employee_sum(self, vector_sum, num_employees, projection=None):
+        """Folds the sum of the vectors of num_employees new employees, see add_employee_vectors"""
+        if self.vector_sum and self.num_employees > 0:
+            vector_sum = decode_vector(self.vector_sum) + vector_sum
+            num_employees = self.num_employees + num_employees
+        # Otherwise employees counted before sums were stored can't be folded into
+
+        self.vector_sum = encode_vector(vector_sum)
+        self.num_employees = num_employees
+        if num_employees >= 3:
+            self.set_vector(vector_sum / num_employees, projection)
+
+    def set_vector(self, vector, projection=None):
+        """Sets the posting vector and its reduced vector
+
+        Parameters:
+            vector (np.ndarray): the posting vector
+            projection (VectorProjection): projection of the reduced vector, usually the
+                active one read once by the caller. No reduced vector is stored if not
+                given, it is projected when read instead.
+        """
+        self.vector = encode_vector(vector)
+        self.vector_norm = float(np.linalg.norm(vector))
+
+        if projection is None:
+            self.reduced_vector = b''
+            self.projection_version = None
+        else:
+            self.reduced_vector = encode_vector(projection.project(vector))
+            self.projection_version = projection.pk
+
+    def get_reduced_vector(self, projection):
+        """Returns the posting vector projected with projection, None if it has none"""
+        if self.reduced_vector and self.projection_version == projection.pk:
+            return decode_vector(self.reduced_vector)
+        vector = self.get_vector()
+        return None if vector is None else projection.project(vector)
+
+    def get_vector(self):
+        """Returns the posting vector as a read only float32 array, None if it has none"""
+        if not self.vector:
+            return None
+        return decode_vector(self.vector)
+
+    def geocode(self):
+        """Sets the coordinates of the posting from its city, state and country
+
+        Returns:
+            (boolean): if the city was found in the gazetteer
+        """
+        place = gazetteer.lookup(self.city, self.state, self.country)
+        if place is None:
+            self.latitude = self.longitude = self.geo_cell = None
+            return False
+        self.latitude = place.latitude
+        self.longitude = place.longitude
+        self.geo_cell = get_geo_cell(place.latitude, place.longitude)
+        return True
+
+    def get_tokens(self):
+        """Returns the PostingTokens of the title and city, unsaved"""
+        return [PostingToken(posting_id=self.id, field=field, token=token)
+                for field, value in [(PostingToken.TITLE, self.title),
+                                     (PostingToken.CITY, self.city)]
+                for token in tokenize(value)]
+
+    def index_tokens(self):
+        """Replaces the indexed tokens of the posting, see PostingToken"""
+        PostingToken.objects.filter(posting_id=self.id).delete()
+        PostingToken.objects.bulk_create(self.get_tokens())
+
+    def bulk_insert(postings):
+        """Inserts the postings that don't exist yet in one transaction
+
+        Tokens and matched_profiles employees of the inserted postings are written in
+        the same transaction, the post_save signal doesn't fire for bulk inserts.
+
+        Parameters:
+            postings (List (Posting)): unsaved postings
+
+        Returns:
+            (List (Posting), int): the inserted postings, and the number of postings
+                skipped because their id already existed
+        """
+        with transaction.atomic():
+            existing_ids = set(Posting.objects.filter(
+                pk__in=[p.id for p in postings]).values_list('id', flat=True))
+            inserted = [p for p in postings if p.id not in existing_ids]
+            # Conflicts can still come from another process inserting concurrently. Its
+            # posting of the same id has the same title and city, so the tokens it
+            # indexed are skipped rather than failing the whole batch
+            Posting.objects.bulk_create(inserted, ignore_conflicts=True)
+            PostingToken.objects.bulk_create([t for p in inserted for t in p.get_tokens()],
+                ignore_conflicts=True)
+            Posting.employees.through.objects.bulk_create([
+                Posting.employees.through(posting_id=p.id, profile_id=profile.pk)
+                for p in inserted for profile in getattr(p, 'matched_profiles', [])],
+                ignore_conflicts=True)
+        return inserted, len(postings) - len(inserted)
+
     def get_image_url(self):
         if self.image_url is None:
             image = self.generate_image()
@@ -97,4 +236,209 @@ class Posting(models.Model):
 
     def __str__(self):
         return '{:39}{:24}{:24}{}\t{:70}'.format(self.title[:35], self.company[:20],
-                self.city[:20], self.date_posted, self.url[:70])
\ No newline at end of file
+                self.city[:20], self.date_posted, self.url[:70])
+
+
+class CompanyTitleVector(models.Model):
+    """Employees of a company with a title and the sum of their vectors
+
+    Shared by every posting of the company and title, and regenerated from LinkedIn
+    once older than COMPANY_TITLE_VECTOR_TTL_DAYS.
+    """
+    company = models.CharField(max_length=64)
+    search_title = models.CharField(max_length=16)
+    vector_sum = models.BinaryField(blank=True, default=b'')
+    num_employees = models.IntegerField(default=0)
+    employees = models.ManyToManyField(Profile, blank=True)
+    updated = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('company', 'search_title')
+
+    def normalize(company):
+        return ' '.join(company.lower().split())[:64]
+
+    def get_fresh(company, search_title):
+        """Returns the aggregate of a company and title, None if missing or expired"""
+        expiry = timezone.now() - timedelta(days=COMPANY_TITLE_VECTOR_TTL_DAYS)
+        return CompanyTitleVector.objects.filter(
+            company=CompanyTitleVector.normalize(company), search_title=search_title,
+            updated__gt=expiry).first()
+
+    def generate(company, search_title, num_profiles, linkedin):
+        """Looks up and vectorizes the employees of a company with a title, and stores them
+
+        Parameters:
+            company (str): the company of the postings
+            search_title (str): the title the postings were searched with
+            num_profiles (int): number of profiles
+            linkedin (LinkedIn): used to find the employees
+
+        Returns:
+            CompanyTitleVector: the stored aggregate
+        """
+        profiles = linkedin.get_profiles(company, search_title, num_profiles)
+        prefetch_profiles(profiles)
+
+        matched_profiles = []
+        exp_start_dates = []
+        for p in profiles:
+            exp_start_date = p.get_experience_start_date(company, search_title)
+            if exp_start_date:
+                matched_profiles.append(p)
+                exp_start_dates.append(exp_start_date)
+
+        vector_sum = b''
+        if matched_profiles:
+            vector_sum = encode_vector(
+                vectorize_profiles(matched_profiles, exp_start_dates).sum(axis=0))
+        company = CompanyTitleVector.normalize(company)
+        for attempt in range(2):
+            try:
+                # The row stays locked until its employees are replaced, so concurrent
+                # vectorize workers don't interleave their updates
+                with transaction.atomic():
+                    aggregate = CompanyTitleVector.get_for_update(company, search_title)
+                    if aggregate is None:
+                        aggregate = CompanyTitleVector(company=company,
+                            search_title=search_title)
+                    aggregate.vector_sum = vector_sum
+                    aggregate.num_employees = len(matched_profiles)
+                    aggregate.updated = timezone.now()
+                    aggregate.save()
+                    aggregate.employees.set(matched_profiles)
+                break
+            except IntegrityError:
+                # Another worker inserted the company and title first, update its row
+                if attempt:
+                    raise
+                logger.info("{} {} was inserted concurrently".format(company, search_title))
+        aggregate.matched_profiles = matched_profiles
+        return aggregate
+
+    def add_employees(self, profiles, vectors):
+        """Folds employees found since the aggregate was generated into it
+
+        The aggregate isn't marked fresher, it is still regenerated from LinkedIn once
+        older than COMPANY_TITLE_VECTOR_TTL_DAYS.
+
+        Parameters:
+            profiles (List (Profile)): the new employees
+            vectors (np.ndarray): their vectors in rows
+        """
+        vector_sum = vectors.sum(axis=0)
+        if self.vector_sum and self.num_employees > 0:
+            vector_sum = decode_vector(self.vector_sum) + vector_sum
+        self.vector_sum = encode_vector(vector_sum)
+        self.num_employees += len(profiles)
+        self.save(update_fields=['vector_sum', 'num_employees'])
+        self.employees.add(*profiles)
+
+    def get_for_update(company, search_title):
+        """Returns the locked aggregate of a normalized company and title, None if missing"""
+        return CompanyTitleVector.objects.select_for_update().filter(company=company,
+            search_title=search_title).first()
+
+    def get_employees(self):
+        if hasattr(self, 'matched_profiles'):
+            return self.matched_profiles
+        return list(self.employees.all())
+
+    def __str__(self):
+        return "{} {}".format(self.company, self.search_title)
+
+
+class PostingToken(models.Model):
+    """Inverted index of the words of posting titles and cities
+
+    Postings are filtered with indexed equality lookups on (field, token) instead of
+    LIKE scans over the posting table. Kept up to date when postings are saved, and
+    rebuilt with `python manage.py index_posting_tokens`.
+    """
+    TITLE = 't'
+    CITY = 'c'
+    FIELD_CHOICES = [(TITLE, 'title'), (CITY, 'city')]
+
+    posting = models.ForeignKey(Posting, on_delete=models.CASCADE)
+    field = models.CharField(max_length=1, choices=FIELD_CHOICES)
+    token = models.CharField(max_length=32)
+
+    class Meta:
+        unique_together = ('posting', 'field', 'token')
+        index_together = ('field', 'token')
+
+    def filter_postings(postings, field, s):
+        """Filters postings to the ones with every token of s in field
+
+        Parameters:
+            postings (QuerySet): the postings to filter
+            field (str): PostingToken.TITLE or PostingToken.CITY
+            s (str): the searched words
+
+        Returns:
+            QuerySet: the filtered postings
+        """
+        for token in tokenize(s):
+            postings = postings.filter(pk__in=PostingToken.objects.filter(
+                field=field, token=token).values('posting_id'))
+        return postings
+
+    def __str__(self):
+        return "{} {}:{}".format(self.posting_id, self.field, self.token)
+
+
+class IngestionWatermark(models.Model):
+    """How far the results of one search are ingested, see IndeedIngestion
+
+    Results are sorted newest first. newest_date and newest_id are the newest card of
+    the last completed crawl of the search, a crawl stops at the first page reaching
+    them. A crawl in progress checkpoints its own newest card and the first page whose
+    postings aren't all saved. An interrupted crawl resumes from that page, and its
+    newest card becomes the watermark once it completes.
+    """
+    source = models.CharField(max_length=16)
+    location = models.CharField(max_length=64)
+    search_title = models.CharField(max_length=16)
+    newest_date = models.DateField(null=True)
+    newest_id = models.CharField(max_length=64, blank=True)
+    crawl_newest_date = models.DateField(null=True)
+    crawl_newest_id = models.CharField(max_length=64, blank=True)
+    resume_page = models.IntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('source', 'location', 'search_title')
+
+    def is_reached(self, date_posted, posting_id):
+        """Returns True if a card is as old as the watermark or older"""
+        if self.newest_date is None:
+            return False
+        return date_posted < self.newest_date or posting_id == self.newest_id
+
+    def checkpoint(self, resume_page, newest_date=None, newest_id=''):
+        """Saves the progress of the crawl in progress
+
+        Parameters:
+            resume_page (int): first page whose postings aren't all saved
+            newest_date (date): date of the newest card of the crawl, kept if not given
+            newest_id (str): id of the newest card of the crawl
+        """
+        if newest_date is not None:
+            self.crawl_newest_date = newest_date
+            self.crawl_newest_id = newest_id
+        self.resume_page = resume_page
+        self.save()
+
+    def complete(self):
+        """Moves the watermark to the newest card of the completed crawl"""
+        if self.crawl_newest_date is not None:
+            self.newest_date = self.crawl_newest_date
+            self.newest_id = self.crawl_newest_id
+        self.crawl_newest_date = None
+        self.crawl_newest_id = ''
+        self.resume_page = 0
+        self.save()
+
+    def __str__(self):
+        return "{} {} {}: {} {}".format(self.source, self.location, self.search_title,
+            self.newest_date, self.newest_id)
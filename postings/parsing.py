@@ -0,0 +1,67 @@
+from bs4 import BeautifulSoup, SoupStrainer
+from bs4.element import Tag
+
+try:
+    import lxml
+    HTML_PARSER = 'lxml'
+except ImportError:
+    HTML_PARSER = 'html.parser'
+
+CARD_CLASS = 'jobsearch-SerpJobCard'
+
+def has_card_class(value):
+    # While straining, the class attribute may not be split into a list yet
+    if isinstance(value, str):
+        value = value.split()
+    return value is not None and CARD_CLASS in value
+
+CARD_STRAINER = SoupStrainer('div', class_=has_card_class)
+
+def parse_cards(html, parser=HTML_PARSER):
+    """Returns the job cards of a result page
+
+    Only the card subtrees are built into tree nodes, the rest of the page (scripts,
+    filters, navigation) is tokenized and dropped.
+
+    Parameters:
+        html (str): the result page
+        parser (str): BeautifulSoup tree builder, lxml if it is installed
+
+    Returns:
+        List (bs4.element.Tag): the card elements, in page order
+    """
+    soup = BeautifulSoup(html, parser, parse_only=CARD_STRAINER)
+    return soup.find_all('div', class_=CARD_CLASS, recursive=False)
+
+def compile_selectors(specs):
+    """Indexes specs of the form {'el': ..., 'tag': 'class', 'attr': ...} by (el, class)
+
+    Returns:
+        Dict ((str, str), str): spec name of every (element name, class) pair
+    """
+    return {(spec['el'], spec['attr']): name for name, spec in specs.items()
+            if spec['tag'] == 'class'}
+
+def find_elements(soup, selectors):
+    """Finds the first element matching each selector in a single walk of soup
+
+    Replaces one find call per selector when many are looked up in the same subtree.
+
+    Parameters:
+        soup (bs4.element.Tag): subtree to search
+        selectors (Dict ((str, str), str)): compiled by compile_selectors
+
+    Returns:
+        Dict (str, bs4.element.Tag): first element found for each spec name
+    """
+    found = {}
+    for element in soup.descendants:
+        if not isinstance(element, Tag):
+            continue
+        for cls in element.get('class', ()):
+            name = selectors.get((element.name, cls))
+            if name is not None and name not in found:
+                found[name] = element
+                if len(found) == len(selectors):
+                    return found
+    return found
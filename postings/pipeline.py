@@ -0,0 +1,123 @@
+from django.db import close_old_connections, connections
+import logging
+import queue
+import threading
+
+logger = logging.getLogger('app')
+
+# Tells a worker to exit
+STOP = object()
+
+class Stage:
+    """A step of a Pipeline, run by num_workers threads reading from a queue
+
+    func(item, emit) processes an item from the queue, and calls emit(output) for every
+    output to pass to the next stage.
+    """
+    def __init__(self, name, func, num_workers, queue_size):
+        self.name = name
+        self.func = func
+        self.num_workers = num_workers
+        # 0 is unbounded
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.threads = []
+        self.num_processed = 0
+        self.num_failed = 0
+
+class Pipeline:
+    """Stages connected by bounded queues, each stage with its own worker threads
+
+    Stages run concurrently, so cheap stages run ahead while a slow stage drains its
+    queue at its own rate. A full queue blocks the stage feeding it, which keeps the
+    number of items in memory bounded by the queue sizes.
+
+    The first queue is unbounded so stages can submit() more work to the first stage,
+    for example the next page of a search, without deadlocking on a full queue. The
+    pipeline is done once every queue is empty and no worker is processing an item.
+    """
+    def __init__(self):
+        self.stages = []
+        self.num_pending = 0
+        self.idle = threading.Condition()
+
+    def add_stage(self, name, func, num_workers=1, queue_size=100):
+        """Appends a stage, see Stage
+
+        Returns:
+            Pipeline: self
+        """
+        if not self.stages:
+            queue_size = 0
+        self.stages.append(Stage(name, func, num_workers, queue_size))
+        return self
+
+    def put(self, stage_index, item):
+        with self.idle:
+            self.num_pending += 1
+        self.stages[stage_index].queue.put(item)
+
+    def submit(self, item):
+        """Adds an item to the first stage, callable from any stage"""
+        self.put(0, item)
+
+    def item_done(self, stage, failed):
+        with self.idle:
+            if failed:
+                stage.num_failed += 1
+            else:
+                stage.num_processed += 1
+            self.num_pending -= 1
+            if self.num_pending == 0:
+                self.idle.notify_all()
+
+    def work(self, stage_index):
+        stage = self.stages[stage_index]
+        if stage_index + 1 < len(self.stages):
+            emit = lambda output: self.put(stage_index + 1, output)
+        else:
+            emit = lambda output: None
+        try:
+            while True:
+                item = stage.queue.get()
+                if item is STOP:
+                    break
+                # Threads keep their own database connection, drop it if it went stale
+                close_old_connections()
+                failed = False
+                try:
+                    stage.func(item, emit)
+                except Exception:
+                    failed = True
+                    logger.exception("{} failed on {}".format(stage.name, item))
+                finally:
+                    # Outputs were counted by emit before the item is released
+                    self.item_done(stage, failed)
+        finally:
+            connections.close_all()
+
+    def run(self, items):
+        """Feeds items to the first stage and returns once every stage is done
+
+        Parameters:
+            items (Iterable): inputs of the first stage
+        """
+        for i, stage in enumerate(self.stages):
+            for j in range(stage.num_workers):
+                thread = threading.Thread(target=self.work, args=(i,),
+                    name='{}-{}'.format(stage.name, j), daemon=True)
+                thread.start()
+                stage.threads.append(thread)
+
+        for item in items:
+            self.submit(item)
+        with self.idle:
+            while self.num_pending > 0:
+                self.idle.wait()
+
+        for stage in self.stages:
+            for _ in stage.threads:
+                stage.queue.put(STOP)
+            for thread in stage.threads:
+                thread.join()
+            logger.info("{}: {} processed, {} failed".format(stage.name,
+                stage.num_processed, stage.num_failed))
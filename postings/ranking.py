@@ -0,0 +1,127 @@
+import numpy as np
+import logging
+from .models import Posting
+from .vector_store import get_posting_vectors, read_posting_vectors
+from profiles.models import Profile
+
+logger = logging.getLogger('app')
+
+def top_k(query, matrix, norms, k):
+    """Returns the k rows of matrix with the highest cosine similarity to query
+
+    Every row is scored with a single matrix-vector product, and only the best k are
+    sorted.
+
+    Parameters:
+        query (np.ndarray): vector of length d
+        matrix (np.ndarray): candidate vectors of shape (n, d)
+        norms (np.ndarray): L2 norm of every row of matrix
+        k (int): number of rows to return
+
+    Returns:
+        (np.ndarray, np.ndarray): indices of the best rows, best first, and their scores
+    """
+    k = min(k, len(matrix))
+    if k <= 0:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float32)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores = matrix.dot(query) / (norms * np.linalg.norm(query))
+    # Zero vectors have no direction, rank them last
+    scores[~np.isfinite(scores)] = -np.inf
+
+    if k < len(scores):
+        rows = np.argpartition(-scores, k - 1)[:k]
+    else:
+        rows = np.arange(len(scores))
+    rows = rows[np.argsort(-scores[rows], kind='stable')]
+    return rows, scores[rows]
+
+class PostingVectors:
+    """Vectors of many postings stacked into one matrix, with their norms"""
+    def __init__(self, ids, matrix, norms):
+        self.ids = ids
+        self.matrix = matrix
+        self.norms = norms
+
+    def empty():
+        return PostingVectors([], np.empty((0, 0), dtype=np.float32),
+            np.empty(0, dtype=np.float32))
+
+    def from_postings(postings, snapshot=None, projection=None):
+        """Loads the vectors of a queryset of postings
+
+        Vectors are read from the memory-mapped posting vector store, and only the
+        postings missing from it are read from the database.
+
+        Parameters:
+            postings (QuerySet): postings with vectors
+            snapshot (VectorStoreSnapshot): store to read, the latest one if not given
+            projection (VectorProjection): loads the reduced vectors of this projection
+                instead of the full vectors
+        """
+        if snapshot is None:
+            snapshot = get_posting_vectors(projection)
+        if len(snapshot) == 0:
+            return PostingVectors.from_database(postings, projection)
+        expected_dim = Profile.VECTOR_LEN if projection is None else projection.dims
+        if snapshot.dim != expected_dim:
+            logger.warning("Posting vector store has vectors of length {}, expected {}. "
+                "Rebuild it with `python manage.py build_posting_vectors`.".format(
+                    snapshot.dim, expected_dim))
+            return PostingVectors.from_database(postings, projection)
+
+        rows, found_ids, missing_ids = snapshot.get_rows(postings.values_list('id', flat=True))
+        parts = [PostingVectors(found_ids, snapshot.matrix[rows], snapshot.norms[rows])]
+        # Chunked to stay under the SQLite limit of query parameters
+        for i in range(0, len(missing_ids), 500):
+            parts.append(PostingVectors.from_database(
+                postings.filter(pk__in=missing_ids[i:i + 500]), projection))
+        return PostingVectors.concatenate(parts)
+
+    def from_database(postings, projection=None):
+        """Loads the vectors of a queryset of postings without building Posting objects
+
+        Postings whose vector can't be decoded are logged and left out.
+
+        Parameters:
+            postings (QuerySet): postings with vectors
+            projection (VectorProjection): loads the reduced vectors of this projection
+                instead, projecting the vectors that weren't yet
+        """
+        ids = []
+        vectors = []
+        norms = []
+        for posting_id, vector, vector_norm in read_posting_vectors(postings, projection):
+            ids.append(posting_id)
+            vectors.append(vector)
+            norms.append(np.nan if vector_norm is None else vector_norm)
+
+        if not vectors:
+            return PostingVectors.empty()
+
+        matrix = np.stack(vectors).astype(np.float32, copy=False)
+        norms = np.array(norms, dtype=np.float32)
+        # Postings stored before norms were precomputed
+        missing = np.isnan(norms)
+        if missing.any():
+            norms[missing] = np.linalg.norm(matrix[missing], axis=1)
+        return PostingVectors(ids, matrix, norms)
+
+    def concatenate(parts):
+        parts = [p for p in parts if len(p)]
+        if not parts:
+            return PostingVectors.empty()
+        if len(parts) == 1:
+            return parts[0]
+        return PostingVectors([i for p in parts for i in p.ids],
+            np.concatenate([p.matrix for p in parts]),
+            np.concatenate([p.norms for p in parts]))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def top_k(self, query, k):
+        """Returns the ids of the k postings most similar to query, best first"""
+        rows, scores = top_k(query, self.matrix, self.norms, k)
+        return [self.ids[r] for r in rows], scores
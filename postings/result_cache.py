@@ -0,0 +1,110 @@
+from django.core.cache import caches
+from .geo import gazetteer, normalize_place_name
+from constants import GEO_SEARCH_RADIUS_KM
+from datetime import date
+import hashlib
+import uuid
+import logging
+
+logger = logging.getLogger('app')
+
+def get_result_cache():
+    return caches['results']
+
+def normalize(s):
+    """Normalizes a search term so equivalent searches share a cache entry"""
+    return ' '.join(s.lower().split())
+
+def get_search_city(location):
+    """Returns the gazetteer name of a searched location, the location itself if it
+    isn't in the gazetteer
+
+    Ingestion invalidates gazetteer names, so 'montreal' and 'Montréal, QC' share
+    the generation of 'Montréal'.
+    """
+    place = gazetteer.parse(location) if location else None
+    return place.name if place else location
+
+def get_city_key(city):
+    return 'city-generation:' + hashlib.sha1(normalize_place_name(city).encode('utf-8')).hexdigest()
+
+def get_ranked_key(user_id, profile_id, title, location):
+    search = hashlib.sha1('{}\n{}'.format(normalize(title),
+        normalize_place_name(get_search_city(location)))
+        .encode('utf-8')).hexdigest()
+    return 'ranked:{}:{}:{}:{}'.format(user_id, profile_id, search, date.today())
+
+def get_ranked_ids(user_id, profile_id, title, location):
+    """Returns the cached ranked posting ids of a search, None if not cached or stale
+
+    An entry is stale once postings were ingested in the searched location or in any
+    city of its results, see invalidate_cities, or once the generation of one of these
+    cities was culled from the cache.
+
+    Parameters:
+        user_id (str): id of the messenger user
+        profile_id (str): id of the user's profile, results change with the profile
+        title (str): the searched title
+        location (str): the searched location
+
+    Returns:
+        List (str): ranked posting ids
+    """
+    cache = get_result_cache()
+    entry = cache.get(get_ranked_key(user_id, profile_id, title, location))
+    if entry is None:
+        return None
+
+    generations, ranked_ids = entry
+    current = cache.get_many(list(generations))
+    # Generations are written when the entry is set, so one that is missing now was
+    # culled and may have been invalidated since
+    if any(v is None or current.get(k) != v for k, v in generations.items()):
+        logger.info("Cached results of {} are stale".format(user_id))
+        return None
+    return ranked_ids
+
+def set_ranked_ids(user_id, profile_id, title, location, ranked_ids, cities):
+    """Caches the ranked posting ids of a search
+
+    Parameters:
+        ranked_ids (List (str)): ranked posting ids
+        cities (Iterable (str)): cities of the ranked postings
+    """
+    cache = get_result_cache()
+    city_keys = {get_city_key(c) for c in cities} | {get_city_key(get_search_city(location))}
+    current = cache.get_many(list(city_keys))
+    for k in city_keys - set(current):
+        # add keeps a generation written concurrently by invalidate_cities
+        cache.add(k, uuid.uuid4().hex, timeout=None)
+    current = cache.get_many(list(city_keys))
+    generations = {k: current.get(k) for k in city_keys}
+    cache.set(get_ranked_key(user_id, profile_id, title, location), (generations, ranked_ids))
+
+def invalidate_cities(cities):
+    """Makes the cached results of searches in or returning these cities stale
+
+    Parameters:
+        cities (Iterable (str)): cities where postings were ingested
+    """
+    # A new random generation, unlike a counter, can't return to a value seen by an
+    # entry if the generation is evicted
+    generation = uuid.uuid4().hex
+    get_result_cache().set_many({get_city_key(c): generation for c in set(cities)},
+        timeout=None)
+
+def get_invalidated_cities(postings):
+    """Returns the cities whose search results may include the given postings
+
+    Searches match the postings within GEO_SEARCH_RADIUS_KM, so the gazetteer cities
+    around a posting are returned along with its own city.
+
+    Parameters:
+        postings (Iterable (Posting)): postings that were ingested or updated
+    """
+    cities = {p.city for p in postings}
+    for latitude, longitude in {(p.latitude, p.longitude) for p in postings
+                                if p.latitude is not None}:
+        cities.update(place.name for place in gazetteer.get_nearby(latitude, longitude,
+            GEO_SEARCH_RADIUS_KM))
+    return cities
@@ -0,0 +1,10 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from .models import Posting
+
+@receiver(post_save, sender=Posting)
+def index_posting_tokens(sender, instance, update_fields=None, **kwargs):
+    """Reindexes the title and city tokens of a saved posting"""
+    if update_fields is not None and not {'title', 'city'} & set(update_fields):
+        return
+    instance.index_tokens()
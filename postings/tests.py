@@ -1,9 +1,716 @@
-from django.test import TestCase
-from .models import Posting
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.db import DataError, OperationalError
+from django.utils import timezone
+from unittest import mock
+from datetime import date, timedelta
+from .models import Posting, PostingToken, CompanyTitleVector, IngestionWatermark
+from .tokens import tokenize
+from .titles import embed_titles, iter_title_vectors, search_titles
+from .geo import gazetteer, filter_radius, get_geo_cell, get_geo_cells
+from .ranking import top_k, PostingVectors
+from .vector_store import PostingVectorStore
+from .ann import LSHIndex
+from .upgrades import upgrade_posting_vectors
+from .fetch import Fetcher
+from .async_fetch import TokenBucket, Response
+from .pipeline import Pipeline
+from .dedupe import PostingIdSet
+from .parsing import parse_cards
+from .ingestions import IndeedIngestion, IndeedJobAd, SearchCrawl
+from profiles.models import Profile, VectorProjection
+from profiles.projection import fit_projection
+from profiles.vectorize import vectorize_profiles
+from utils.vector_encoding import encode_vector, decode_vector, HEADER
+from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import asyncio
+import tempfile
+import threading
+import time
 
 
 class ProfileTestCase(TestCase):
     def test_posting_image(self):
         p = Posting.objects.all()[0]
         p.generate_image()
-        
\ No newline at end of file
+
+
+class PostingTokenTestCase(TestCase):
+    def test_tokenize(self):
+        self.assertEqual(tokenize(' Software  Developer, software (C++)'),
+            ['software', 'developer', 'c'])
+        self.assertEqual(tokenize(''), [])
+
+    def test_filter_postings(self):
+        Posting.objects.create(pk='a', title='Senior Software Developer', city='Toronto')
+        Posting.objects.create(pk='b', title='Software Engineer', city='New York')
+        posting = Posting.objects.create(pk='c', title='Developer', city='New Toronto')
+
+        def filter_postings(title, city):
+            postings = PostingToken.filter_postings(Posting.objects.all(), PostingToken.TITLE,
+                title)
+            postings = PostingToken.filter_postings(postings, PostingToken.CITY, city)
+            return sorted(postings.values_list('id', flat=True))
+
+        self.assertEqual(filter_postings('software', ''), ['a', 'b'])
+        self.assertEqual(filter_postings('developer software', 'toronto'), ['a'])
+        self.assertEqual(filter_postings('developer', 'new'), ['c'])
+        self.assertEqual(filter_postings('soft', ''), [])
+
+        # Tokens follow saved changes
+        posting.title = 'Software Developer'
+        posting.save()
+        self.assertEqual(filter_postings('software developer', 'toronto'), ['a', 'c'])
+        posting.delete()
+        self.assertEqual(PostingToken.objects.filter(posting_id='c').count(), 0)
+
+    def test_bulk_insert(self):
+        Posting.objects.create(pk='a', title='Existing')
+        profile = Profile.objects.create(username='ada')
+        new = Posting(pk='b', title='Software Developer', city='Toronto')
+        new.matched_profiles = [profile]
+
+        inserted, num_skipped = Posting.bulk_insert([Posting(pk='a', title='Changed'), new])
+        self.assertEqual(([p.id for p in inserted], num_skipped), (['b'], 1))
+        self.assertEqual(Posting.objects.get(pk='a').title, 'Existing')
+        self.assertEqual(list(Posting.objects.get(pk='b').employees.all()), [profile])
+        self.assertEqual(sorted(PostingToken.objects.filter(posting_id='b').values_list(
+            'field', 'token')), [('c', 'toronto'), ('t', 'developer'), ('t', 'software')])
+
+        # Another process inserts b after the existing ids were read
+        with mock.patch.object(Posting.objects, 'filter', return_value=Posting.objects.none()):
+            inserted, _ = Posting.bulk_insert([Posting(pk='b', title='Software Developer',
+                city='Toronto'), Posting(pk='c', title='Tester')])
+        self.assertEqual(PostingToken.objects.filter(posting_id='b').count(), 3)
+        self.assertEqual(PostingToken.objects.filter(posting_id='c').count(), 1)
+
+
+class TitleSearchTestCase(TestCase):
+    def test_search_titles(self):
+        Posting.objects.create(pk='computer', title='Computer Programmer')
+        Posting.objects.create(pk='science', title='Science Teacher')
+        Posting.objects.create(pk='unknown', title='Barista')
+        with tempfile.TemporaryDirectory() as directory:
+            store = PostingVectorStore(directory)
+            self.assertEqual(store.rebuild(iter_title_vectors(Posting.objects.all())), 2)
+            snapshot = store.reload()
+
+            ids, scores = search_titles('Software', 10, min_similarity=0.8, snapshot=snapshot)
+            self.assertEqual(ids, ['computer'])
+            ids, scores = search_titles('software', 10, min_similarity=0, snapshot=snapshot)
+            self.assertEqual(ids, ['computer', 'science'])
+            self.assertEqual(search_titles('barista', 10, snapshot=snapshot)[0], [])
+            # Only the given postings are candidates, the most similar title isn't among them
+            ids, scores = search_titles('software', 1, min_similarity=0, snapshot=snapshot,
+                posting_ids=['science', 'unknown'])
+            self.assertEqual(ids, ['science'])
+
+        self.assertEqual(embed_titles(['Computer, Science!', 'science computer']).tolist()[0],
+            embed_titles(['science computer']).tolist()[0])
+
+
+class GeoTestCase(TestCase):
+    def test_gazetteer(self):
+        self.assertEqual(gazetteer.lookup('cambridge', 'MA').country, 'usa')
+        self.assertEqual(gazetteer.lookup('Cambridge', country='canada').state, 'ON')
+        self.assertEqual(gazetteer.parse('Montreal, QC').name, 'Montréal')
+        self.assertEqual(gazetteer.parse('North  York').state, 'ON')
+        self.assertIsNone(gazetteer.lookup('Atlantis'))
+        self.assertIn('North York', [p.name for p in gazetteer.get_nearby(43.6532, -79.3832, 30)])
+
+    def test_geo_cells(self):
+        cell = get_geo_cell(43.6532, -79.3832)
+        self.assertIn(cell, get_geo_cells(43.6532, -79.3832, 30))
+        self.assertNotIn(get_geo_cell(45.4215, -75.6972), get_geo_cells(43.6532, -79.3832, 30))
+
+    def test_filter_radius(self):
+        for pk, city, state in [('toronto', 'Toronto', 'ON'), ('north-york', 'North York', 'ON'),
+                                ('hamilton', 'Hamilton', 'ON'), ('nowhere', 'Nowhere', 'ON')]:
+            posting = Posting(pk=pk, city=city, state=state, country='canada')
+            self.assertEqual(posting.geocode(), pk != 'nowhere')
+            posting.save()
+
+        toronto = gazetteer.lookup('Toronto')
+        postings = filter_radius(Posting.objects.all(), toronto.latitude, toronto.longitude, 30)
+        self.assertEqual(sorted(postings.values_list('id', flat=True)), ['north-york', 'toronto'])
+        postings = filter_radius(Posting.objects.all(), toronto.latitude, toronto.longitude, 60)
+        self.assertEqual(postings.count(), 3)
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'results': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+})
+class UpgradeTestCase(TestCase):
+    def add_employee(self, username, start_date):
+        profile = Profile.objects.create(username=username)
+        profile.experience_set.create(company='Acme Inc', title='Software Developer',
+            start_date=start_date, end_date=date(2021, 1, 1), is_current=True)
+        return profile
+
+    def test_add_employee_vectors(self):
+        posting = Posting(pk='test')
+        vectors = np.arange(8, dtype=np.float32).reshape(4, 2)
+        posting.add_employee_vectors(vectors[:2])
+        self.assertEqual((posting.num_employees, posting.vector), (2, b''))
+        posting.add_employee_vectors(vectors[2:])
+        self.assertEqual(posting.num_employees, 4)
+        self.assertEqual(posting.get_vector().tolist(), [3, 4])
+        self.assertEqual(decode_vector(posting.vector_sum).tolist(), [12, 16])
+
+    def test_company_title_vector(self):
+        employees = [self.add_employee('employee-{}'.format(i), date(2019, i + 1, 1))
+                     for i in range(3)]
+        linkedin = mock.Mock()
+        linkedin.get_profiles.return_value = employees
+
+        first = Posting(pk='first', company='Acme', search_title='developer')
+        self.assertTrue(first.generate_vector(5, linkedin))
+        # Postings of the same company and title reuse the stored employees
+        second = Posting(pk='second', company='ACME ', search_title='developer')
+        self.assertTrue(second.generate_vector(5, linkedin))
+        self.assertEqual(linkedin.get_profiles.call_count, 1)
+        self.assertEqual(second.vector, first.vector)
+        self.assertEqual(set(second.matched_profiles), set(employees))
+
+        CompanyTitleVector.objects.update(updated=date(2020, 1, 1))
+        Posting(pk='third', company='Acme', search_title='developer').generate_vector(5, linkedin)
+        self.assertEqual(linkedin.get_profiles.call_count, 2)
+        self.assertEqual(CompanyTitleVector.objects.get().employees.count(), 3)
+
+    def test_company_title_vector_concurrent_insert(self):
+        linkedin = mock.Mock()
+        linkedin.get_profiles.return_value = [self.add_employee('employee', date(2019, 1, 1))]
+        other = CompanyTitleVector.objects.create(company='acme', search_title='developer',
+            updated=timezone.now())
+
+        # Another worker inserts the row after this one found it missing
+        with mock.patch.object(CompanyTitleVector, 'get_for_update', side_effect=[None, other]):
+            aggregate = CompanyTitleVector.generate('Acme', 'developer', 5, linkedin)
+        self.assertEqual(aggregate.pk, other.pk)
+        self.assertEqual(CompanyTitleVector.objects.get().num_employees, 1)
+        self.assertEqual(CompanyTitleVector.objects.get().employees.count(), 1)
+
+    @mock.patch('postings.upgrades.invalidate_cities')
+    @mock.patch('postings.upgrades.sync_posting_vectors')
+    def test_upgrade_company_title_vector(self, sync_posting_vectors, invalidate_cities):
+        linkedin = mock.Mock()
+        linkedin.get_profiles.return_value = [self.add_employee('employee-0', date(2019, 1, 1))]
+        posting = Posting(pk='test', company='Acme', search_title='developer')
+        self.assertFalse(posting.generate_vector(5, linkedin))
+        posting.save()
+        posting.employees.set(posting.matched_profiles)
+
+        employees = [self.add_employee('employee-{}'.format(i), date(2019, i + 1, 1))
+                     for i in range(1, 3)]
+        self.assertEqual([p.pk for p in upgrade_posting_vectors()], ['test'])
+        # Postings ingested later reuse the employees found by the upgrade
+        aggregate = CompanyTitleVector.get_fresh('Acme', 'developer')
+        self.assertEqual((aggregate.num_employees, aggregate.employees.count()), (3, 3))
+        posting.refresh_from_db()
+        np.testing.assert_allclose(decode_vector(aggregate.vector_sum),
+            decode_vector(posting.vector_sum), rtol=1e-5)
+
+    @mock.patch('postings.upgrades.invalidate_cities')
+    @mock.patch('postings.upgrades.sync_posting_vectors')
+    def test_upgrade_posting_vectors(self, sync_posting_vectors, invalidate_cities):
+        posting = Posting(pk='test', company='Acme', search_title='developer',
+            city='Toronto', state='ON', country='canada', num_employees=0)
+        posting.geocode()
+        posting.save()
+        employees = [self.add_employee('employee-{}'.format(i), date(2019, i + 1, 1))
+                     for i in range(2)]
+        self.assertEqual(upgrade_posting_vectors(), [])
+        posting.refresh_from_db()
+        self.assertEqual(posting.num_employees, 2)
+        self.assertFalse(posting.vector)
+
+        employees.append(self.add_employee('employee-2', date(2019, 3, 1)))
+        with mock.patch.object(Posting, 'index_tokens') as index_tokens:
+            self.assertEqual([p.pk for p in upgrade_posting_vectors()], ['test'])
+        index_tokens.assert_not_called()
+        sync_posting_vectors.assert_called_once()
+        # Searches of nearby cities match the posting too
+        self.assertIn('North York', invalidate_cities.call_args[0][0])
+        posting.refresh_from_db()
+        self.assertEqual(posting.num_employees, 3)
+        self.assertEqual(posting.employees.count(), 3)
+        expected = vectorize_profiles(employees,
+            [date(2019, 1, 1), date(2019, 2, 1), date(2019, 3, 1)]).mean(axis=0)
+        np.testing.assert_allclose(posting.get_vector(), expected, rtol=1e-5)
+
+        # Postings with vectors are left alone
+        self.add_employee('employee-3', date(2019, 4, 1))
+        self.assertEqual(upgrade_posting_vectors(), [])
+        posting.refresh_from_db()
+        self.assertEqual(posting.num_employees, 3)
+
+
+class FetcherTestCase(TestCase):
+    def test_fetch_per_host(self):
+        in_flight = {'a': 0, 'b': 0}
+        max_in_flight = {'a': 0, 'b': 0}
+        lock = threading.Lock()
+
+        def get(url, timeout):
+            host = url.split('/')[2]
+            with lock:
+                in_flight[host] += 1
+                max_in_flight[host] = max(max_in_flight[host], in_flight[host])
+            time.sleep(0.01)
+            with lock:
+                in_flight[host] -= 1
+            return url
+
+        urls = ['https://{}/{}'.format(host, i) for i in range(10) for host in 'ab']
+        # Called from the threads of the fetch stage
+        with Fetcher(max_workers=6, max_per_host=2) as fetcher, \
+                ThreadPoolExecutor(max_workers=6) as executor:
+            with mock.patch.object(fetcher.session, 'get', side_effect=get):
+                results = list(executor.map(fetcher.fetch, urls))
+        self.assertEqual(results, urls)
+        self.assertEqual(max_in_flight, {'a': 2, 'b': 2})
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=100, capacity=5)
+
+        async def acquire_all():
+            start = time.monotonic()
+            await asyncio.gather(*[bucket.acquire() for _ in range(15)])
+            return time.monotonic() - start
+
+        # 5 tokens right away, then 10 at 100 per second
+        elapsed = asyncio.run(acquire_all())
+        self.assertGreaterEqual(elapsed, 0.09)
+        self.assertLess(elapsed, 1)
+
+
+class PipelineTestCase(TestCase):
+    def test_pipeline(self):
+        in_flight = []
+        outputs = []
+
+        def expand(n, emit):
+            # Feedback to the first stage
+            if n < 3:
+                pipeline.submit(n + 10)
+            for i in range(3):
+                emit((n, i))
+
+        def slow(item, emit):
+            in_flight.append(item)
+            time.sleep(0.001)
+            emit(item)
+
+        def fail_or_collect(item, emit):
+            if item == (1, 1):
+                raise ValueError(item)
+            outputs.append(item)
+
+        pipeline = Pipeline().add_stage('expand', expand, 2) \
+            .add_stage('slow', slow, 1, queue_size=2) \
+            .add_stage('collect', fail_or_collect, 1, queue_size=2)
+        pipeline.run(range(5))
+
+        expected = {(n, i) for n in list(range(5)) + [10, 11, 12] for i in range(3)}
+        self.assertEqual(set(outputs), expected - {(1, 1)})
+        self.assertEqual(len(in_flight), len(expected))
+        self.assertEqual([(s.num_processed, s.num_failed) for s in pipeline.stages],
+            [(8, 0), (24, 0), (23, 1)])
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'results': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+})
+@mock.patch('postings.ingestions.sync_posting_vectors')
+@mock.patch('postings.ingestions.sync_title_vectors')
+class IngestionTestCase(TransactionTestCase):
+    CARD = '''<div class="jobsearch-SerpJobCard">
+        <a class="jobtitle" href="/rc/clk?jk={id}">{title}</a>
+        <span class="company">Acme</span>
+        <span class="date">{date}</span>
+        <div class="summary">Build things</div>
+        <span class="location">Toronto, ON</span>
+    </div>'''
+
+    def get_page(self, titles, posted='Today'):
+        cards = [self.CARD.format(id=i, title=t, date=posted) for i, t in enumerate(titles)]
+        return mock.Mock(status_code=200, text='<html>' + ''.join(cards) + '</html>')
+
+    def get_response(self, pages, url, detail='<html></html>'):
+        """Returns the page of pages keyed by (location, page number), empty if missing, or
+        detail for the detail page of a posting"""
+        if '&l=' not in url:
+            return mock.Mock(status_code=200, text=detail)
+        location = url.split('&l=')[1].split('&')[0]
+        page_num = int(url.split('&start=')[1]) // 50
+        return pages.get((location, page_num), self.get_page([]))
+
+    def test_ingest_jobs(self, sync_title_vectors, sync_posting_vectors):
+        Posting.objects.create(pk='existing', title='Existing')
+        Posting.objects.create(pk='analyst-acme-toronto-{}'.format(date.today()))
+        pages = {('toronto', 0): self.get_page(['Developer', 'Tester', 'Developer', 'Analyst']),
+                 ('ottawa', 0): mock.Mock(status_code=503)}
+        ingestion = IndeedIngestion(ca_locations=['toronto', 'ottawa'], us_locations=[],
+            titles=['developer'])
+        linkedin = mock.Mock()
+        linkedin.get_profiles.return_value = []
+
+        with mock.patch('postings.ingestions.Fetcher.fetch',
+                        side_effect=lambda url: self.get_response(pages, url)), \
+                mock.patch.object(IndeedIngestion, 'get_linkedin', return_value=linkedin), \
+                mock.patch.object(IndeedJobAd, 'to_model', autospec=True,
+                                  side_effect=IndeedJobAd.to_model) as to_model:
+            ingestion.ingest_jobs()
+
+        saved_ids = sorted(p.id for p in ingestion.saved_postings)
+        self.assertEqual(saved_ids, ['developer-acme-toronto-{}'.format(date.today()),
+                                     'tester-acme-toronto-{}'.format(date.today())])
+        # Duplicate and known cards are dropped before their model is built
+        self.assertEqual(to_model.call_count, 2)
+        self.assertEqual(Posting.objects.count(), 4)
+        self.assertEqual(Posting.objects.get(pk=saved_ids[0]).latitude, 43.6532)
+        # Only async ingestion fetches detail pages
+        self.assertEqual(Posting.objects.get(pk=saved_ids[0]).description, 'Build things')
+        sync_posting_vectors.assert_called_once()
+
+        # The crawl of toronto completed, ottawa will be retried from its first page
+        watermark = IngestionWatermark.objects.get(location='toronto')
+        self.assertEqual((watermark.newest_date, watermark.newest_id, watermark.resume_page),
+            (date.today(), saved_ids[0], 0))
+        watermark = IngestionWatermark.objects.get(location='ottawa')
+        self.assertEqual((watermark.newest_date, watermark.resume_page), (None, 0))
+
+    def test_ingest_jobs_vectorize_failure(self, sync_title_vectors, sync_posting_vectors):
+        pages = {('toronto', 0): self.get_page(['Developer', 'Tester'])}
+        ingestion = IndeedIngestion(ca_locations=['toronto'], us_locations=[],
+            titles=['developer'])
+        linkedin = mock.Mock()
+        linkedin.get_profiles.side_effect = Exception('LinkedIn is down')
+
+        with mock.patch('postings.ingestions.Fetcher.fetch',
+                        side_effect=lambda url: self.get_response(pages, url)), \
+                mock.patch.object(IndeedIngestion, 'get_linkedin', return_value=linkedin):
+            ingestion.ingest_jobs()
+
+        # Saved without vectors, so the crawl still completes
+        self.assertEqual(sorted(Posting.objects.values_list('num_employees', flat=True)),
+            [0, 0])
+        watermark = IngestionWatermark.objects.get(location='toronto')
+        self.assertEqual((watermark.newest_date, watermark.resume_page), (date.today(), 0))
+
+    def test_ingest_jobs_num_prev_days(self, sync_title_vectors, sync_posting_vectors):
+        pages = {('toronto', 0): self.get_page(['Developer']),
+                 ('toronto', 1): self.get_page(['Tester'], posted='5 days ago'),
+                 ('toronto', 2): self.get_page(['Designer'])}
+        ingestion = IndeedIngestion(ca_locations=['toronto'], us_locations=[],
+            titles=['developer'])
+        linkedin = mock.Mock()
+        linkedin.get_profiles.return_value = []
+
+        fetch = mock.Mock(side_effect=lambda url: self.get_response(pages, url))
+        with mock.patch('postings.ingestions.Fetcher.fetch', fetch), \
+                mock.patch.object(IndeedIngestion, 'get_linkedin', return_value=linkedin):
+            ingestion.ingest_jobs(3)
+
+        # Stopped at the first page with a card older than 3 days, without saving it
+        self.assertEqual([c[0][0].split('&start=')[1] for c in fetch.call_args_list],
+            ['0', '50'])
+        self.assertEqual([p.title for p in ingestion.saved_postings], ['Developer'])
+
+    def test_resume_crawl(self, sync_title_vectors, sync_posting_vectors):
+        today = date.today()
+        IngestionWatermark.objects.create(source='indeed', location='toronto',
+            search_title='developer', newest_date=today - timedelta(days=3), newest_id='w',
+            crawl_newest_date=today - timedelta(days=1), crawl_newest_id='c', resume_page=2)
+        pages = {('toronto', 2): self.get_page(['Developer'], posted='2 days ago'),
+                 ('toronto', 3): self.get_page(['Designer', 'Tester'], posted='5 days ago')}
+        ingestion = IndeedIngestion(ca_locations=['toronto'], us_locations=[],
+            titles=['developer'])
+        linkedin = mock.Mock()
+        linkedin.get_profiles.return_value = []
+
+        fetch = mock.Mock(side_effect=lambda url: self.get_response(pages, url))
+        with mock.patch('postings.ingestions.Fetcher.fetch', fetch), \
+                mock.patch.object(IndeedIngestion, 'get_linkedin', return_value=linkedin):
+            ingestion.ingest_jobs()
+
+        # Resumed at the checkpoint and stopped at the page older than the watermark
+        self.assertEqual([c[0][0].split('&start=')[1] for c in fetch.call_args_list],
+            ['100', '150'])
+        self.assertEqual(len(ingestion.saved_postings), 3)
+        watermark = IngestionWatermark.objects.get(location='toronto')
+        self.assertEqual((watermark.newest_date, watermark.newest_id, watermark.resume_page,
+            watermark.crawl_newest_date), (today - timedelta(days=1), 'c', 0, None))
+
+    def test_search_crawl(self, sync_title_vectors, sync_posting_vectors):
+        watermark = IngestionWatermark.objects.create(source='indeed', location='toronto',
+            search_title='developer')
+        crawl = SearchCrawl(watermark)
+        crawl.page_parsed(0, 2, (date.today(), 'a'), False)
+        crawl.page_parsed(1, 0, (date.today(), 'b'), False)
+        crawl.page_parsed(2, 1, None, True)
+        watermark.refresh_from_db()
+        self.assertEqual((watermark.crawl_newest_id, watermark.resume_page), ('a', 0))
+
+        # Page 0 is done once both its postings are saved
+        crawl.posting_saved(0)
+        crawl.posting_saved(0)
+        watermark.refresh_from_db()
+        self.assertEqual((watermark.newest_id, watermark.resume_page), ('', 2))
+        crawl.posting_saved(2)
+        watermark.refresh_from_db()
+        self.assertEqual((watermark.newest_id, watermark.crawl_newest_id,
+            watermark.resume_page), ('a', '', 0))
+
+    def test_ingest_jobs_async(self, sync_title_vectors, sync_posting_vectors):
+        detail = '<div class="jobsearch-JobComponent-description"> Full\n description </div>'
+        pages = {('toronto', 0): self.get_page(['Developer', 'Tester'])}
+        linkedin = mock.Mock()
+        linkedin.get_profiles.return_value = []
+        test = self
+
+        class FakeAsyncFetcher:
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *args):
+                pass
+
+            async def fetch(self, url):
+                page = test.get_response(pages, url,
+                    detail if url.endswith('0') else '<html></html>')
+                return Response(url, page.status_code, page.text)
+
+        ingestion = IndeedIngestion(ca_locations=['toronto', 'ottawa'], us_locations=[],
+            titles=['developer'])
+        with mock.patch('postings.ingestions.AsyncFetcher', FakeAsyncFetcher), \
+                mock.patch.object(IndeedIngestion, 'get_linkedin', return_value=linkedin):
+            ingestion.ingest_jobs(use_async=True)
+
+        descriptions = {p.title: p.description for p in Posting.objects.all()}
+        self.assertEqual(descriptions, {'Developer': 'Full description',
+                                        'Tester': 'Build things'})
+
+    def test_flush_postings_retry(self, sync_title_vectors, sync_posting_vectors):
+        ingestion = IndeedIngestion(ca_locations=[], us_locations=[], titles=[])
+        ingestion.saved_postings = []
+        ingestion.num_skipped = 0
+        batch = [Posting(pk='test', title='Developer'), Posting(pk='bad')]
+        for posting in batch:
+            posting.search_page = mock.Mock(page_num=0)
+        ingestion.persist_batch = list(batch)
+
+        bulk_insert = Posting.bulk_insert
+        errors = [OperationalError('database is locked')]
+        def insert(postings):
+            if errors:
+                raise errors.pop()
+            if any(p.id == 'bad' for p in postings):
+                raise DataError('value too long')
+            return bulk_insert(postings)
+
+        with mock.patch.object(Posting, 'bulk_insert', side_effect=insert), \
+                mock.patch('postings.ingestions.time.sleep') as sleep:
+            ingestion.flush_postings()
+        # Retried once while locked, then the bad posting was dropped from the batch
+        sleep.assert_called_once()
+        self.assertEqual(ingestion.persist_batch, [])
+        self.assertEqual([p.id for p in ingestion.saved_postings], ['test'])
+        self.assertEqual(list(Posting.objects.values_list('id', flat=True)), ['test'])
+        # Dropped postings don't hold back the checkpoint of their search
+        for posting in batch:
+            posting.search_page.crawl.posting_saved.assert_called_once_with(0)
+
+    def test_posting_id_set(self, sync_title_vectors, sync_posting_vectors):
+        Posting.objects.create(pk='recent')
+        Posting.objects.create(pk='old', date_posted=date.today() - timedelta(days=40))
+        known_ids = PostingIdSet.load_recent(31)
+        self.assertEqual(len(known_ids), 1)
+        self.assertIn('recent', known_ids)
+        self.assertNotIn('old', known_ids)
+        self.assertTrue(known_ids.add('old'))
+        self.assertFalse(known_ids.add('old'))
+
+    def test_parse_description(self, sync_title_vectors, sync_posting_vectors):
+        html = '<div class="jobsearch-JobComponent-description"><p>{}</p></div>'
+        self.assertEqual(IndeedJobAd.parse_description(html.format('Write code')),
+            'Write code')
+        self.assertEqual(len(IndeedJobAd.parse_description(html.format('a ' * 500))), 256)
+        self.assertIsNone(IndeedJobAd.parse_description('<html></html>'))
+
+
+class ParsingTestCase(TestCase):
+    def test_parse_cards(self):
+        with open('postings/data/pages/indeed_search.html', 'r', encoding='utf-8') as f:
+            html = f.read()
+        cards = parse_cards(html)
+        self.assertEqual(len(cards), 50)
+        self.assertEqual([c.decode() for c in cards],
+            [c.decode() for c in BeautifulSoup(html, 'html.parser').find_all(
+                'div', {'class': 'jobsearch-SerpJobCard'})])
+
+        # Sponsored cards are skipped
+        ads = [IndeedJobAd(card, 'canada', 'developer') for card in cards]
+        valid_ads = [ad for ad in ads if ad.valid]
+        self.assertEqual(len(valid_ads), 45)
+        self.assertEqual((valid_ads[0].company, valid_ads[0].city, valid_ads[0].state),
+            ('Shopify', 'Toronto', 'ON'))
+
+
+class RankingTestCase(TestCase):
+    def test_top_k(self):
+        query = np.array([1, 0], dtype=np.float32)
+        matrix = np.array([[0, 1], [1, 1], [2, 0], [0, 0], [-1, 0]], dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1)
+
+        rows, scores = top_k(query, matrix, norms, 2)
+        self.assertEqual(rows.tolist(), [2, 1])
+        np.testing.assert_allclose(scores, [1, np.sqrt(0.5)], rtol=1e-6)
+
+        rows, scores = top_k(query, matrix, norms, 10)
+        self.assertEqual(rows.tolist(), [2, 1, 0, 4, 3])
+        self.assertEqual(len(top_k(query, matrix[:0], norms[:0], 3)[0]), 0)
+
+
+
+class ProjectionTestCase(TestCase):
+    def test_reduced_vectors(self):
+        # Vectors spanning 2 dimensions are projected without loss
+        rng = np.random.RandomState(0)
+        basis = rng.standard_normal((2, Profile.VECTOR_LEN))
+        vectors = rng.standard_normal((50, 2)).dot(basis).astype(np.float32)
+        components, explained_variance = fit_projection([vectors[:20], vectors[20:]], 2)
+        self.assertEqual(components.shape, (2, Profile.VECTOR_LEN))
+        self.assertAlmostEqual(explained_variance, 1, places=5)
+
+        projection = VectorProjection.objects.create(input_len=Profile.VECTOR_LEN, dims=2,
+            components=encode_vector(components.ravel()), explained_variance=explained_variance)
+        self.assertEqual(VectorProjection.get_active(), projection)
+        reduced = projection.project(vectors)
+        np.testing.assert_allclose(reduced.dot(reduced.T), vectors.dot(vectors.T), rtol=1e-3,
+            atol=1e-2)
+
+        for i in range(3):
+            posting = Posting(pk=str(i), num_employees=3)
+            posting.set_vector(vectors[i], projection if i < 2 else None)
+            posting.save()
+
+        # Full vectors are only read for the posting without a reduced vector
+        with self.assertNumQueries(2):
+            candidates = PostingVectors.from_database(Posting.objects.all(), projection)
+        self.assertEqual(candidates.matrix.shape, (3, 2))
+        for posting_id, vector in zip(candidates.ids, candidates.matrix):
+            np.testing.assert_allclose(vector, reduced[int(posting_id)], rtol=1e-5)
+        self.assertEqual(candidates.top_k(reduced[1], 1)[0], ['1'])
+
+
+class VectorEncodingTestCase(TestCase):
+    def test_round_trip(self):
+        vector = np.arange(5, dtype=np.float64) / 3
+        blob = encode_vector(vector)
+        self.assertEqual(len(blob), HEADER.size + 5 * 4)
+
+        decoded = decode_vector(blob)
+        self.assertEqual(decoded.dtype, np.float32)
+        self.assertFalse(decoded.flags.owndata)
+        self.assertFalse(decoded.flags.writeable)
+        np.testing.assert_array_equal(decoded, vector.astype(np.float32))
+        np.testing.assert_array_equal(decode_vector(memoryview(blob)), decoded)
+
+    def test_invalid_blobs(self):
+        blob = encode_vector(np.ones(3))
+        for invalid in [b'', np.ones(3).dumps(), blob[:-1], blob[:2] + b'\x09' + blob[3:]]:
+            with self.assertRaises(ValueError):
+                decode_vector(invalid)
+
+    def test_posting_vector(self):
+        posting = Posting(pk='test')
+        self.assertIsNone(posting.get_vector())
+        posting.set_vector(np.array([3, 4], dtype=np.float32))
+        posting.save()
+
+        posting = Posting.objects.get(pk='test')
+        self.assertEqual(posting.get_vector().tolist(), [3, 4])
+        self.assertEqual(posting.vector_norm, 5)
+
+
+class PostingVectorStoreTestCase(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.store = PostingVectorStore(self.dir.name)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_upsert_and_rebuild(self):
+        self.assertEqual(len(self.store.reload()), 0)
+        self.assertEqual(self.store.upsert([('a', [3, 4]), ('b', [1, 0])]), 2)
+
+        # Another process sees the changes on reload
+        reader = PostingVectorStore(self.dir.name)
+        snapshot = reader.reload()
+        rows, found_ids, missing_ids = snapshot.get_rows(['b', 'c', 'a'])
+        self.assertEqual((found_ids, missing_ids), (['b', 'a'], ['c']))
+        self.assertEqual(snapshot.matrix[rows].tolist(), [[1, 0], [3, 4]])
+        self.assertEqual(snapshot.norms[rows].tolist(), [1, 5])
+
+        # Updates don't modify a snapshot being read
+        self.assertEqual(self.store.upsert([('a', [0, 2]), ('c', [0, 1])]), 1)
+        self.assertEqual((snapshot.matrix[0].tolist(), snapshot.norms[0]), ([3, 4], 5))
+        snapshot = reader.reload()
+        self.assertEqual(snapshot.ids, ['a', 'b', 'c'])
+        self.assertEqual(snapshot.matrix.tolist(), [[0, 2], [1, 0], [0, 1]])
+        self.assertEqual(snapshot.norms.tolist(), [2, 1, 1])
+        with self.assertRaises(ValueError):
+            self.store.upsert([('d', [1, 2, 3])])
+
+        old_snapshot = snapshot
+        self.assertEqual(self.store.rebuild([('d', [1, 2, 3])]), 1)
+        snapshot = reader.reload()
+        self.assertEqual((snapshot.ids, snapshot.dim), (['d'], 3))
+        # Previously mapped files stay readable
+        self.assertEqual(old_snapshot.matrix[1].tolist(), [1, 0])
+
+    def test_posting_vectors_from_store(self):
+        vectors = {}
+        for i in range(3):
+            vectors[str(i)] = np.full(Profile.VECTOR_LEN, i + 1, dtype=np.float32)
+            posting = Posting(pk=str(i), num_employees=3)
+            posting.set_vector(vectors[str(i)])
+            posting.save()
+        self.store.upsert([('0', vectors['0']), ('2', vectors['2'])])
+
+        candidates = PostingVectors.from_postings(Posting.objects.all(), self.store.reload())
+        self.assertEqual(sorted(candidates.ids), ['0', '1', '2'])
+        for posting_id, vector, norm in zip(candidates.ids, candidates.matrix, candidates.norms):
+            np.testing.assert_array_equal(vector, vectors[posting_id])
+            self.assertAlmostEqual(norm, np.linalg.norm(vectors[posting_id]), places=2)
+
+    def test_lsh_index(self):
+        rng = np.random.RandomState(1)
+        vectors = rng.standard_normal((500, 32)).astype(np.float32)
+        self.store.upsert([(str(i), v) for i, v in enumerate(vectors[:400])])
+        index = LSHIndex(num_tables=4, num_bits=6).update(self.store.reload())
+        self.assertEqual(index.num_rows, 400)
+
+        # Incremental inserts only hash the appended rows
+        self.store.upsert([(str(i), v) for i, v in enumerate(vectors[400:], 400)])
+        index.update(self.store.reload())
+        self.assertEqual(index.num_rows, 500)
+
+        query = vectors[450] + rng.standard_normal(32).astype(np.float32) * 0.1
+        ids, scores = index.search(query, 5)
+        self.assertEqual(ids[0], '450')
+        self.assertEqual(len(ids), 5)
+        self.assertTrue((np.diff(scores) <= 0).all())
+        self.assertLess(len(index.get_candidates(index.tables, query, 5)), 500)
+
+        # A new generation gets new tables, searches holding the old ones are unaffected
+        tables = index.tables
+        self.store.upsert([('0', vectors[1])])
+        index.update(self.store.reload())
+        self.assertIsNot(index.tables.buckets, tables.buckets)
+        np.testing.assert_array_equal(tables.snapshot.matrix[0], vectors[0])
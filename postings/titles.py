@@ -0,0 +1,80 @@
+from constants import TITLE_VECTOR_STORE_DIR, SEMANTIC_TITLE_MIN_SIMILARITY
+from utils.glove import glove
+from .ranking import top_k
+from .tokens import tokenize
+from .vector_store import PostingVectorStore
+import numpy as np
+import logging
+
+logger = logging.getLogger('app')
+
+# Title embeddings of postings, rows are WORD_EMBEDDING_LEN floats
+title_vector_store = PostingVectorStore(TITLE_VECTOR_STORE_DIR)
+
+def embed_titles(titles):
+    """Returns the averaged GloVe embeddings of the words of each title
+
+    Titles are lowercased and split on punctuation since the vocabulary is lowercase.
+
+    Returns:
+        np.ndarray: float32 array of shape (len(titles), WORD_EMBEDDING_LEN)
+    """
+    return glove.get_mean_embeddings([' '.join(tokenize(t)) for t in titles])
+
+def iter_title_vectors(postings, batch_size=1000):
+    """Yields (id, title embedding) of every posting of a queryset with a known title word"""
+    batch = []
+    for posting_id, title in postings.values_list('id', 'title').iterator():
+        batch.append((posting_id, title))
+        if len(batch) == batch_size:
+            yield from get_title_vectors(batch)
+            batch = []
+    yield from get_title_vectors(batch)
+
+def get_title_vectors(postings):
+    if not postings:
+        return []
+    vectors = embed_titles([title for _, title in postings])
+    return [(posting_id, vector) for (posting_id, _), vector in zip(postings, vectors)
+            if vector.any()]
+
+def sync_title_vectors(postings):
+    """Adds the title embeddings of newly ingested or updated postings to the store
+
+    Parameters:
+        postings (List (Posting)): the postings
+    """
+    title_vector_store.upsert(get_title_vectors([(p.id, p.title) for p in postings]))
+
+def search_titles(title, k, min_similarity=SEMANTIC_TITLE_MIN_SIMILARITY, snapshot=None,
+                  posting_ids=None):
+    """Returns the postings whose titles are the most similar to title
+
+    The embedding of title is compared to every candidate title embedding at once.
+
+    Parameters:
+        title (str): the searched title
+        k (int): max number of postings returned
+        min_similarity (float): min cosine similarity of returned titles
+        snapshot (VectorStoreSnapshot): title store to search, the latest one if not given
+        posting_ids (Iterable (str)): only search the titles of these postings, every
+            stored title if not given
+
+    Returns:
+        (List (str), np.ndarray): posting ids, most similar first, and their similarity
+    """
+    if snapshot is None:
+        snapshot = title_vector_store.reload()
+    query = embed_titles([title])[0]
+    if len(snapshot) == 0 or not query.any() or len(query) != snapshot.dim:
+        return [], np.empty(0, dtype=np.float32)
+
+    if posting_ids is None:
+        ids, matrix, norms = snapshot.ids, snapshot.matrix, snapshot.norms
+    else:
+        rows, ids, _ = snapshot.get_rows(posting_ids)
+        matrix, norms = snapshot.matrix[rows], snapshot.norms[rows]
+    rows, scores = top_k(query, matrix, norms, k)
+    keep = scores >= min_similarity
+    logger.info("{} titles similar to {}".format(keep.sum(), title))
+    return [ids[r] for r in rows[keep]], scores[keep]
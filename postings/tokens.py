@@ -0,0 +1,16 @@
+import re
+
+TOKEN_MAX_LEN = 32
+
+def tokenize(s):
+    """Splits a string into lowercase alphanumeric tokens, without duplicates
+
+    Returns:
+        List (str): the tokens in order of first appearance
+    """
+    tokens = []
+    for token in re.findall(r'\w+', s.lower()):
+        token = token[:TOKEN_MAX_LEN]
+        if token not in tokens:
+            tokens.append(token)
+    return tokens
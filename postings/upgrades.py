@@ -0,0 +1,93 @@
+from datetime import date, timedelta
+from profiles.models import Profile, VectorProjection
+from profiles.vectorize import prefetch_profiles, vectorize_profiles
+from .models import Posting, CompanyTitleVector
+from django.db import transaction
+from .vector_store import sync_posting_vectors
+from .result_cache import invalidate_cities, get_invalidated_cities
+import numpy as np
+import logging
+
+logger = logging.getLogger('app')
+
+def upgrade_posting_vectors(num_prev_days=30):
+    """Folds the profiles stored since postings were ingested into their vectors
+
+    Postings that had less than 3 matched employees are matched against the profiles
+    now in the database, and the new employees are added to their running sums.
+    Postings reaching 3 employees get a vector and are added to the vector stores.
+    The new employees are also folded into the CompanyTitleVector of their company and
+    title, so postings ingested later reuse them. Profiles are read once per search
+    title, not once per posting.
+
+    Parameters:
+        num_prev_days (int): only postings posted in the last num_prev_days days
+
+    Returns:
+        List (Posting): the postings that got a vector
+    """
+    postings = Posting.objects.filter(num_employees__gte=0, num_employees__lt=3,
+        date_posted__gt=date.today() - timedelta(days=num_prev_days)).exclude(search_title='')
+    postings_by_title = {}
+    for posting in postings:
+        postings_by_title.setdefault(posting.search_title, []).append(posting)
+
+    projection = VectorProjection.get_active()
+    upgraded = []
+    # New employee profiles and vectors by normalized company and title
+    aggregate_employees = {}
+    for search_title, title_postings in postings_by_title.items():
+        profiles = list(Profile.objects.filter(experience__title__icontains=search_title)
+            .distinct())
+        if not profiles:
+            continue
+        prefetch_profiles(profiles)
+
+        employee_ids = {}
+        for posting_id, profile_id in Posting.employees.through.objects.filter(
+                posting__in=title_postings).values_list('posting_id', 'profile_id'):
+            employee_ids.setdefault(posting_id, set()).add(profile_id)
+
+        for posting in title_postings:
+            new_employees = []
+            exp_start_dates = []
+            for profile in profiles:
+                if profile.pk in employee_ids.get(posting.pk, ()):
+                    continue
+                exp_start_date = profile.get_experience_start_date(posting.company,
+                    search_title)
+                if exp_start_date:
+                    new_employees.append(profile)
+                    exp_start_dates.append(exp_start_date)
+            if not new_employees:
+                continue
+
+            vectors = vectorize_profiles(new_employees, exp_start_dates)
+            posting.add_employee_vectors(vectors, projection)
+            # Only the vector fields changed, so the tokens aren't reindexed
+            posting.save(update_fields=['vector', 'vector_norm', 'reduced_vector',
+                'projection_version', 'vector_sum', 'num_employees'])
+            posting.employees.add(*new_employees)
+            logger.info("Added {} employees to {}, {} total".format(len(new_employees),
+                posting.pk, posting.num_employees))
+            if posting.num_employees >= 3:
+                upgraded.append(posting)
+            aggregate_employees.setdefault(
+                (CompanyTitleVector.normalize(posting.company), search_title), {}) \
+                .update((p.pk, (p, v)) for p, v in zip(new_employees, vectors))
+
+    for (company, search_title), employees in aggregate_employees.items():
+        with transaction.atomic():
+            aggregate = CompanyTitleVector.get_for_update(company, search_title)
+            if aggregate is None:
+                continue
+            known_ids = set(aggregate.employees.values_list('pk', flat=True))
+            new = [employees[pk] for pk in employees if pk not in known_ids]
+            if new:
+                aggregate.add_employees([p for p, _ in new], np.array([v for _, v in new]))
+
+    if upgraded:
+        sync_posting_vectors(upgraded)
+        invalidate_cities(get_invalidated_cities(upgraded))
+    logger.info("Upgraded {} of {} postings".format(len(upgraded), len(postings)))
+    return upgraded
@@ -0,0 +1,360 @@
+from contextlib import contextmanager
+from constants import POSTING_VECTOR_STORE_DIR, REDUCED_POSTING_VECTOR_STORE_DIR
+from profiles.models import VectorProjection
+from utils.vector_encoding import decode_vector
+import numpy as np
+import fcntl
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger('app')
+
+DTYPE = np.dtype('<f4')
+
+class VectorStoreSnapshot:
+    """Immutable snapshot of the store, safe to read while the store reloads"""
+    def __init__(self, generation, dim, ids, matrix, norms):
+        self.generation = generation
+        self.dim = dim
+        self.ids = ids
+        self.rows = {posting_id: row for row, posting_id in enumerate(ids)}
+        self.matrix = matrix
+        self.norms = norms
+
+    def empty():
+        return VectorStoreSnapshot(0, 0, [], np.empty((0, 0), dtype=DTYPE), np.empty(0, dtype=DTYPE))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def get_rows(self, posting_ids):
+        """Returns the rows of the given postings
+
+        Returns:
+            (np.ndarray, List (str), List (str)): rows of the postings in the store, their
+                ids, and the ids of the postings not in the store
+        """
+        rows = []
+        found_ids = []
+        missing_ids = []
+        for posting_id in posting_ids:
+            row = self.rows.get(posting_id)
+            if row is None:
+                missing_ids.append(posting_id)
+            else:
+                rows.append(row)
+                found_ids.append(posting_id)
+        return np.array(rows, dtype=np.intp), found_ids, missing_ids
+
+class PostingVectorStore:
+    """Posting vectors in one contiguous float32 matrix file, memory-mapped read only
+
+    Files in the store directory:
+        index.json: generation, vector dimension and posting ids in row order
+        vectors-<generation>.f32: raw float32 matrix, row i is the vector of ids[i]
+        norms-<generation>.f32: L2 norm of every row
+
+    Writers append rows, then atomically replace index.json. Readers only map the rows
+    listed in the index they loaded, so a partially written append is never read.
+    Updating existing rows or rebuilding writes a new generation instead of modifying
+    mapped files, so readers keep using the files they mapped until they reload.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.index_token = None
+        self.snapshot = VectorStoreSnapshot.empty()
+
+    def get_path(self, name):
+        return os.path.join(self.directory, name)
+
+    def map_file(self, name, shape, mode='r'):
+        if shape[0] == 0:
+            return np.empty(shape, dtype=DTYPE)
+        return np.memmap(self.get_path(name), dtype=DTYPE, mode=mode, shape=shape)
+
+    def reload(self):
+        """Maps the latest version of the store if index.json changed since the last call
+
+        Cheap enough to call before every read, it only stats index.json.
+
+        Returns:
+            VectorStoreSnapshot: snapshot of the store
+        """
+        try:
+            stat = os.stat(self.get_path('index.json'))
+            token = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            token = None
+        if token == self.index_token:
+            return self.snapshot
+
+        with self.lock:
+            if token is None:
+                self.snapshot = VectorStoreSnapshot.empty()
+            else:
+                with open(self.get_path('index.json'), 'r') as f:
+                    index = json.load(f)
+                generation, dim, ids = index['generation'], index['dim'], index['ids']
+                self.snapshot = VectorStoreSnapshot(generation, dim, ids,
+                    self.map_file(self.vectors_name(generation), (len(ids), dim)),
+                    self.map_file(self.norms_name(generation), (len(ids),)))
+            self.index_token = token
+        return self.snapshot
+
+    def vectors_name(self, generation):
+        return 'vectors-{}.f32'.format(generation)
+
+    def norms_name(self, generation):
+        return 'norms-{}.f32'.format(generation)
+
+    @contextmanager
+    def write_lock(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.get_path('.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def write_index(self, generation, dim, ids):
+        index_path = self.get_path('index.json')
+        with open(index_path + '.tmp', 'w') as f:
+            json.dump({'generation': generation, 'dim': dim, 'ids': ids}, f)
+        os.replace(index_path + '.tmp', index_path)
+
+    def upsert(self, postings):
+        """Appends new posting vectors, and replaces the rows of existing ones
+
+        Appending is cheap. Replacing rows copies the store to a new generation, so
+        snapshots being read are never modified.
+
+        Parameters:
+            postings (List ((str, np.ndarray))): posting ids and their vectors
+
+        Returns:
+            int: number of rows appended
+        """
+        postings = list(postings)
+        if not postings:
+            return 0
+
+        with self.write_lock():
+            current = self.reload()
+            generation = current.generation
+            dim = current.dim if len(current) else len(postings[0][1])
+            ids = list(current.ids)
+            rows = dict(current.rows)
+
+            new_ids = []
+            new_vectors = []
+            updated_rows = []
+            updated_vectors = []
+            for posting_id, vector in postings:
+                if len(vector) != dim:
+                    raise ValueError("Vector of {} has length {}, the store has {}. "
+                        "Rebuild the store with `python manage.py build_posting_vectors`."
+                        .format(posting_id, len(vector), dim))
+                if posting_id in rows:
+                    updated_rows.append(rows[posting_id])
+                    updated_vectors.append(vector)
+                else:
+                    rows[posting_id] = len(ids)
+                    ids.append(posting_id)
+                    new_ids.append(posting_id)
+                    new_vectors.append(vector)
+
+            if updated_rows:
+                self.write_generation(current, rows=updated_rows, vectors=updated_vectors,
+                    new_vectors=new_vectors, ids=ids)
+            elif new_ids:
+                new_vectors = np.array(new_vectors, dtype=DTYPE)
+                # Truncate rows of an interrupted append that never made it to the index
+                for name, row_size in [(self.vectors_name(generation), dim),
+                                       (self.norms_name(generation), 1)]:
+                    with open(self.get_path(name), 'ab') as f:
+                        f.truncate(len(current) * row_size * DTYPE.itemsize)
+                with open(self.get_path(self.vectors_name(generation)), 'ab') as f:
+                    new_vectors.tofile(f)
+                with open(self.get_path(self.norms_name(generation)), 'ab') as f:
+                    np.linalg.norm(new_vectors, axis=1).astype(DTYPE).tofile(f)
+                self.write_index(generation, dim, ids)
+
+        self.reload()
+        logger.info("Posting vector store: appended {}, updated {}, {} total".format(
+            len(new_ids), len(updated_rows), len(ids)))
+        return len(new_ids)
+
+    def write_generation(self, current, rows, vectors, new_vectors, ids):
+        """Writes a copy of current with rows replaced and new rows appended
+
+        Must be called with the write lock held.
+
+        Parameters:
+            current (VectorStoreSnapshot): the latest snapshot
+            rows (List (int)): rows of current to replace
+            vectors (List (np.ndarray)): their new vectors
+            new_vectors (List (np.ndarray)): vectors of the rows to append
+            ids (List (str)): posting ids of the new generation in row order
+        """
+        generation = current.generation + 1
+        replaced = dict(zip(rows, vectors))
+        with open(self.get_path(self.vectors_name(generation)), 'wb') as vectors_file, \
+                open(self.get_path(self.norms_name(generation)), 'wb') as norms_file:
+            # Copied in chunks to bound memory
+            for start in range(0, len(current), 4096):
+                chunk = np.array(current.matrix[start:start + 4096], dtype=DTYPE)
+                norms = np.array(current.norms[start:start + 4096], dtype=DTYPE)
+                for row in range(start, start + len(chunk)):
+                    if row in replaced:
+                        chunk[row - start] = replaced[row]
+                        norms[row - start] = np.linalg.norm(chunk[row - start])
+                chunk.tofile(vectors_file)
+                norms.tofile(norms_file)
+            if new_vectors:
+                new_vectors = np.array(new_vectors, dtype=DTYPE)
+                new_vectors.tofile(vectors_file)
+                np.linalg.norm(new_vectors, axis=1).astype(DTYPE).tofile(norms_file)
+        self.write_index(generation, current.dim, ids)
+
+        # Readers keep the old files mapped until they reload
+        for name in [self.vectors_name(current.generation),
+                     self.norms_name(current.generation)]:
+            if os.path.exists(self.get_path(name)):
+                os.remove(self.get_path(name))
+
+    def rebuild(self, postings):
+        """Replaces the store with the given posting vectors
+
+        Parameters:
+            postings (Iterable ((str, np.ndarray))): posting ids and their vectors
+
+        Returns:
+            int: number of rows written
+        """
+        with self.write_lock():
+            current = self.reload()
+            old_generation = current.generation if self.index_token else None
+            generation = current.generation + 1
+            ids = []
+            dim = None
+            with open(self.get_path(self.vectors_name(generation)), 'wb') as vectors_file, \
+                    open(self.get_path(self.norms_name(generation)), 'wb') as norms_file:
+                for posting_id, vector in postings:
+                    vector = np.asarray(vector, dtype=DTYPE)
+                    if dim is None:
+                        dim = len(vector)
+                    elif len(vector) != dim:
+                        logger.warning("Skipping vector of {} with length {}".format(
+                            posting_id, len(vector)))
+                        continue
+                    vector.tofile(vectors_file)
+                    np.array([np.linalg.norm(vector)], dtype=DTYPE).tofile(norms_file)
+                    ids.append(posting_id)
+            self.write_index(generation, dim or 0, ids)
+
+            # Readers keep the old files mapped until they reload
+            if old_generation is not None:
+                for name in [self.vectors_name(old_generation), self.norms_name(old_generation)]:
+                    if os.path.exists(self.get_path(name)):
+                        os.remove(self.get_path(name))
+
+        self.reload()
+        logger.info("Rebuilt posting vector store with {} postings".format(len(ids)))
+        return len(ids)
+
+posting_vector_store = PostingVectorStore(POSTING_VECTOR_STORE_DIR)
+reduced_posting_vector_stores = {}
+
+def get_posting_vector_store(projection=None):
+    """Returns the store of the posting vectors, or of their reduced vectors
+
+    Parameters:
+        projection (VectorProjection): projection of the reduced vectors
+    """
+    if projection is None:
+        return posting_vector_store
+    store = reduced_posting_vector_stores.get(projection.pk)
+    if store is None:
+        store = PostingVectorStore(os.path.join(REDUCED_POSTING_VECTOR_STORE_DIR,
+            str(projection.pk)))
+        reduced_posting_vector_stores[projection.pk] = store
+    return store
+
+def get_posting_vectors(projection=None):
+    """Returns the latest snapshot of the posting vector store"""
+    return get_posting_vector_store(projection).reload()
+
+def read_posting_vectors(postings, projection=None):
+    """Yields (id, vector, norm) of every posting of a queryset, reading one blob each
+
+    Postings whose vector can't be decoded are logged and left out.
+
+    Parameters:
+        postings (QuerySet): postings with vectors
+        projection (VectorProjection): yields the reduced vectors of this projection
+            instead. Full vectors are only read for the postings that weren't projected
+            yet.
+
+    Yields:
+        (str, np.ndarray, float): posting id, vector and its stored norm, None if the
+            norm isn't stored
+    """
+    if projection is None:
+        for posting_id, vector, vector_norm in \
+                postings.values_list('id', 'vector', 'vector_norm').iterator():
+            try:
+                yield posting_id, decode_vector(vector), vector_norm
+            except ValueError:
+                logger.warning("Couldn't decode vector of {}".format(posting_id))
+        return
+
+    unprojected_ids = []
+    for posting_id, reduced_vector, projection_version in postings.values_list(
+            'id', 'reduced_vector', 'projection_version').iterator():
+        if not reduced_vector or projection_version != projection.pk:
+            unprojected_ids.append(posting_id)
+            continue
+        try:
+            yield posting_id, decode_vector(reduced_vector), None
+        except ValueError:
+            logger.warning("Couldn't decode reduced vector of {}".format(posting_id))
+
+    # Chunked to stay under the SQLite limit of query parameters
+    for i in range(0, len(unprojected_ids), 500):
+        for posting_id, vector in postings.filter(
+                pk__in=unprojected_ids[i:i + 500]).values_list('id', 'vector'):
+            try:
+                yield posting_id, projection.project(decode_vector(vector)), None
+            except ValueError:
+                logger.warning("Couldn't decode vector of {}".format(posting_id))
+
+def iter_posting_vectors(postings, projection=None):
+    """Yields (id, vector) of every posting of a queryset that has a vector
+
+    Parameters:
+        postings (QuerySet): the postings
+        projection (VectorProjection): yields the reduced vectors of this projection
+            instead, projecting the ones that weren't yet
+    """
+    for posting_id, vector, _ in read_posting_vectors(
+            postings.filter(num_employees__gte=3).exclude(vector=b''), projection):
+        yield posting_id, vector
+
+def sync_posting_vectors(postings):
+    """Adds the vectors of newly ingested or updated postings to the store
+
+    Parameters:
+        postings (List (Posting)): postings, the ones without vectors are skipped
+    """
+    postings = [p for p in postings if p.num_employees >= 3 and p.vector]
+    if postings:
+        posting_vector_store.upsert([(p.id, p.get_vector()) for p in postings])
+
+    projection = VectorProjection.get_active()
+    if projection is not None and postings:
+        get_posting_vector_store(projection).upsert(
+            [(p.id, p.get_reduced_vector(projection)) for p in postings])
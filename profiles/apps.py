@@ -3,4 +3,7 @@ from django.apps import AppConfig
 
 class ProfilesConfig(AppConfig):
     name = 'profiles'
-    
\ No newline at end of file
+
+    def ready(self):
+        # Connects the signal receivers
+        from . import signals
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from utils.glove import convert_glove, get_store_paths, is_store_current
+from constants import GLOVE_FILE
+
+class Command(BaseCommand):
+    help = 'Converts the GloVe text file into a memory-mappable binary store ' \
+        + 'Ex: python manage.py convert_glove data/filtered.glove.6B.50d.txt'
+
+    def add_arguments(self, parser):
+        parser.add_argument('glove_file', nargs='?', type=str, default=GLOVE_FILE)
+        parser.add_argument('--force', action='store_true',
+            help='Convert even if the binary store is up to date')
+
+    def handle(self, *args, **options):
+        glove_file = options['glove_file']
+        if not options['force'] and is_store_current(glove_file):
+            print("Binary store for {} is up to date".format(glove_file))
+            return
+
+        num_words = convert_glove(glove_file)
+        matrix_file, vocab_file = get_store_paths(glove_file)
+        print("Converted {} words into {} and {}".format(num_words, matrix_file, vocab_file))
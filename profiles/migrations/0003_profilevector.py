@@ -0,0 +1,27 @@
+# Generated by Django 3.0.3 on 2026-10-18 17:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles', '0002_auto_20200214_0111'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfileVector',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('simulation_date', models.DateField()),
+                ('version', models.IntegerField(default=1)),
+                ('vector', models.BinaryField()),
+                ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='profiles.Profile')),
+            ],
+            options={
+                'unique_together': {('profile', 'simulation_date', 'version')},
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.0.3 on 2026-10-18 17:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles', '0003_profilevector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VectorProjection',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('input_len', models.IntegerField()),
+                ('dims', models.IntegerField()),
+                ('components', models.BinaryField()),
+                ('explained_variance', models.FloatField(default=0)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -1,13 +1,14 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
 import numpy as np
 import sys
 from .representations import ExperienceRepresentation, SkillRepresentation
 from utils.glove import glove
 from constants import *
 from .schools import School
+from utils.vector_encoding import encode_vector, decode_vector
 
 class Profile(models.Model):
-    VECTOR_LEN = SKILLS_LEN + EDUCATION_VECTOR_LEN + EXPERIENCE_VECTOR_LEN
+    VECTOR_LEN = PROFILE_VECTOR_LEN
     
     username = models.CharField(max_length=100, default = "", primary_key=True)
     name = models.CharField(max_length=128, default='', blank=True)
@@ -28,38 +29,83 @@ class Profile(models.Model):
             return url.split('/')[-2]
         return url.split('/')[-1]
     
-    def to_vector(self, profile_simulation_date):
+    def to_vector(self, profile_simulation_date, out=None):
         """Returns a numerical representation of profile
   
         Parameters: 
             profile_simulation_date (datetime.date): The date at which the profile is 
                 simulated.A component represents years since graduation, so a profile 
                 vector is dependent on the profile simulation date.
+            out (np.ndarray): float32 buffer of length Profile.VECTOR_LEN to write the
+                vector into, for example a row of a matrix. Allocated if not given.
           
         Returns:
-            List (int): representing the profile
+            np.ndarray: out, representing the profile
         """
-        education_vector = self.education_to_vector(profile_simulation_date)
+        if out is None:
+            out = np.empty(Profile.VECTOR_LEN, dtype=np.float32)
+        # No queries if the profile was prefetched, see vectorize_profiles. It isn't
+        # prefetched here, the cache would outlive changes to the experiences.
 
+        self.education_to_vector(profile_simulation_date,
+            out[EDUCATION_VECTOR_OFFSET:EXPERIENCE_VECTOR_OFFSET])
+
+        experiences = list(self.experience_set.all())
+        title_vectors = glove.get_string_embeddings(
+            [e.title for e in experiences], NUM_EXPERIENCE_TITLE_WORDS)
         exp_repr = ExperienceRepresentation(PREV_YEARS_LOOKUP)
-        for e in self.experience_set.all():
-            exp_repr.add_experience(e, profile_simulation_date)
-        experience_vector = exp_repr.to_vector()
+        for e, title_vector in zip(experiences, title_vectors):
+            exp_repr.add_experience(e, profile_simulation_date, title_vector)
+        exp_repr.to_vector(out[EXPERIENCE_VECTOR_OFFSET:SKILLS_VECTOR_OFFSET])
 
         skills_repr = SkillRepresentation(profile_simulation_date)
-        for e in self.experience_set.all():
+        for e in experiences:
             skills_repr.add_text(e.description, e.end_date)
         for edu in self.education_set.all():
             skills_repr.add_text(edu.description, edu.end_date)
-        skills_vector = skills_repr.to_vector()
+        skills_repr.to_vector(out[SKILLS_VECTOR_OFFSET:PROFILE_VECTOR_LEN])
 
-        return np.array(education_vector + experience_vector + skills_vector, dtype=np.float32)
+        return out
         
-    def education_to_vector(self, profile_simulation_date):
-        if len(self.education_set.all()) == 0:
-            return [0] * EDUCATION_VECTOR_LEN
+    def get_vector(self, profile_simulation_date):
+        """Returns the profile vector, computing and storing it only if it isn't stored
+
+        Stored vectors are deleted when the profile's experiences or educations change.
+
+        Parameters:
+            profile_simulation_date (datetime.date): The date at which the profile is simulated
+
+        Returns:
+            np.ndarray: read only float32 array, equal to to_vector(profile_simulation_date)
+        """
+        stored = self.profilevector_set.filter(simulation_date=profile_simulation_date,
+            version=PROFILE_VECTOR_VERSION).values_list('vector', flat=True).first()
+        if stored is not None:
+            return decode_vector(stored)
+
+        vector = self.to_vector(profile_simulation_date)
+        # Vectors of previous days or formats are never read again
+        self.profilevector_set.exclude(version=PROFILE_VECTOR_VERSION).delete()
+        self.profilevector_set.filter(simulation_date__lt=profile_simulation_date).delete()
+        try:
+            with transaction.atomic():
+                self.profilevector_set.create(simulation_date=profile_simulation_date,
+                    version=PROFILE_VECTOR_VERSION, vector=encode_vector(vector))
+        except IntegrityError:
+            # Stored by a concurrent request
+            pass
+        vector.setflags(write=False)
+        return vector
+
+    def education_to_vector(self, profile_simulation_date, out=None):
+        educations = list(self.education_set.all())
+        if len(educations) == 0:
+            if out is None:
+                out = np.empty(EDUCATION_VECTOR_LEN, dtype=np.float32)
+            out[:] = 0
+            return out
         else:
-            return self.education_set.all()[0].to_vector(profile_simulation_date)
+            return educations[0].to_vector(profile_simulation_date, out)
 
     def get_experience_start_date(self, company, title):
         for exp in self.experience_set.all():
@@ -90,6 +136,64 @@ class Profile(models.Model):
         return base
 
 
+class ProfileVector(models.Model):
+    """Materialized Profile.to_vector, see Profile.get_vector"""
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE)
+    simulation_date = models.DateField()
+    # Always set by get_vector, the default is the version of vectors stored before
+    # versions were introduced
+    version = models.IntegerField(default=1)
+    vector = models.BinaryField()
+
+    class Meta:
+        unique_together = ('profile', 'simulation_date', 'version')
+
+    def __str__(self):
+        return "{:20} {} v{}".format(self.profile_id, self.simulation_date, self.version)
+
+
+class VectorProjection(models.Model):
+    """Linear projection of profile and posting vectors to fewer dimensions
+
+    Fitted offline with `python manage.py fit_projection`, the id is the projection
+    version. Vectors projected with different versions can't be compared.
+    """
+    input_len = models.IntegerField()
+    dims = models.IntegerField()
+    components = models.BinaryField()
+    explained_variance = models.FloatField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+
+    # Decoded components of every projection loaded by this process
+    loaded_components = {}
+
+    def get_active():
+        """Returns the latest projection of profile vectors, None if none was fitted"""
+        return VectorProjection.objects.filter(input_len=Profile.VECTOR_LEN) \
+            .defer('components').order_by('-id').first()
+
+    def get_components(self):
+        components = VectorProjection.loaded_components.get(self.pk)
+        if components is None:
+            blob = VectorProjection.objects.filter(pk=self.pk) \
+                .values_list('components', flat=True).get()
+            components = decode_vector(blob).reshape(self.dims, self.input_len)
+            VectorProjection.loaded_components[self.pk] = components
+        return components
+
+    def project(self, vectors):
+        """Projects a vector, or a matrix of vectors in rows
+
+        Returns:
+            np.ndarray: float32 array with dims values per vector
+        """
+        return np.asarray(vectors, dtype=np.float32).dot(self.get_components().T)
+
+    def __str__(self):
+        return "v{} {} -> {} dims, {:.1%} explained".format(
+            self.pk, self.input_len, self.dims, self.explained_variance)
+
+
 class Experience(models.Model):
     profile = models.ForeignKey(Profile, on_delete=models.CASCADE)
     company = models.CharField(max_length=128, default='')
@@ -118,30 +222,37 @@ class Education(models.Model):
     end_date = models.DateField(null=True, blank=True)
     is_current = models.BooleanField(null=True)
     
-    def to_vector(self, profile_simulation_date):
+    def to_vector(self, profile_simulation_date, out=None):
         """Returns a numerical representation of education
   
         Parameters: 
             profile_simulation_date (datetime.date): The date at which the profile is simulated.
                     A component represents years since graduation, so a profile vector is
                     dependent on the profile simulation date.
+            out (np.ndarray): float32 buffer of length EDUCATION_VECTOR_LEN to write the
+                    vector into. Allocated if not given.
           
         Returns:
-            List (int): representing the education
+            np.ndarray: out, representing the education
                         [school_vec, gpa, years_to_complete_degree, years_since_graduation,
                          field_of_study (3 * word_embedding)]
         """
-        school_vec = School(self.school_name).to_vector()
-        gpa = [self.gpa] if self.gpa else [0]
+        if out is None:
+            out = np.empty(EDUCATION_VECTOR_LEN, dtype=np.float32)
+
+        out[:SCHOOL_VEC_LEN] = School(self.school_name).to_vector()
+        out[SCHOOL_VEC_LEN] = self.gpa if self.gpa else 0
         if self.start_date:
-            years_to_complete_degree = [round((self.end_date - self.start_date).days / 365)]
-            years_since_graduation = [0] if self.is_current else [round((profile_simulation_date - self.end_date).days / 365)]
+            out[SCHOOL_VEC_LEN + 1] = round((self.end_date - self.start_date).days / 365)
+            out[SCHOOL_VEC_LEN + 2] = 0 if self.is_current else \
+                round((profile_simulation_date - self.end_date).days / 365)
         else:
-            years_to_complete_degree = [0]
-            years_since_graduation = [0]
-        field_of_study = glove.get_string_embedding(self.field_of_study, 3)
+            out[SCHOOL_VEC_LEN + 1] = 0
+            out[SCHOOL_VEC_LEN + 2] = 0
+        out[SCHOOL_VEC_LEN + 3:] = glove.get_string_embedding(
+            self.field_of_study, NUM_FIELD_OF_STUDY_WORDS)
 
-        return school_vec + gpa + years_to_complete_degree + years_since_graduation + field_of_study
+        return out
 
     def __str__(self):
         return "{:40}, {:40}, Start: {}".format(
@@ -0,0 +1,32 @@
+import numpy as np
+
+def fit_projection(vector_chunks, dims):
+    """Fits a linear projection that keeps most of the energy of the vectors
+
+    The projection is made of the top eigenvectors of the uncentered second moment
+    matrix (PCA without mean removal), so dot products and cosine similarities between
+    projected vectors approximate the ones between the original vectors. The vectors
+    are streamed in chunks so all of them never need to be in memory.
+
+    Parameters:
+        vector_chunks (Iterable (np.ndarray)): matrices of shape (n_i, d)
+        dims (int): number of dimensions to keep
+
+    Returns:
+        (np.ndarray, float): float32 components of shape (dims, d), and the fraction of
+            the energy of the vectors they keep
+    """
+    second_moment = None
+    for chunk in vector_chunks:
+        chunk = np.asarray(chunk, dtype=np.float64)
+        if second_moment is None:
+            second_moment = np.zeros((chunk.shape[1], chunk.shape[1]))
+        second_moment += chunk.T.dot(chunk)
+    if second_moment is None:
+        raise ValueError("No vectors to fit the projection on")
+
+    eigenvalues, eigenvectors = np.linalg.eigh(second_moment)
+    top = np.argsort(eigenvalues)[::-1][:dims]
+    total = eigenvalues.clip(min=0).sum()
+    kept = eigenvalues[top].clip(min=0).sum() / total if total > 0 else 0
+    return eigenvectors[:, top].T.astype(np.float32), float(kept)
@@ -1,5 +1,6 @@
 #from .models import Experience
 from datetime import date, timedelta
+import numpy as np
 from utils.glove import glove
 from .data.skills_one_hot import skills_one_hot
 from constants import *
@@ -7,16 +8,22 @@ from constants import *
 class SkillRepresentation:
     def __init__(self, profile_simulation_date):
         self.profile_simulation_date = profile_simulation_date
-        self.skills = [0] * len(skills_one_hot)
+        # Indices of the skills found
+        self.skills = set()
 
     def add_text(self, text, end_date):
         if end_date > self.profile_simulation_date:
             for w in text.lower().split():
                 if w in skills_one_hot:
-                    self.skills[skills_one_hot[w]] = 1
+                    self.skills.add(skills_one_hot[w])
 
-    def to_vector(self):
-        return self.skills
+    def to_vector(self, out=None):
+        """Writes the one hot skills vector into out, allocating it if not given"""
+        if out is None:
+            out = np.empty(SKILLS_LEN, dtype=np.float32)
+        out[:] = 0
+        out[list(self.skills)] = 1
+        return out
         
 class ExperienceRepresentation:
     def __init__(self, prev_years_lookup):
@@ -28,21 +35,43 @@ class ExperienceRepresentation:
         for i in range(prev_years_lookup + 1):
             self.exp_map[-i] = None
 
-    def to_vector(self):
-        res = []
+    def to_vector(self, out=None):
+        """Writes the experience vector into out, allocating it if not given
+
+        Parameters:
+            out (np.ndarray): contiguous float32 buffer of length
+                prev_years_lookup * EXPERIENCE_YEAR_VECTOR_LEN
+
+        Returns:
+            np.ndarray: out
+        """
+        if out is None:
+            out = np.empty(self.prev_years_lookup * EXPERIENCE_YEAR_VECTOR_LEN, dtype=np.float32)
+        years = out.reshape(self.prev_years_lookup, EXPERIENCE_YEAR_VECTOR_LEN)
+        years[:] = 0
         for i in range(self.prev_years_lookup):
-            if not self.exp_map[-i]:
-                res += [0] * EXPERIENCE_YEAR_VECTOR_LEN
-            else:
-                res += self.exp_map[-i]
-        return res
+            if self.exp_map[-i] is not None:
+                month_tenured, exp_vector = self.exp_map[-i]
+                years[i, 0] = month_tenured
+                years[i, 1:] = exp_vector
+        return out
+
+    def add_experience(self, exp, profile_simulation_date, exp_title_vector=None):
+        """Adds an experience to the representation
 
-    def add_experience(self, exp, profile_simulation_date):
+        Parameters:
+            exp (Experience): the experience
+            profile_simulation_date (datetime.date): The date at which the profile is simulated
+            exp_title_vector (np.ndarray): embedding of the experience title, computed if
+                not given. Callers embedding many titles should batch them with
+                glove.get_string_embeddings.
+        """
         latest_year = profile_simulation_date.year - self.prev_years_lookup
         lower_date_bound = date(latest_year, 1, 1)
 
         if exp.start_date < profile_simulation_date and exp.end_date >= lower_date_bound:
-            exp_title_vector = glove.get_string_embedding(exp.title, NUM_EXPERIENCE_TITLE_WORDS)
+            if exp_title_vector is None:
+                exp_title_vector = glove.get_string_embedding(exp.title, NUM_EXPERIENCE_TITLE_WORDS)
             delta_years_at_start = exp.start_date.year - profile_simulation_date.year
             delta_years_at_end = exp.end_date.year - profile_simulation_date.year
 
@@ -67,11 +96,11 @@ class ExperienceRepresentation:
     def update_year(self, start_month, end_month, delta_years, exp_vector):
         month_tenured = end_month - start_month + 1
         if self.should_set_experience(delta_years, month_tenured):
-            self.set_experience(delta_years, [month_tenured] + exp_vector)
+            self.set_experience(delta_years, (month_tenured, exp_vector))
 
     def should_set_experience(self, delta_years, exp_score):
         if delta_years <= 0 and -delta_years < self.prev_years_lookup and \
-                (self.exp_map[delta_years] == None or self.exp_map[delta_years][0] < exp_score):
+                (self.exp_map[delta_years] is None or self.exp_map[delta_years][0] < exp_score):
             return True
         return False
 
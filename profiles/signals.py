@@ -0,0 +1,9 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Experience, Education, ProfileVector
+
+@receiver([post_save, post_delete], sender=Experience)
+@receiver([post_save, post_delete], sender=Education)
+def invalidate_profile_vectors(sender, instance, **kwargs):
+    """Deletes the stored vectors of a profile when its experiences or educations change"""
+    ProfileVector.objects.filter(profile_id=instance.profile_id).delete()
@@ -2,9 +2,15 @@ from django.test import TestCase
 from .models import Profile
 from .scraper import LinkedInScraper
 import time
-from profiles.models import Profile, Education, Experience
+from profiles.models import Profile, Education, Experience, ProfileVector
 from datetime import date, datetime
 from .search import GoogleSearch
+from .vectorize import vectorize_profiles
+from utils.glove import Glove, LazyGlove, convert_glove, is_store_current
+from constants import *
+import numpy as np
+import os
+import tempfile
 
 class ProfileTestCase(TestCase):
     def setUp(self):
@@ -88,4 +94,177 @@ class ProfileTestCase(TestCase):
     #     education_vector = e.to_vector(date(2020,1,1))
     #     self.assertTrue(education_vector == [60.04, 0, 4, -1, 0.079084, -0.81504, 1.7901, 0.91653, 0.10797, -0.55628, -0.84427, -1.4951, 0.13418, 0.63627, 0.35146, 0.25813, -0.55029, 0.51056, 0.37409, 0.12092, -1.6166, 0.83653, 0.14202, -0.52348, 0.73453, 0.12207, -0.49079, 0.32533, 0.45306, -1.585, -0.63848, -1.0053, 0.10454, -0.42984, 3.181, -0.62187, 0.16819, -1.0139, 0.064058, 0.57844, -0.4556, 0.73783, 0.37203, -0.57722, 0.66441, 0.055129, 0.037891, 1.3275, 0.30991, 0.50697, 1.2357, 0.1274, -0.11434, 0.20709, -0.30847, 0.23461, 0.11819, 0.50325, -0.4622, 0.33465, -0.24591, -0.90292, 0.39837, -0.3622, 1.0792, 0.22552, -0.60442, -0.30231, -1.41, -0.22967, -0.075232, 1.8487, -0.23882, -0.21088, 1.3641, 0.4565, -0.75138, -1.007, -0.029306, -0.94489, -0.86208, -1.4729, -0.98162, 0.25306, 2.6589, -0.48034, 0.020104, -1.063, 0.71672, 0.5565, -0.42515, 1.3095, 1.4427, 0.51156, -0.022319, -1.0668, 0.39002, 0.16765, 0.045271, 0.2151, 0.49155, 0.78136, -0.31409, 0.05833, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0])
 
+class GloveTestCase(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.glove_file = os.path.join(self.dir.name, 'glove.txt')
+        with open(self.glove_file, 'w') as f:
+            f.write('computer ' + ' '.join(['0.5'] * WORD_EMBEDDING_LEN) + '\n')
+            f.write('science ' + ' '.join(['-1.25'] * WORD_EMBEDDING_LEN) + '\n')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_binary_store_matches_text(self):
+        text_glove = Glove(self.glove_file)
+        self.assertFalse(is_store_current(self.glove_file))
+
+        self.assertEqual(convert_glove(self.glove_file), 2)
+        self.assertTrue(is_store_current(self.glove_file))
+        binary_glove = Glove(self.glove_file)
+
+        for s in ['computer science', 'science unknown computer', '']:
+            self.assertEqual(text_glove.get_string_embedding(s, 3).tolist(),
+                binary_glove.get_string_embedding(s, 3).tolist())
+        self.assertEqual(binary_glove.get_string_embedding('science', 2).tolist(),
+            [-1.25] * WORD_EMBEDDING_LEN + [0] * WORD_EMBEDDING_LEN)
+
+    def test_batch_embeddings(self):
+        glove = Glove(self.glove_file)
+        strings = ['computer science', 'science', 'unknown words here', '']
+        embeddings = glove.get_string_embeddings(strings, 2)
+
+        self.assertEqual(embeddings.shape, (len(strings), 2 * WORD_EMBEDDING_LEN))
+        self.assertEqual(embeddings.dtype, np.float32)
+        for s, embedding in zip(strings, embeddings):
+            self.assertEqual(embedding.tolist(), glove.get_string_embedding(s, 2).tolist())
+        self.assertEqual(glove.get_string_embeddings([], 2).shape, (0, 2 * WORD_EMBEDDING_LEN))
+
+    def test_mean_embeddings(self):
+        glove = Glove(self.glove_file)
+        embeddings = glove.get_mean_embeddings(['computer science', 'science unknown', ''])
+        self.assertEqual(embeddings.shape, (3, WORD_EMBEDDING_LEN))
+        self.assertEqual(embeddings[0].tolist(), [-0.375] * WORD_EMBEDDING_LEN)
+        self.assertEqual(embeddings[1].tolist(), [-1.25] * WORD_EMBEDDING_LEN)
+        self.assertEqual(embeddings[2].tolist(), [0] * WORD_EMBEDDING_LEN)
+
+    def test_embedding_cache(self):
+        glove = Glove(self.glove_file, cache_size=2)
+        first = glove.get_string_embedding('computer  science extra', 2)
+        self.assertEqual(glove.cache.info(), {'hits': 0, 'misses': 1, 'size': 1, 'max_size': 2})
+
+        second = glove.get_string_embedding('computer science', 2)
+        self.assertEqual(first.tolist(), second.tolist())
+        self.assertEqual(glove.cache.hits, 1)
+
+        # Returned embeddings are copies, the cached one can't be mutated
+        second[:] = 0
+        self.assertEqual(glove.get_string_embedding('computer science', 2).tolist(), first.tolist())
+
+        # Duplicates within a batch are gathered once
+        glove.get_string_embeddings(['science', 'science', 'computer'], 2)
+        self.assertEqual(glove.cache.misses, 4)
+        self.assertEqual(glove.cache.info()['size'], 2)
+        self.assertNotIn(('computer science', 2), glove.cache.entries)
+
+    def test_lazy_glove(self):
+        lazy_glove = LazyGlove(self.glove_file)
+        self.assertFalse(lazy_glove.is_loaded())
+
+        embedding = lazy_glove.get_string_embedding('computer', 1)
+        self.assertTrue(lazy_glove.is_loaded())
+        self.assertEqual(embedding.tolist(), [0.5] * WORD_EMBEDDING_LEN)
+        self.assertIs(lazy_glove.warm_up(), lazy_glove.warm_up())
+
+class ProfileVectorTestCase(TestCase):
+    def setUp(self):
+        self.p = Profile.objects.create(username='test-profile', name='Test')
+        self.p.education_set.create(school_name='University of Toronto', degree='Bachelor',
+            field_of_study='computer science', gpa='3.3',
+            start_date=date(2016, 9, 1), end_date=date(2020, 5, 1), is_current=False)
+        self.p.experience_set.create(company='Microsoft', title='computer engineering',
+            description='agile', start_date=date(2019, 5, 1), end_date=date(2019, 8, 31),
+            is_current=False)
+        self.p.experience_set.create(company='Google', title='software',
+            description='python', start_date=date(2020, 6, 1), end_date=date(2021, 3, 1),
+            is_current=True)
+        self.simulation_date = date(2021, 1, 1)
+
+    def get_year_slot(self, vector, i):
+        start = EDUCATION_VECTOR_LEN + i * EXPERIENCE_YEAR_VECTOR_LEN
+        return vector[start:start + EXPERIENCE_YEAR_VECTOR_LEN]
+
+    def test_to_vector(self):
+        from utils.glove import glove
+        vector = np.asarray(self.p.to_vector(self.simulation_date))
+
+        self.assertEqual(vector.shape, (Profile.VECTOR_LEN,))
+        self.assertEqual(vector.dtype, np.float32)
+        np.testing.assert_allclose(vector[:4], [0.6004, 3.3, 4, 1], rtol=1e-6)
+        np.testing.assert_allclose(vector[4:EDUCATION_VECTOR_LEN],
+            glove.get_string_embedding('computer science', 3))
+
+        # Months worked in the current year and the two previous years
+        self.assertEqual([self.get_year_slot(vector, i)[0] for i in range(4)], [3, 7, 4, 0])
+        np.testing.assert_allclose(self.get_year_slot(vector, 1)[1:],
+            glove.get_string_embedding('software', NUM_EXPERIENCE_TITLE_WORDS))
+        np.testing.assert_allclose(self.get_year_slot(vector, 2)[1:],
+            glove.get_string_embedding('computer engineering', NUM_EXPERIENCE_TITLE_WORDS))
+
+        # Only skills of experiences that haven't ended are included
+        skills_vector = vector[EDUCATION_VECTOR_LEN + EXPERIENCE_VECTOR_LEN:]
+        self.assertEqual(len(skills_vector), SKILLS_LEN)
+        self.assertEqual(np.flatnonzero(skills_vector).tolist(), [12])
+
+    def test_to_vector_into_buffer(self):
+        expected = self.p.to_vector(self.simulation_date)
+
+        # Rows of a dirty matrix are fully overwritten in place
+        matrix = np.full((2, Profile.VECTOR_LEN), 7, dtype=np.float32)
+        res = self.p.to_vector(self.simulation_date, out=matrix[1])
+        self.assertTrue(np.shares_memory(res, matrix))
+        np.testing.assert_array_equal(matrix[1], expected)
+        self.assertTrue((matrix[0] == 7).all())
+
+    def test_get_vector(self):
+        vector = self.p.get_vector(self.simulation_date)
+        np.testing.assert_array_equal(vector, self.p.to_vector(self.simulation_date))
+        self.assertEqual(ProfileVector.objects.filter(profile=self.p).count(), 1)
+
+        with self.assertNumQueries(1):
+            stored = self.p.get_vector(self.simulation_date)
+        np.testing.assert_array_equal(stored, vector)
+
+        # A new day replaces the stored vector of the previous one
+        self.p.get_vector(date(2021, 1, 2))
+        self.assertEqual(list(ProfileVector.objects.values_list('simulation_date', flat=True)),
+            [date(2021, 1, 2)])
+
+    def test_get_vector_invalidation(self):
+        vector = self.p.get_vector(self.simulation_date)
+        exp = self.p.experience_set.get(company='Google')
+        exp.title = 'computer science'
+        exp.save()
+        self.assertFalse(ProfileVector.objects.exists())
+
+        # The same instance sees the change
+        updated = self.p.get_vector(self.simulation_date)
+        self.assertFalse(np.array_equal(updated, vector))
+        np.testing.assert_array_equal(updated,
+            Profile.objects.get(pk=self.p.pk).to_vector(self.simulation_date))
+        self.p.education_set.all().delete()
+        self.assertFalse(ProfileVector.objects.exists())
+
+    def test_vectorize_profiles(self):
+        for i in range(3):
+            p = Profile.objects.create(username='other-{}'.format(i))
+            p.experience_set.create(company='Google', title='software', description='python',
+                start_date=date(2019, 1, 1), end_date=date(2021, 6, 1), is_current=True)
+            p.education_set.create(school_name='', field_of_study='science',
+                start_date=date(2015, 9, 1), end_date=date(2019, 5, 1))
+
+        # One query for the profiles and one for each related set
+        with self.assertNumQueries(3):
+            matrix = vectorize_profiles(Profile.objects.order_by('username'),
+                self.simulation_date)
+
+        profiles = Profile.objects.order_by('username')
+        self.assertEqual(matrix.shape, (4, Profile.VECTOR_LEN))
+        for p, vector in zip(profiles, matrix):
+            np.testing.assert_array_equal(vector, p.to_vector(self.simulation_date))
+
+        dates = [date(2020, 1, 1), self.simulation_date]
+        matrix = vectorize_profiles(profiles[:2], dates)
+        np.testing.assert_array_equal(matrix[0], profiles[0].to_vector(dates[0]))
+
 # Create your tests here.
@@ -0,0 +1,35 @@
+from django.db.models import prefetch_related_objects
+from datetime import date
+import numpy as np
+from .models import Profile
+
+def prefetch_profiles(profiles):
+    """Loads the experiences and educations of all profiles in two queries
+
+    Profiles that were already prefetched are skipped.
+    """
+    prefetch_related_objects(profiles, 'experience_set', 'education_set')
+
+def vectorize_profiles(profiles, dates):
+    """Returns the vectors of many profiles with a constant number of queries
+
+    Parameters:
+        profiles (List (Profile) or QuerySet): profiles to vectorize
+        dates (datetime.date or List (datetime.date)): simulation date of all profiles,
+            or one simulation date per profile
+
+    Returns:
+        np.ndarray: float32 matrix of shape (len(profiles), Profile.VECTOR_LEN), row i
+            is the vector of profiles[i]
+    """
+    profiles = list(profiles)
+    if isinstance(dates, date):
+        dates = [dates] * len(profiles)
+    if len(dates) != len(profiles):
+        raise ValueError("Got {} dates for {} profiles".format(len(dates), len(profiles)))
+
+    prefetch_profiles(profiles)
+    matrix = np.empty((len(profiles), Profile.VECTOR_LEN), dtype=np.float32)
+    for i, (p, profile_simulation_date) in enumerate(zip(profiles, dates)):
+        p.to_vector(profile_simulation_date, out=matrix[i])
+    return matrix
@@ -1,37 +1,251 @@
 from constants import *
+from collections import OrderedDict
+import numpy as np
 import logging
-import sys
+import os
+import threading
 
 logger = logging.getLogger('app')
 
-class Glove:
-    def __init__(self, glove_file):
-        logger.info("Loading Glove Model")
-        f = open(glove_file,'r')
-        self.model = {}
+def get_store_paths(glove_file):
+    """Returns the paths of the binary store for a GloVe text file
+
+    Parameters:
+        glove_file (str): path to the GloVe text file
+
+    Returns:
+        (str, str): path to the float32 matrix (.npy) and to the vocabulary index
+    """
+    base = os.path.splitext(glove_file)[0]
+    return base + '.npy', base + '.vocab'
+
+def is_store_current(glove_file):
+    """Returns True if the binary store exists and is newer than the text file"""
+    matrix_file, vocab_file = get_store_paths(glove_file)
+    if not (os.path.exists(matrix_file) and os.path.exists(vocab_file)):
+        return False
+    text_mtime = os.path.getmtime(glove_file)
+    return os.path.getmtime(matrix_file) >= text_mtime \
+        and os.path.getmtime(vocab_file) >= text_mtime
+
+def read_glove_text(glove_file):
+    """Parses a GloVe text file
+
+    Returns:
+        (List (str), np.ndarray): the vocabulary and a float32 matrix of shape
+            (len(vocabulary) + 1, WORD_EMBEDDING_LEN). The last row is all zeros and
+            is used for words that are not in the vocabulary.
+    """
+    words = []
+    embeddings = []
+    with open(glove_file, 'r', encoding='utf-8') as f:
         for line in f:
             splitLine = line.split()
-            word = splitLine[0]
-            embedding = [float(val) for val in splitLine[1:]]
-            self.model[word] = embedding
-        
-        assert(WORD_EMBEDDING_LEN == len(self.model[word]))
-        logger.info("Done loading glove. {} words loaded!".format(len(self.model)))
+            if not splitLine:
+                continue
+            words.append(splitLine[0])
+            embeddings.append(splitLine[1:])
+
+    vectors = np.zeros((len(words) + 1, WORD_EMBEDDING_LEN), dtype=np.float32)
+    if words:
+        vectors[:-1] = np.array(embeddings, dtype=np.float32)
+    return words, vectors
+
+def convert_glove(glove_file):
+    """Writes the binary store of a GloVe text file next to it
+
+    The matrix is written with np.save so it can be memory-mapped, and the vocabulary
+    is written one word per line in row order.
+
+    Returns:
+        int: number of words converted
+    """
+    matrix_file, vocab_file = get_store_paths(glove_file)
+    words, vectors = read_glove_text(glove_file)
+
+    # Write to temporary files first so running workers never map a partial store
+    np.save(matrix_file + '.tmp.npy', vectors)
+    with open(vocab_file + '.tmp', 'w', encoding='utf-8') as f:
+        f.write('\n'.join(words))
+    os.replace(matrix_file + '.tmp.npy', matrix_file)
+    os.replace(vocab_file + '.tmp', vocab_file)
+    return len(words)
+
+class EmbeddingCache:
+    """Bounded least recently used cache of string embeddings
+
+    Keys are (normalized string, num_words), see get_key. A max_size of 0 disables
+    the cache.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get_key(s, num_words):
+        # Only the first num_words words are embedded, so whitespace and trailing
+        # words don't change the embedding
+        return ' '.join(s.split()[:num_words]), num_words
+
+    def get(self, key):
+        with self.lock:
+            embedding = self.entries.get(key)
+            if embedding is None:
+                self.misses += 1
+            else:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            return embedding
+
+    def put(self, key, embedding):
+        if self.max_size <= 0:
+            return
+        embedding.setflags(write=False)
+        with self.lock:
+            self.entries[key] = embedding
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self.entries), 'max_size': self.max_size}
+
+class Glove:
+    def __init__(self, glove_file, cache_size=EMBEDDING_CACHE_SIZE):
+        logger.info("Loading Glove Model")
+        self.cache = EmbeddingCache(cache_size)
+        if is_store_current(glove_file):
+            matrix_file, vocab_file = get_store_paths(glove_file)
+            # Memory-mapped read only, pages are shared between every process on the host
+            self.vectors = np.load(matrix_file, mmap_mode='r')
+            with open(vocab_file, 'r', encoding='utf-8') as f:
+                words = f.read().split('\n') if self.vectors.shape[0] > 1 else []
+        else:
+            logger.warning("No binary store for {}, parsing text file. "
+                "Run `python manage.py convert_glove` to speed up loading.".format(glove_file))
+            words, self.vectors = read_glove_text(glove_file)
+
+        assert(WORD_EMBEDDING_LEN == self.vectors.shape[1])
+        assert(len(words) + 1 == self.vectors.shape[0])
+        self.index = {w: i for i, w in enumerate(words)}
+        # Row of zeros used for unknown words and padding
+        self.unknown_index = len(words)
+        logger.info("Done loading glove. {} words loaded!".format(len(self.index)))
+
+    def get_word_indices(self, strings, num_words):
+        """Returns the embedding matrix rows of the first num_words words of each string
+
+        Strings with less than num_words words are padded with the row of zeros.
+
+        Returns:
+            np.ndarray: int array of shape (len(strings), num_words)
+        """
+        indices = np.full((len(strings), num_words), self.unknown_index, dtype=np.intp)
+        for i, s in enumerate(strings):
+            for j, w in enumerate(s.split()[:num_words]):
+                indices[i, j] = self.index.get(w, self.unknown_index)
+        return indices
+
+    def get_string_embeddings(self, strings, num_words):
+        """Embeds many strings with a single gather over the embedding matrix
+
+        Parameters:
+            strings (List (str)): strings to embed
+            num_words (int): number of words of each string to embed
+
+        Returns:
+            np.ndarray: float32 array of shape (len(strings), num_words * WORD_EMBEDDING_LEN)
+                where each row is the concatenated word embeddings of one string
+        """
+        res = np.empty((len(strings), num_words * WORD_EMBEDDING_LEN), dtype=np.float32)
+
+        # Rows of res waiting for each string that isn't cached
+        missing = OrderedDict()
+        for i, s in enumerate(strings):
+            key = EmbeddingCache.get_key(s, num_words)
+            embedding = self.cache.get(key)
+            if embedding is None:
+                missing.setdefault(key, []).append(i)
+            else:
+                res[i] = embedding
+
+        if missing:
+            indices = self.get_word_indices([key[0] for key in missing], num_words)
+            embeddings = self.vectors[indices].reshape(len(missing), -1)
+            for (key, rows), embedding in zip(missing.items(), embeddings):
+                res[rows] = embedding
+                self.cache.put(key, embedding.copy())
+
+        return res
 
     def get_string_embedding(self, s, num_words):
-        # Parse string
-        words = s.split()[:num_words]
-        
-        # Pad if less than num_words
-        padding = num_words - len(words)
-        words = words + [''] * padding
-        
-        res = []
-        for w in words:
-            res += self.model.get(w, [0] * WORD_EMBEDDING_LEN)
-        
+        return self.get_string_embeddings([s], num_words)[0]
+
+    def get_mean_embeddings(self, strings):
+        """Averages the embeddings of the known words of each string
+
+        Unlike get_string_embeddings, the result doesn't depend on word positions, so
+        'software engineer' and 'senior software engineer' embed close to each other.
+
+        Returns:
+            np.ndarray: float32 array of shape (len(strings), WORD_EMBEDDING_LEN), rows
+                of strings without known words are all zeros
+        """
+        res = np.zeros((len(strings), WORD_EMBEDDING_LEN), dtype=np.float32)
+        for i, s in enumerate(strings):
+            indices = [self.index[w] for w in s.split() if w in self.index]
+            if indices:
+                res[i] = self.vectors[indices].mean(axis=0)
         return res
 
-glove = Glove(GLOVE_FILE)
-# if any(command in sys.argv for command in ['runserver', 'Seekr.wsgi:application', 'ingest', 'shell', 'shell_plus']):
-#     glove = Glove(GLOVE_FILE)
\ No newline at end of file
+class LazyGlove:
+    """Proxy for the Glove model that loads it the first time an embedding is requested
+
+    Commands that never embed text (migrate, delete_profile_errors, tests) then skip the
+    load entirely. Processes that serve requests call warm_up() on start up instead.
+    """
+    def __init__(self, glove_file):
+        self.glove_file = glove_file
+        self.model = None
+        self.lock = threading.Lock()
+
+    def is_loaded(self):
+        return self.model is not None
+
+    def warm_up(self):
+        """Loads the model if it is not loaded yet
+
+        Returns:
+            Glove: the loaded model
+        """
+        if self.model is None:
+            with self.lock:
+                if self.model is None:
+                    self.model = Glove(self.glove_file)
+        return self.model
+
+    def get_string_embedding(self, s, num_words):
+        return self.warm_up().get_string_embedding(s, num_words)
+
+    def get_string_embeddings(self, strings, num_words):
+        return self.warm_up().get_string_embeddings(strings, num_words)
+
+    def get_mean_embeddings(self, strings):
+        return self.warm_up().get_mean_embeddings(strings)
+
+    def __getattr__(self, name):
+        # Only called for attributes not defined on the proxy
+        if name in ('glove_file', 'model', 'lock'):
+            raise AttributeError(name)
+        return getattr(self.warm_up(), name)
+
+glove = LazyGlove(GLOVE_FILE)
@@ -0,0 +1,56 @@
+import numpy as np
+import struct
+
+# Header of an encoded vector: magic, format version, dtype code, number of elements.
+# It is 8 bytes long so the data that follows stays aligned.
+HEADER = struct.Struct('<2sBcI')
+MAGIC = b'SV'
+FORMAT_VERSION = 1
+DTYPES = {
+    b'f': np.dtype('<f4'),
+}
+DTYPE_CODES = {dtype: code for code, dtype in DTYPES.items()}
+
+def encode_vector(vector, dtype=np.float32):
+    """Encodes a 1-d vector as a header followed by its raw little endian bytes
+
+    Parameters:
+        vector (np.ndarray): the vector
+        dtype (np.dtype): dtype to store the vector as
+
+    Returns:
+        bytes: the encoded vector
+    """
+    dtype = np.dtype(dtype).newbyteorder('<')
+    vector = np.ascontiguousarray(vector, dtype=dtype).reshape(-1)
+    return HEADER.pack(MAGIC, FORMAT_VERSION, DTYPE_CODES[dtype], len(vector)) \
+        + vector.tobytes()
+
+def is_encoded_vector(blob):
+    return blob is not None and len(blob) >= HEADER.size \
+        and bytes(blob[:len(MAGIC)]) == MAGIC
+
+def decode_vector(blob):
+    """Decodes a vector written by encode_vector without copying it
+
+    Parameters:
+        blob (bytes or memoryview): the encoded vector
+
+    Returns:
+        np.ndarray: read only view of the vector data in blob
+
+    Raises:
+        ValueError: if blob isn't a vector written by encode_vector
+    """
+    if not is_encoded_vector(blob):
+        raise ValueError("Not an encoded vector")
+    magic, version, dtype_code, length = HEADER.unpack_from(blob)
+    if version != FORMAT_VERSION:
+        raise ValueError("Unsupported vector format version {}".format(version))
+    if dtype_code not in DTYPES:
+        raise ValueError("Unsupported vector dtype {}".format(dtype_code))
+
+    dtype = DTYPES[dtype_code]
+    if len(blob) != HEADER.size + length * dtype.itemsize:
+        raise ValueError("Expected {} elements, got {} bytes".format(length, len(blob)))
+    return np.frombuffer(blob, dtype=dtype, count=length, offset=HEADER.size)